@@ -0,0 +1,200 @@
+"""
+Cache su disco ('dati/cache_cv/') dei punteggi di cross-validation per combinazione di
+iperparametri e fold: --find_models calcola solo le celle che mancano.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.stats import rankdata
+from sklearn.base import clone
+from sklearn.metrics import root_mean_squared_error
+from sklearn.utils.parallel import Parallel, delayed
+
+CARTELLA_CACHE = 'dati/cache_cv'
+
+# parametri che cambiano solo il numero di thread, non il risultato
+PARAMETRI_ESCLUSI = ('n_jobs', 'nthread', 'verbose', 'verbosity')
+
+_STATISTICHE = {'hit': 0, 'miss': 0}
+
+
+class RisultatoRicerca:
+    """Stessi attributi di GridSearchCV usati dai moduli *_train_and_test e da retrain_finale."""
+
+    def __init__(self, cv_results, best_index, best_estimator, refit_time):
+        self.cv_results_ = cv_results
+        self.best_index_ = best_index
+        self.best_params_ = cv_results['params'][best_index]
+        self.best_score_ = cv_results['mean_test_score'][best_index]
+        self.best_estimator_ = best_estimator
+        self.refit_time_ = refit_time
+
+
+def _sha256(*parti):
+    h = hashlib.sha256()
+    for parte in parti:
+        h.update(parte if isinstance(parte, bytes) else str(parte).encode('utf-8'))
+    return h.hexdigest()[:16]
+
+
+def _impronta_dati(X, y):
+    righe_X = pd.util.hash_pandas_object(X, index=False).to_numpy()
+    righe_y = pd.util.hash_pandas_object(pd.Series(np.asarray(y)), index=False).to_numpy()
+    return _sha256(json.dumps(list(X.columns)), righe_X.tobytes(), righe_y.tobytes())
+
+
+def _json_parametri(parametri):
+    parametri = {k: v for k, v in parametri.items() if k not in PARAMETRI_ESCLUSI}
+    return json.dumps(parametri, sort_keys=True, default=str)
+
+
+def _chiave_cella(parametri, indice_fold, train, test):
+    return _sha256(_json_parametri(parametri), indice_fold, len(train), train[0], train[-1], test[0], test[-1])
+
+
+def percorso_cache(stimatore, X, y):
+    return os.path.join(CARTELLA_CACHE, f'{type(stimatore).__name__}_{_impronta_dati(X, y)}.json')
+
+
+def _leggi(percorso):
+    if not os.path.exists(percorso):
+        return {}
+    with open(percorso, 'r') as f:
+        return json.load(f)
+
+
+def _scrivi(percorso, celle):
+    os.makedirs(CARTELLA_CACHE, exist_ok=True)
+    temporaneo = f'{percorso}.{os.getpid()}.tmp'
+    with open(temporaneo, 'w') as f:
+        json.dump(celle, f)
+    os.replace(temporaneo, percorso)
+
+
+def _valuta_fold(stimatore, parametri, X, y, train, test):
+    modello = clone(stimatore).set_params(**parametri)
+    t_start = time.perf_counter()
+    modello.fit(X.iloc[train], y.iloc[train])
+    tempo_fit = time.perf_counter() - t_start
+
+    t_start = time.perf_counter()
+    punteggio = -root_mean_squared_error(y.iloc[test], modello.predict(X.iloc[test]))
+    tempo_score = time.perf_counter() - t_start
+    return {'punteggio': float(punteggio), 'fit_s': tempo_fit, 'score_s': tempo_score}
+
+
+def stimatore_a_thread_singolo(stimatore, n_jobs):
+    """
+    Copia dello stimatore con un solo thread interno quando le valutazioni della ricerca
+    girano in parallelo (n_jobs diverso da None/1), così processi x thread resta nel budget.
+    """
+    if n_jobs in (None, 1) or 'n_jobs' not in stimatore.get_params():
+        return stimatore
+    return clone(stimatore).set_params(n_jobs=1)
+
+
+def ricerca_con_cache(stimatore, candidati, X, y, cv, n_jobs=None):
+    """
+    Valuta 'candidati' (lista di dizionari di iperparametri) con la cross-validation
+    'cv', calcolando solo le celle (combinazione, fold) assenti dalla cache, e
+    riaddestra la combinazione migliore su tutto (X, y).
+
+    n_jobs: processi per le celle da calcolare, come in GridSearchCV; con più processi
+    le celle usano lo stimatore a thread singolo, il riaddestramento quello originale.
+
+    Restituisce un RisultatoRicerca con cv_results_ nello stesso formato di GridSearchCV.
+    """
+    split = list(cv.split(X))
+    percorso = percorso_cache(stimatore, X, y)
+    celle = _leggi(percorso)
+    parametri_base = stimatore.get_params()
+
+    chiavi = []
+    mancanti = {}
+    for parametri in candidati:
+        chiavi_candidato = []
+        for indice_fold, (train, test) in enumerate(split):
+            chiave = _chiave_cella({**parametri_base, **parametri}, indice_fold, train, test)
+            if chiave not in celle:
+                mancanti.setdefault(chiave, (parametri, train, test))
+            chiavi_candidato.append(chiave)
+        chiavi.append(chiavi_candidato)
+
+    stimatore_celle = stimatore_a_thread_singolo(stimatore, n_jobs)
+    valutazioni = Parallel(n_jobs=n_jobs)(
+        delayed(_valuta_fold)(stimatore_celle, parametri, X, y, train, test)
+        for parametri, train, test in mancanti.values()
+    )
+    celle.update(zip(mancanti, valutazioni))
+
+    n_miss = len(mancanti)
+    n_hit = sum(len(c) for c in chiavi) - n_miss
+    risultati = [[celle[chiave] for chiave in chiavi_candidato] for chiavi_candidato in chiavi]
+
+    if n_miss:
+        _scrivi(percorso, celle)
+    _STATISTICHE['hit'] += n_hit
+    _STATISTICHE['miss'] += n_miss
+    print(f"   - Cache CV: {n_hit} fold riusati, {n_miss} calcolati")
+
+    punteggi = np.array([[cella['punteggio'] for cella in per_fold] for per_fold in risultati])
+    tempi_fit = np.array([[cella['fit_s'] for cella in per_fold] for per_fold in risultati])
+    tempi_score = np.array([[cella['score_s'] for cella in per_fold] for per_fold in risultati])
+
+    cv_results = {
+        'mean_fit_time': tempi_fit.mean(axis=1),
+        'std_fit_time': tempi_fit.std(axis=1),
+        'mean_score_time': tempi_score.mean(axis=1),
+        'std_score_time': tempi_score.std(axis=1),
+    }
+    nomi_parametri = list(dict.fromkeys(nome for parametri in candidati for nome in parametri))
+    for nome in nomi_parametri:
+        cv_results[f'param_{nome}'] = [parametri.get(nome) for parametri in candidati]
+    cv_results['params'] = list(candidati)
+    for indice_fold in range(len(split)):
+        cv_results[f'split{indice_fold}_test_score'] = punteggi[:, indice_fold]
+    cv_results['mean_test_score'] = punteggi.mean(axis=1)
+    cv_results['std_test_score'] = punteggi.std(axis=1)
+    cv_results['rank_test_score'] = rankdata(-punteggi.mean(axis=1), method='min').astype(np.int32)
+
+    best_index = int(np.argmin(cv_results['rank_test_score']))
+    t_start = time.perf_counter()
+    best_estimator = clone(stimatore).set_params(**candidati[best_index]).fit(X, y)
+    refit_time = time.perf_counter() - t_start
+
+    return RisultatoRicerca(cv_results, best_index, best_estimator, refit_time)
+
+
+def valori_memorizzati(stimatore, X, y, etichetta, elenco_parametri, calcola):
+    """
+    Valori di calcola(parametri) per ogni combinazione di 'elenco_parametri',
+    memorizzati nello stesso file di cache dei fold di (stimatore, X, y) sotto
+    'etichetta'. Serve ai passi della ricerca che non sono fold di CV (es. i round
+    scelti con l'early stopping); calcola deve restituire un valore serializzabile in JSON.
+    """
+    percorso = percorso_cache(stimatore, X, y)
+    celle = _leggi(percorso)
+    parametri_base = stimatore.get_params()
+
+    valori = []
+    n_nuovi = 0
+    for parametri in elenco_parametri:
+        chiave = _sha256(etichetta, _json_parametri({**parametri_base, **parametri}))
+        if chiave not in celle:
+            celle[chiave] = calcola(parametri)
+            n_nuovi += 1
+        valori.append(celle[chiave])
+
+    if n_nuovi:
+        _scrivi(percorso, celle)
+    return valori
+
+
+def ultime_statistiche():
+    """Fold riusati (hit) e calcolati (miss) dall'avvio del processo."""
+    return dict(_STATISTICHE)
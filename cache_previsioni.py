@@ -0,0 +1,138 @@
+"""
+Cache su disco ('dati/cache_previsioni/') delle previsioni annuali di cerca_con_a_star, con chiave
+(città, anno, hash del modello, impronta dei dati dell'ultimo anno).
+"""
+
+import glob
+import hashlib
+import os
+import time
+
+import numpy as np
+
+import gestore_modelli
+from dati import archivio_colonnare, gestore
+
+CARTELLA_CACHE = 'dati/cache_previsioni'
+
+_STATISTICHE = {
+    'hit': 0,
+    'miss': 0,
+    'tempo_lettura_s': 0.0,
+    'tempo_predizione_s': 0.0,
+}
+
+
+def _hash_file(percorso):
+    h = hashlib.sha256()
+    with open(percorso, 'rb') as f:
+        for blocco in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(blocco)
+    return h.hexdigest()[:16]
+
+
+def percorso_cache(citta, anno):
+    """
+    Percorso del file di cache per (città, anno) calcolato dagli input attuali,
+    oppure None se il modello o i dati dell'ultimo anno non sono disponibili.
+    """
+    modello_scelto = gestore_modelli.modello_scelto_citta(citta)
+    if not modello_scelto:
+        return None
+
+    file_modello = gestore_modelli.percorso_modello(modello_scelto, citta)
+    file_ultimo_anno = gestore.file_ultimo_anno(citta)
+    if not os.path.exists(file_modello) or file_ultimo_anno is None:
+        return None
+
+    impronta_ultimo_anno = archivio_colonnare.impronta(file_ultimo_anno)
+    nome_file = f'{citta}_{anno}_{modello_scelto}_{_hash_file(file_modello)}_{impronta_ultimo_anno}.npy'
+    return os.path.join(CARTELLA_CACHE, nome_file)
+
+
+def leggi_cache(citta, anno):
+    """
+    Array delle temperature previste letto (in memory-map) dalla cache,
+    oppure None se per la chiave attuale non esiste ancora una previsione.
+    """
+    percorso = percorso_cache(citta, anno)
+    if percorso is None or not os.path.exists(percorso):
+        return None
+
+    t_start = time.perf_counter()
+    previsioni = np.load(percorso, mmap_mode='r')
+    _STATISTICHE['tempo_lettura_s'] += time.perf_counter() - t_start
+    _STATISTICHE['hit'] += 1
+    return previsioni
+
+
+def calcola_previsioni(citta, anno):
+    """Ricalcola la previsione con il modello migliore della città e la salva in cache."""
+    _STATISTICHE['miss'] += 1
+    t_start = time.perf_counter()
+    previsioni = gestore_modelli.predici_array_temperature_anno_citta(citta, anno)
+    _STATISTICHE['tempo_predizione_s'] += time.perf_counter() - t_start
+
+    _salva(citta, anno, previsioni)
+    return previsioni
+
+
+def calcola_previsioni_gruppo(citta_list, anno):
+    """
+    Come calcola_previsioni per più città, restituendo { città: previsioni }: le città
+    che condividono un modello multi-città (es. 'globale') sono predette con un'unica predict.
+    """
+    _STATISTICHE['miss'] += len(citta_list)
+    t_start = time.perf_counter()
+    previsioni_citta = gestore_modelli.predici_array_temperature_anno_gruppo(citta_list, anno)
+    _STATISTICHE['tempo_predizione_s'] += time.perf_counter() - t_start
+
+    for citta, previsioni in previsioni_citta.items():
+        _salva(citta, anno, previsioni)
+    return previsioni_citta
+
+
+def _salva(citta, anno, previsioni):
+    percorso = percorso_cache(citta, anno)
+    if previsioni is not None and percorso is not None:
+        os.makedirs(CARTELLA_CACHE, exist_ok=True)
+        # Rimuoviamo le previsioni della stessa città/anno calcolate con input ormai superati
+        for vecchio in glob.glob(os.path.join(CARTELLA_CACHE, f'{citta}_{anno}_*.npy')):
+            os.remove(vecchio)
+        np.save(percorso, np.asarray(previsioni, dtype=np.float64))
+
+
+def previsioni_anno(citta, anno, aggiorna=False):
+    """
+    Restituisce l'array delle temperature previste per 'citta' nell'anno 'anno'
+    (indice 0 = 1 gennaio), leggendolo dalla cache se la chiave coincide.
+    Con aggiorna=True la previsione viene sempre ricalcolata e riscritta.
+    Restituisce None se la previsione non è calcolabile.
+    """
+    if not aggiorna:
+        previsioni = leggi_cache(citta, anno)
+        if previsioni is not None:
+            return previsioni
+
+    return calcola_previsioni(citta, anno)
+
+
+def statistiche():
+    return dict(_STATISTICHE)
+
+
+def azzera_statistiche():
+    for chiave in _STATISTICHE:
+        _STATISTICHE[chiave] = 0
+
+
+def unisci_statistiche(altre):
+    """Somma ai contatori locali quelli raccolti in un altro processo."""
+    for chiave in _STATISTICHE:
+        _STATISTICHE[chiave] += altre.get(chiave, 0)
+
+
+def stampa_statistiche():
+    s = _STATISTICHE
+    print(f"  - Cache previsioni: {s['hit']} hit, {s['miss']} miss "
+          f"(lettura {s['tempo_lettura_s']:.3f} s, predizione {s['tempo_predizione_s']:.3f} s)")
@@ -1,6 +1,11 @@
 import heapq
 import datetime
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import cache_previsioni
 import gestore_modelli
+import registro_modelli
 from datetime import date, timedelta
 import json
 
@@ -22,24 +27,85 @@ with open("colture.json", "r", encoding="utf-8") as file:
 # Dizionario globale: TEMPERATURE[citta] = [t_giorno_1, t_giorno_2, ... t_giorno_365]
 TEMPERATURE = {}
 
-def carica_dati_meteo(ANNO_TARGET, CITTA):
+def _prevedi_citta(citta, ANNO_TARGET):
+    # Eseguita in un processo worker: i contatori vengono azzerati e restituiti
+    # così che il processo principale possa sommarli ai propri.
+    cache_previsioni.azzera_statistiche()
+    registro_modelli.azzera_statistiche()
+
+    t_start = time.perf_counter()
+    predizioni = cache_previsioni.calcola_previsioni(citta, ANNO_TARGET)
+    tempo = time.perf_counter() - t_start
+
+    return predizioni, tempo, cache_previsioni.statistiche(), registro_modelli.statistiche()
+
+
+def carica_dati_meteo(ANNO_TARGET, CITTA, aggiorna_cache=False, n_worker=None):
     print(f"\n-- Caricamento modelli predittivi per l'anno {ANNO_TARGET}:")
-    
+
+    predizioni_citta = {}
+    tempi_citta = {}
+
+    # 1. Previsioni già presenti nella cache su disco (modello e dati non sono cambiati)
+    if not aggiorna_cache:
+        for citta in CITTA:
+            t_start = time.perf_counter()
+            predizioni = cache_previsioni.leggi_cache(citta, ANNO_TARGET)
+            if predizioni is not None:
+                predizioni_citta[citta] = predizioni
+                tempi_citta[citta] = time.perf_counter() - t_start
+
+    # 2. Le città che condividono un modello multi-città (es. 'globale') vengono predette
+    #    insieme nel processo principale, con una sola predict per tutte.
+    da_calcolare = [citta for citta in CITTA if citta not in predizioni_citta]
+    condivise = gestore_modelli.citta_con_modello_condiviso(da_calcolare)
+    if condivise:
+        t_start = time.perf_counter()
+        predizioni_citta.update(cache_previsioni.calcola_previsioni_gruppo(condivise, ANNO_TARGET))
+        tempo = time.perf_counter() - t_start
+        for citta in condivise:
+            tempi_citta[citta] = tempo / len(condivise)
+
+    # 3. Le città restanti sono indipendenti tra loro (modello e dati dell'ultimo anno
+    #    propri), quindi la predizione batch annuale viene distribuita su un pool di processi.
+    singole = [citta for citta in da_calcolare if citta not in condivise]
+    if n_worker is None:
+        n_worker = os.cpu_count() or 1
+    n_worker = max(1, min(n_worker, len(singole)))
+
+    if n_worker > 1:
+        with ProcessPoolExecutor(max_workers=n_worker) as pool:
+            # map restituisce i risultati nell'ordine delle città, indipendentemente da chi finisce prima
+            risultati = pool.map(_prevedi_citta, singole, [ANNO_TARGET] * len(singole))
+            for citta, (predizioni, tempo, stat_cache, stat_registro) in zip(singole, risultati):
+                predizioni_citta[citta] = predizioni
+                tempi_citta[citta] = tempo
+                cache_previsioni.unisci_statistiche(stat_cache)
+                registro_modelli.unisci_statistiche(stat_registro)
+    else:
+        for citta in singole:
+            t_start = time.perf_counter()
+            predizioni_citta[citta] = cache_previsioni.calcola_previsioni(citta, ANNO_TARGET)
+            tempi_citta[citta] = time.perf_counter() - t_start
+
+    # 4. TEMPERATURE viene riempito sempre nell'ordine di CITTA
     for citta in CITTA:
-        # print("Citta:",citta)
-        dati_raw = gestore_modelli.predici_temperature_anno_citta(citta, ANNO_TARGET)
-        # Convertiamo il dizionario {(mese,giorno): temp} in una lista piatta [t0, t1, t2...]
-        # per accesso veloce O(1) tramite indice.
-        lista_temp = []
-        curr = date(ANNO_TARGET, 1, 1)
-        while curr.year == ANNO_TARGET:
-            key = (curr.month, curr.day)
-            t = dati_raw.get(key, 0.0) # Gestione errori se manca un giorno
-            lista_temp.append(t)
-            curr += timedelta(days=1)
+        # L'array è già indicizzato per giorno dell'anno, quindi l'accesso resta O(1) tramite indice.
+        predizioni = predizioni_citta[citta]
+        if predizioni is None:
+            # Gestione errori se manca il modello
+            giorni_anno = (date(ANNO_TARGET + 1, 1, 1) - date(ANNO_TARGET, 1, 1)).days
+            lista_temp = [0.0] * giorni_anno
+        else:
+            lista_temp = predizioni.tolist()
             
         TEMPERATURE[citta] = lista_temp
-        print(f"  - Carcati i dati meteo predetti per la città {citta}({len(lista_temp)} giorni).")
+        print(f"  - Carcati i dati meteo predetti per la città {citta}({len(lista_temp)} giorni, {tempi_citta[citta]:.3f} s).")
+
+    if len(da_calcolare) > 0:
+        print(f"  - Predizioni calcolate per {len(da_calcolare)} città con {n_worker} processi.")
+    cache_previsioni.stampa_statistiche()
+    registro_modelli.stampa_statistiche()
 
 # =============================================================================
 # 3. PRE-CALCOLO COSTI (Lookup Table)
@@ -193,9 +259,9 @@ def run_a_star(ANNO_TARGET, CITTA):
     print("\n-- Ricerca con A* terminata senza soluzioni complete.")       
     return None, None
 
-def cerca_soluzione(ANNO_TARGET, CITTA):
-    # 1. Carica previsioni ML
-    carica_dati_meteo(ANNO_TARGET, CITTA)
+def cerca_soluzione(ANNO_TARGET, CITTA, aggiorna_cache=False, n_worker=None):
+    # 1. Carica previsioni ML (dalla cache su disco, se valida)
+    carica_dati_meteo(ANNO_TARGET, CITTA, aggiorna_cache, n_worker)
     
     # 2. Precalcola costi energetici per ogni combinazione
     precalcola_costi(ANNO_TARGET, CITTA)
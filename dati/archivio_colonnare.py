@@ -0,0 +1,208 @@
+"""
+Archivio colonnare tipizzato (.npz, un array per colonna) del dataset meteo: è la copia di
+riferimento, il CSV accanto è solo un export.
+"""
+
+import csv
+import hashlib
+import math
+import os
+
+import numpy as np
+
+ESTENSIONE = '.npz'
+VERSIONE_ARCHIVIO = 1
+MANCANTE_INTERO = -1
+
+COLONNE_MISURA = [
+    'TMEDIA °C', 'TEMPERATURA_MEDIA_ANNO_PRECEDENTE', 'TMIN °C', 'TMAX °C',
+    'UMIDITA %', 'VENTOMEDIA km/h', 'PRESSIONEMEDIA mb', 'PIOGGIA mm',
+]
+
+SCHEMA = {
+    'LOCALITA': 'categoria',
+    'ANNO': 'intero',
+    'MESE': 'intero',
+    'GIORNO': 'intero',
+    'SIN_GIORNO': 'decimale',
+    'COS_GIORNO': 'decimale',
+    'FENOMENI': 'categoria',
+    **{colonna: 'misura' for colonna in COLONNE_MISURA},
+}
+
+
+def percorso_archivio(file_csv):
+    return os.path.splitext(file_csv)[0] + ESTENSIONE
+
+
+def _a_float(valore):
+    if valore == '' or valore is None:
+        return math.nan
+    return float(valore)
+
+
+def _converti(tipo, valori):
+    # restituisce (tipo effettivo, array[, categorie])
+    if tipo == 'intero':
+        try:
+            return tipo, np.array([MANCANTE_INTERO if v == '' or v is None else int(v) for v in valori], dtype=np.int16)
+        except (ValueError, TypeError, OverflowError):
+            tipo = 'categoria'
+    if tipo in ('decimale', 'misura'):
+        try:
+            return tipo, np.array([_a_float(v) for v in valori], dtype=np.float64)
+        except (ValueError, TypeError):
+            tipo = 'categoria'
+    testi = ['' if v is None else str(v) for v in valori]
+    categorie, codici = np.unique(np.array(testi, dtype=str), return_inverse=True)
+    return 'categoria', codici.astype(np.int32), categorie
+
+
+def _formatta(tipo, valore):
+    # stesso testo del CSV: le misure intere senza '.0' (e '-0' conservato), i decimali con repr
+    if tipo == 'intero':
+        return '' if valore == MANCANTE_INTERO else str(int(valore))
+    if math.isnan(valore):
+        return ''
+    if tipo == 'misura' and valore.is_integer():
+        return '-0' if valore == 0 and math.copysign(1.0, valore) < 0 else str(int(valore))
+    return repr(float(valore))
+
+
+class RaccoltaColonne:
+    """Raccoglie le colonne delle righe che la attraversano, per salvarle nell'archivio."""
+
+    def __init__(self, fieldnames):
+        self.fieldnames = list(fieldnames)
+        self.valori = {colonna: [] for colonna in self.fieldnames}
+
+    def attraversa(self, righe):
+        for riga in righe:
+            for colonna in self.fieldnames:
+                self.valori[colonna].append(riga.get(colonna, ''))
+            yield riga
+
+    def salva(self, percorso):
+        dati = {'versione': np.array(VERSIONE_ARCHIVIO), 'colonne': np.array(self.fieldnames, dtype=str)}
+        tipi = []
+        for i, colonna in enumerate(self.fieldnames):
+            tipo, *array = _converti(SCHEMA.get(colonna, 'categoria'), self.valori[colonna])
+            tipi.append(tipo)
+            dati[f'c{i}'] = array[0]
+            if tipo == 'categoria':
+                dati[f'c{i}_categorie'] = array[1]
+        dati['tipi'] = np.array(tipi, dtype=str)
+
+        os.makedirs(os.path.dirname(percorso) or '.', exist_ok=True)
+        temporaneo = f'{percorso}.{os.getpid()}.tmp'
+        with open(temporaneo, 'wb') as f:
+            np.savez(f, **dati)
+        os.replace(temporaneo, percorso)
+
+
+def scrivi(percorso, fieldnames, righe):
+    raccolta = RaccoltaColonne(fieldnames)
+    for _ in raccolta.attraversa(righe):
+        pass
+    raccolta.salva(percorso)
+
+
+def da_csv(file_csv, percorso=None):
+    """Crea (o rigenera) l'archivio dal CSV ';' del dataset."""
+    with open(file_csv, newline='', encoding='utf-8-sig') as fin:
+        reader = csv.DictReader(fin, delimiter=';')
+        fieldnames = [nome.strip() for nome in reader.fieldnames]
+        reader.fieldnames = fieldnames
+        scrivi(percorso or percorso_archivio(file_csv), fieldnames,
+               ({k: (v.strip() if isinstance(v, str) else v) for k, v in riga.items()} for riga in reader))
+
+
+def percorso_aggiornato(file_csv):
+    """
+    Percorso dell'archivio del dataset 'file_csv', rigenerato dal CSV se manca o se il
+    CSV è più recente; None se non esistono né l'archivio né il CSV.
+    """
+    percorso = percorso_archivio(file_csv)
+    if not os.path.exists(file_csv):
+        return percorso if os.path.exists(percorso) else None
+    if not os.path.exists(percorso) or os.path.getmtime(percorso) < os.path.getmtime(file_csv):
+        da_csv(file_csv, percorso)
+    return percorso
+
+
+def carica(percorso, colonne=None):
+    """
+    Dizionario {colonna: array} dell'archivio (solo 'colonne', se indicate).
+    Le colonne 'categoria' sono restituite come array di stringhe.
+    """
+    with np.load(percorso, allow_pickle=False) as dati:
+        nomi = [str(c) for c in dati['colonne']]
+        tipi = [str(t) for t in dati['tipi']]
+        risultato = {}
+        for i, (colonna, tipo) in enumerate(zip(nomi, tipi)):
+            if colonne is not None and colonna not in colonne:
+                continue
+            valori = dati[f'c{i}']
+            if tipo == 'categoria':
+                valori = dati[f'c{i}_categorie'][valori]
+            risultato[colonna] = valori
+    return risultato
+
+
+def schema(percorso):
+    """(colonne, tipi) salvati nell'archivio."""
+    with np.load(percorso, allow_pickle=False) as dati:
+        return [str(c) for c in dati['colonne']], [str(t) for t in dati['tipi']]
+
+
+def impronta(percorso):
+    """Hash del contenuto (schema e valori) dell'archivio, indipendente dalla data di scrittura del file."""
+    h = hashlib.sha256()
+    with np.load(percorso, allow_pickle=False) as dati:
+        for nome in sorted(dati.files):
+            h.update(nome.encode('utf-8'))
+            h.update(np.ascontiguousarray(dati[nome]).tobytes())
+    return h.hexdigest()[:16]
+
+
+def righe(percorso):
+    """Intestazioni e righe (dizionari di testo, come nel CSV) dell'archivio."""
+    colonne, tipi = schema(percorso)
+    dati = carica(percorso)
+
+    def genera():
+        for i in range(len(dati[colonne[0]]) if colonne else 0):
+            yield {
+                colonna: str(dati[colonna][i]) if tipo == 'categoria' else _formatta(tipo, dati[colonna][i])
+                for colonna, tipo in zip(colonne, tipi)
+            }
+
+    return colonne, genera()
+
+
+def dataframe(percorso, colonne=None):
+    """
+    DataFrame pandas dell'archivio, con gli stessi dtype che darebbe read_csv sul CSV
+    (LOCALITA categorica, interi int64, misure intere senza mancanti int64, il resto
+    float64 o object con NaN per il testo vuoto), così impronte e cache calcolate sui dati restano valide.
+    """
+    import pandas as pd
+
+    nomi, tipi = schema(percorso)
+    dati = carica(percorso, colonne)
+    df = {}
+    for colonna, tipo in zip(nomi, tipi):
+        if colonna not in dati:
+            continue
+        valori = dati[colonna]
+        if colonna == 'LOCALITA':
+            valori = pd.Categorical(valori)
+        elif tipo == 'categoria':
+            valori = np.where(valori == '', np.nan, valori.astype(object))
+        elif tipo == 'intero':
+            valori = valori.astype(np.int64) if (valori != MANCANTE_INTERO).all() else \
+                np.where(valori == MANCANTE_INTERO, np.nan, valori)
+        elif tipo == 'misura' and not np.isnan(valori).any() and (valori == np.round(valori)).all():
+            valori = valori.astype(np.int64)
+        df[colonna] = valori
+    return pd.DataFrame(df)
@@ -1,25 +1,75 @@
 import csv
 import os
 import math
-from datetime import datetime
+import calendar
+from datetime import datetime, date, timedelta
+from itertools import islice
 
-# per gestire i valori NULL e i valori numerici con la virgola(al posto del punto)
-def gestisci_null(file_path):
-    #file_path = "dati/dataset_meteo_unificato.csv"
+import numpy as np
+
+from dati import archivio_colonnare
+
+# colonne (nell'ordine) usate come input dai modelli di predizione
+COLONNE_FEATURES = ['ANNO', 'SIN_GIORNO', 'COS_GIORNO', 'TEMPERATURA_MEDIA_ANNO_PRECEDENTE']
+
+# anni ammessi nelle date (gli stessi di datetime)
+ANNO_MINIMO, ANNO_MASSIMO = 1, 9999
 
+# ================================================================
+# PIPELINE A STADI DELLA FORMALIZZAZIONE DEL DATASET
+# ================================================================
+# Ogni stadio riceve (fieldnames, righe) e restituisce (fieldnames, righe), dove
+# 'righe' è un iteratore di dizionari: gli stadi si compongono come generatori,
+# quindi il dataset viene letto una volta sola e scritto una volta sola alla fine
+# (esegui_pipeline). Le funzioni gestisci_null, separatore_data, ... restano
+# disponibili come pipeline di un solo stadio che riscrivono il file.
+
+# legge il CSV in streaming: restituisce le intestazioni e il generatore delle righe
+def leggi_righe(file_path):
+    fin = open(file_path, newline="", encoding="utf-8")
+    reader = csv.DictReader(fin, delimiter=";")
+    fieldnames = reader.fieldnames.copy()
+
+    def righe():
+        with fin:
+            yield from reader
+
+    return fieldnames, righe()
+
+
+# scrive le righe su un file temporaneo e poi lo sostituisce a 'file_path'
+# (la sorgente della pipeline può essere lo stesso file che si sta riscrivendo)
+def scrivi_righe(file_path, fieldnames, righe):
+    file_temporaneo = f"{file_path}.tmp"
+    with open(file_temporaneo, "w", newline="", encoding="utf-8") as fout:
+        writer = csv.DictWriter(fout, fieldnames=fieldnames, delimiter=";")
+        writer.writeheader()
+        writer.writerows(righe)
+    os.replace(file_temporaneo, file_path)
+
+
+# compone gli stadi sulla sorgente (fieldnames, righe) senza ancora leggere le righe
+def componi_stadi(sorgente, stadi):
+    fieldnames, righe = sorgente
+    for stadio in stadi:
+        fieldnames, righe = stadio(fieldnames, righe)
+    return fieldnames, righe
+
+
+def esegui_pipeline(sorgente, file_output, stadi):
+    scrivi_righe(file_output, *componi_stadi(sorgente, stadi))
+
+
+# per gestire i valori NULL e i valori numerici con la virgola(al posto del punto)
+def stadio_gestisci_null(fieldnames, righe):
     # Lista delle colonne che contengono numeri con la virgola da convertire
     colonne_numeriche = [
         'TMEDIA °C', 'TMIN °C', 'TMAX °C', 
         'VENTOMEDIA km/h', 'PRESSIONEMEDIA mb', 'PIOGGIA mm'
     ]
 
-    righe_modificate = []
-
-    with open(file_path, newline="", encoding="utf-8") as fin:
-        reader = csv.DictReader(fin, delimiter=";")
-        fieldnames = reader.fieldnames
-
-        for riga in reader:
+    def genera():
+        for riga in righe:
             # 1. GESTIONE NULL SU FENOMENI
             val = riga.get("FENOMENI", "").strip()
             if val == "" or val.lower() == "":
@@ -30,37 +80,31 @@ def gestisci_null(file_path):
                 if col in riga and riga[col]:
                     # Sostituisce la virgola con il punto
                     riga[col] = riga[col].replace(",", ".")
-            
-            righe_modificate.append(riga)
-
-    # Riscrivi il file originale con le modifiche
-    with open(file_path, "w", newline="", encoding="utf-8") as fout:
-        writer = csv.DictWriter(fout, fieldnames=fieldnames, delimiter=";")
-        writer.writeheader()
-        writer.writerows(righe_modificate)
-
-    print("  - Sono stati gestiti i NULL.\n  - Sono stati convertiti i valori decimali nel formato puntato.")
-
-# suddivide il campo DATA in ANNO, MESE e Giorno
-def separatore_data(file_path):
 
-    # file_path = "dati/dataset_meteo_unificato.csv"
+            yield riga
 
-    righe_modificate = []
+    return fieldnames, genera()
 
-    with open(file_path, newline="", encoding="utf-8") as fin:
-        reader = csv.DictReader(fin, delimiter=";")
-        fieldnames = reader.fieldnames.copy()
 
-        # Rimuovi la colonna 'DATA' e inserisci 'ANNO', 'MESE', 'GIORNO' al suo posto
-        if "DATA" in fieldnames:
-            idx = fieldnames.index("DATA")
-            # rimuovo DATA
-            fieldnames.pop(idx)
-            # inserisco ANNO, MESE, GIORNO nella stessa posizione
-            fieldnames[idx:idx] = ["ANNO", "MESE", "GIORNO"]
+def gestisci_null(file_path):
+    #file_path = "dati/dataset_meteo_unificato.csv"
+    esegui_pipeline(leggi_righe(file_path), file_path, [stadio_gestisci_null])
+    print("  - Sono stati gestiti i NULL.\n  - Sono stati convertiti i valori decimali nel formato puntato.")
 
-        for riga in reader:
+# suddivide il campo DATA in ANNO, MESE e Giorno
+def stadio_separatore_data(fieldnames, righe):
+    fieldnames = fieldnames.copy()
+
+    # Rimuovi la colonna 'DATA' e inserisci 'ANNO', 'MESE', 'GIORNO' al suo posto
+    if "DATA" in fieldnames:
+        idx = fieldnames.index("DATA")
+        # rimuovo DATA
+        fieldnames.pop(idx)
+        # inserisco ANNO, MESE, GIORNO nella stessa posizione
+        fieldnames[idx:idx] = ["ANNO", "MESE", "GIORNO"]
+
+    def genera():
+        for riga in righe:
             data_str = riga.get("DATA", "")
             # Default valori
             anno, mese, giorno = "", "", ""
@@ -80,123 +124,132 @@ def separatore_data(file_path):
             riga["MESE"] = mese
             riga["GIORNO"] = giorno
 
-            righe_modificate.append(riga)
+            yield riga
+
+    return fieldnames, genera()
 
-    # Riscrivi il file originale con le modifiche
-    with open(file_path, "w", newline="", encoding="utf-8") as fout:
-        writer = csv.DictWriter(fout, fieldnames=fieldnames, delimiter=";")
-        writer.writeheader()
-        writer.writerows(righe_modificate)
 
+def separatore_data(file_path):
+    # file_path = "dati/dataset_meteo_unificato.csv"
+    esegui_pipeline(leggi_righe(file_path), file_path, [stadio_separatore_data])
     print("  - Il campo DATA è stato diviso in ANNO, MESE e GIORNO.")
 
-def elimina_colonne(file_path, colonne_da_eliminare):
-    righe_modificate = []
-    
-    with open(file_path, newline="", encoding="utf-8") as fin:
-        reader = csv.DictReader(fin, delimiter=";")
-        
+# restituisce lo stadio che elimina le colonne indicate
+def stadio_elimina_colonne(colonne_da_eliminare):
+
+    def stadio(fieldnames, righe):
         # Copia i fieldnames attuali per modificarli
-        fieldnames = reader.fieldnames.copy()
-        
+        fieldnames = fieldnames.copy()
+
         # Rimuovi le colonne dall'intestazione (se esistono)
         for col in colonne_da_eliminare:
             if col in fieldnames:
                 fieldnames.remove(col)
-        
-        # Itera sulle righe e rimuovi i dati
-        for riga in reader:
-            for col in colonne_da_eliminare:
-                # Rimuovi la chiave dal dizionario se presente
-                if col in riga:
-                    del riga[col]
-            righe_modificate.append(riga)
-
-    # Riscrivi il file senza le colonne rimosse
-    with open(file_path, "w", newline="", encoding="utf-8") as fout:
-        # 'extrasaction' non è strettamente necessario qui perché abbiamo rimosso 
-        # le chiavi manualmente dal dizionario 'riga', ma è una buona sicurezza.
-        writer = csv.DictWriter(fout, fieldnames=fieldnames, delimiter=";")
-        writer.writeheader()
-        writer.writerows(righe_modificate)
 
-    print(f"  - Sono state eliminate le Colonne: {colonne_da_eliminare}")
+        def genera():
+            # Itera sulle righe e rimuovi i dati
+            for riga in righe:
+                for col in colonne_da_eliminare:
+                    # Rimuovi la chiave dal dizionario se presente
+                    if col in riga:
+                        del riga[col]
+                yield riga
 
+        return fieldnames, genera()
 
-def aggiungi_ciclicita_data(file_path):
-   
-    righe_modificate = []
-
-    with open(file_path, newline="", encoding="utf-8") as fin:
-        reader = csv.DictReader(fin, delimiter=";")
-        fieldnames = reader.fieldnames.copy()
-
-        # Inserisci le nuove colonne nell'header subito dopo 'GIORNO'
-        if "GIORNO" in fieldnames:
-            idx = fieldnames.index("GIORNO")
-            # Inseriamo dopo GIORNO (idx + 1)
-            fieldnames.insert(idx + 1, "COS_GIORNO")
-            fieldnames.insert(idx + 1, "SIN_GIORNO") # Inseriamo prima SIN così finisce prima di COS
-        else:
-            # Fallback se non trova GIORNO: le aggiunge alla fine
-            fieldnames.extend(["SIN_GIORNO", "COS_GIORNO"])
+    return stadio
 
-        for riga in reader:
-            try:
-                # Recupera anno, mese, giorno convertendoli in interi
-                anno = int(riga.get("ANNO", 0))
-                mese = int(riga.get("MESE", 0))
-                giorno = int(riga.get("GIORNO", 0))
-                
-                # Crea un oggetto data per ottenere il numero del giorno nell'anno (1-366)
-                data_obj = datetime(anno, mese, giorno)
-                giorno_anno = data_obj.timetuple().tm_yday
-                
-                # Giorni in un anno medio (considerando i bisestili per l'apprendimento)
-                giorni_totali = 365.25
-                
-                # Calcolo Sin e Cos
-                # Formula: sin( 2 * pi * giorno_corrente / giorni_totali )
-                val_sin = math.sin(2 * math.pi * giorno_anno / giorni_totali)
-                val_cos = math.cos(2 * math.pi * giorno_anno / giorni_totali)
-                
-                # Aggiungi i valori alla riga (arrotondati a 5 decimali)
-                riga["SIN_GIORNO"] = round(val_sin, 5)
-                riga["COS_GIORNO"] = round(val_cos, 5)
 
-            except (ValueError, TypeError):
-                # Se la data non è valida o mancano i dati, metti 0 o lascia vuoto
-                riga["SIN_GIORNO"] = 0
-                riga["COS_GIORNO"] = 0
+def elimina_colonne(file_path, colonne_da_eliminare):
+    esegui_pipeline(leggi_righe(file_path), file_path, [stadio_elimina_colonne(colonne_da_eliminare)])
+    print(f"  - Sono state eliminate le Colonne: {colonne_da_eliminare}")
 
-            righe_modificate.append(riga)
 
-    # Scrittura su file
-    with open(file_path, "w", newline="", encoding="utf-8") as fout:
-        writer = csv.DictWriter(fout, fieldnames=fieldnames, delimiter=";")
-        writer.writeheader()
-        writer.writerows(righe_modificate)
+# righe elaborate insieme dagli stadi vettorizzati (gli stadi restano in streaming a blocchi)
+DIMENSIONE_BLOCCO = 4096
+
+
+def _blocchi(righe, dimensione=DIMENSIONE_BLOCCO):
+    righe = iter(righe)
+    while blocco := list(islice(righe, dimensione)):
+        yield blocco
+
+
+# valori interi di una colonna (come int(valore)) e maschera delle righe convertibili
+def _colonna_intera(righe, colonna, predefinito=None):
+    valori = [riga.get(colonna, predefinito) for riga in righe]
+    try:
+        return np.array(valori, dtype=str).astype(np.int64), np.ones(len(valori), dtype=bool)
+    except (ValueError, TypeError, OverflowError):
+        pass
+
+    interi = np.zeros(len(valori), dtype=np.int64)
+    validi = np.zeros(len(valori), dtype=bool)
+    for i, valore in enumerate(valori):
+        try:
+            interi[i] = int(valore)
+            validi[i] = True
+        except (ValueError, TypeError, OverflowError):
+            continue
+    return interi, validi
+
+
+# SIN_GIORNO e COS_GIORNO (arrotondati a 5 decimali) dei giorni dell'anno 'giorno_anno'
+def ciclicita_giorno(giorno_anno):
+    # Giorni in un anno medio (considerando i bisestili per l'apprendimento)
+    # Formula: sin( 2 * pi * giorno_corrente / giorni_totali )
+    angolo = 2 * np.pi * giorno_anno / 365.25
+    return np.round(np.sin(angolo), 5), np.round(np.cos(angolo), 5)
+
+
+def stadio_ciclicita_data(fieldnames, righe):
+    fieldnames = fieldnames.copy()
+
+    # Inserisci le nuove colonne nell'header subito dopo 'GIORNO'
+    if "GIORNO" in fieldnames:
+        idx = fieldnames.index("GIORNO")
+        # Inseriamo dopo GIORNO (idx + 1)
+        fieldnames.insert(idx + 1, "COS_GIORNO")
+        fieldnames.insert(idx + 1, "SIN_GIORNO") # Inseriamo prima SIN così finisce prima di COS
+    else:
+        # Fallback se non trova GIORNO: le aggiunge alla fine
+        fieldnames.extend(["SIN_GIORNO", "COS_GIORNO"])
+
+    def genera():
+        for blocco in _blocchi(righe):
+            # Recupera anno, mese, giorno come interi per tutto il blocco
+            anni, anni_validi = _colonna_intera(blocco, "ANNO", 0)
+            mesi, mesi_validi = _colonna_intera(blocco, "MESE", 0)
+            giorni, giorni_validi = _colonna_intera(blocco, "GIORNO", 0)
+
+            # Numero del giorno nell'anno (1-366) calcolato sugli array
+            giorno_anno, date_valide = _giorno_dell_anno(anni, mesi, giorni)
+            valide = anni_validi & mesi_validi & giorni_validi & date_valide
+
+            # Calcolo Sin e Cos, arrotondati a 5 decimali
+            val_sin, val_cos = ciclicita_giorno(giorno_anno)
+
+            for riga, valida, sin, cos in zip(blocco, valide.tolist(), val_sin.tolist(), val_cos.tolist()):
+                if valida:
+                    riga["SIN_GIORNO"] = sin
+                    riga["COS_GIORNO"] = cos
+                else:
+                    # Se la data non è valida o mancano i dati, metti 0
+                    riga["SIN_GIORNO"] = 0
+                    riga["COS_GIORNO"] = 0
+                yield riga
 
+    return fieldnames, genera()
+
+
+def aggiungi_ciclicita_data(file_path):
+    esegui_pipeline(leggi_righe(file_path), file_path, [stadio_ciclicita_data])
     print("  - Aggiunte le Colonne SIN_GIORNO e COS_GIORNO per la ciclicità temporale.")
 
-def aggiungi_temperatura_anno_precedente(file_path):
-    righe_modificate = []
-    # Dizionario per mappare (anno, mese, giorno) -> temperatura
-    mappa_temperature = {}
-
-    # 1. Lettura preliminare per caricare i dati in memoria
-    with open(file_path, newline="", encoding="utf-8") as fin:
-        reader = csv.DictReader(fin, delimiter=";")
-        fieldnames = reader.fieldnames.copy()
-        
-        for riga in reader:
-            try:
-                chiave = (int(riga['ANNO']), int(riga['MESE']), int(riga['GIORNO']))
-                mappa_temperature[chiave] = riga.get('TMEDIA °C', "")
-            except (ValueError, KeyError):
-                continue
+def stadio_temperatura_anno_precedente(fieldnames, righe):
+    fieldnames = fieldnames.copy()
 
-    # 2. Aggiunta della nuova colonna nell'header
+    # Aggiunta della nuova colonna nell'header
     nuova_colonna = 'TEMPERATURA_MEDIA_ANNO_PRECEDENTE'
     if nuova_colonna not in fieldnames:
         # La inseriamo magari dopo TMEDIA °C se esiste, o in fondo
@@ -206,56 +259,285 @@ def aggiungi_temperatura_anno_precedente(file_path):
         else:
             fieldnames.append(nuova_colonna)
 
-    # 3. Seconda passata per calcolare il valore dell'anno precedente
-    with open(file_path, newline="", encoding="utf-8") as fin:
-        reader = csv.DictReader(fin, delimiter=";")
-        for riga in reader:
-            # se non abbiamo la temperatura dell'anno precedente, mettiamo la media dell'anno stesso
-            temp = riga['TMEDIA °C']
+    def genera():
+        # Unico stadio bloccante: il valore di ogni riga dipende da quella della stessa
+        # città nello stesso giorno dell'anno precedente, che può arrivare dopo
+        righe_lette = list(righe)
+        valori = valori_anno_precedente(righe_lette)
+        for riga, valore in zip(righe_lette, valori):
+            riga[nuova_colonna] = valore
+            yield riga
+
+    return fieldnames, genera()
+
+
+# codifica ogni riga di 'chiavi' e 'cercate' (matrici di interi) in un intero che rispetta
+# l'uguaglianza tra righe; se gli intervalli dei valori non entrano in un int64 si usa np.unique
+def _codifica_chiavi(chiavi, cercate):
+    tutte = np.concatenate([chiavi, cercate])
+    if len(tutte) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    minimi = tutte.min(axis=0)
+    ampiezze = [int(v) for v in tutte.max(axis=0) - minimi + 1]
+    if math.prod(ampiezze) >= 2 ** 62:
+        _, codici = np.unique(tutte, axis=0, return_inverse=True)
+    else:
+        codici = np.zeros(len(tutte), dtype=np.int64)
+        for colonna, ampiezza in enumerate(ampiezze):
+            codici = codici * ampiezza + (tutte[:, colonna] - minimi[colonna])
+    codici = codici.reshape(-1)
+    return codici[:len(chiavi)], codici[len(chiavi):]
+
+
+def valori_anno_precedente(righe, indici=None):
+    """
+    TEMPERATURA_MEDIA_ANNO_PRECEDENTE delle righe in posizione 'indici' (tutte se None):
+    la TMEDIA della riga della stessa città con (anno - 1, mese, giorno), oppure la
+    TMEDIA della riga stessa se quel giorno manca o è vuoto. A parità di chiave vale
+    l'ultima riga. Il join è calcolato sugli array delle chiavi, non riga per riga.
+    """
+    if indici is None:
+        indici = np.arange(len(righe))
+    indici = np.asarray(indici, dtype=np.int64)
+    if len(righe) == 0 or len(indici) == 0:
+        return []
+
+    anni, anni_validi = _colonna_intera(righe, 'ANNO')
+    mesi, mesi_validi = _colonna_intera(righe, 'MESE')
+    giorni, giorni_validi = _colonna_intera(righe, 'GIORNO')
+    valide = anni_validi & mesi_validi & giorni_validi
+    codici_citta = {}
+    citta = np.array([codici_citta.setdefault(riga.get('LOCALITA', ''), len(codici_citta)) for riga in righe],
+                     dtype=np.int64)
+
+    # chiavi (città, anno, mese, giorno) delle righe valide e dei giorni cercati, codificate in un solo intero
+    posizioni_valide = np.flatnonzero(valide)
+    cercate_valide = valide[indici]
+    chiavi = np.column_stack([citta, anni, mesi, giorni])
+    cercate = chiavi[indici[cercate_valide]] - np.array([0, 1, 0, 0])
+    chiavi_righe, chiavi_cercate = _codifica_chiavi(chiavi[posizioni_valide], cercate)
+
+    # a parità di chiave l'ordinamento stabile lascia per ultima la riga che viene dopo nel dataset
+    ordine = np.argsort(chiavi_righe, kind='stable')
+    chiavi_ordinate = chiavi_righe[ordine]
+    posizione = np.searchsorted(chiavi_ordinate, chiavi_cercate, side='right') - 1
+    presenti = posizione >= 0
+    presenti[presenti] = chiavi_ordinate[posizione[presenti]] == chiavi_cercate[presenti]
+
+    trovate = np.full(len(indici), -1, dtype=np.int64)
+    trovate[np.flatnonzero(cercate_valide)[presenti]] = posizioni_valide[ordine[posizione[presenti]]]
+
+    risultato = []
+    for i, j in zip(indici.tolist(), trovate.tolist()):
+        # se non abbiamo la temperatura dell'anno precedente, mettiamo la media dell'anno stesso
+        valore_prec = righe[j].get('TMEDIA °C', "") if j >= 0 else ""
+        risultato.append(valore_prec if valore_prec else righe[i]['TMEDIA °C'])
+    return risultato
+
+
+def aggiungi_temperatura_anno_precedente(file_path):
+    esegui_pipeline(leggi_righe(file_path), file_path, [stadio_temperatura_anno_precedente])
+    print("  - Aggiunta la Colonna 'TEMPERATURA_MEDIA_ANNO_PRECEDENTE'.")
+
+
+# carica il dataset unificato una sola volta, già ripulito per l'addestramento
+# (righe senza LOCALITA, feature o target scartate) e diviso per città:
+# restituisce { localita: DataFrame }, con LOCALITA di tipo categorico.
+# I dati sono letti dall'archivio colonnare accanto al CSV (rigenerato se il CSV è più recente)
+def carica_dataset_per_citta(file_path, target_column):
+    percorso = archivio_colonnare.percorso_aggiornato(file_path)
+    if percorso is None:
+        raise FileNotFoundError(f"Dataset '{file_path}' non trovato")
+
+    df = archivio_colonnare.dataframe(percorso)
+    df_clean = df.dropna(subset=['LOCALITA'] + COLONNE_FEATURES + [target_column])
+
+    return {
+        localita: df_localita
+        for localita, df_localita in df_clean.groupby('LOCALITA', observed=True, sort=False)
+    }
+
+
+# dati (ripuliti) di una località per i moduli *_train_and_test: 'dataset' può essere
+# il dizionario prodotto da carica_dataset_per_citta oppure il percorso del CSV
+def dati_localita(dataset, target_column, localita):
+    if isinstance(dataset, dict):
+        dataset_per_citta = dataset
+    else:
+        dataset_per_citta = carica_dataset_per_citta(dataset, target_column)
+
+    if localita in dataset_per_citta:
+        return dataset_per_citta[localita]
+
+    # località assente: DataFrame vuoto con le stesse colonne
+    for df_localita in dataset_per_citta.values():
+        return df_localita.iloc[0:0]
+    raise ValueError("Il dataset non contiene righe valide per l'addestramento")
+
+
+# Archivio in memoria delle temperature dell'ultimo anno:
+# _TMEDIA_ULTIMO_ANNO[localita] = array di 366 valori indicizzato per giorno dell'anno
+# (calendario bisestile, così anche il 29 febbraio ha il suo posto); NaN se il giorno manca.
+# Viene caricato alla prima richiesta e invalidato quando dati_ultimo_anno rigenera i file.
+_TMEDIA_ULTIMO_ANNO = {}
+_ANNO_ULTIMO_OSSERVATO = {}  # localita -> anno a cui si riferiscono i dati del file
+_VERSIONE_TMEDIA = 0  # incrementata a ogni invalidazione, per chi tiene cache derivate
+_ANNO_BISESTILE_RIFERIMENTO = 2000
+
+
+def _indice_giorno(mese, giorno):
+    return date(_ANNO_BISESTILE_RIFERIMENTO, mese, giorno).timetuple().tm_yday - 1
+
+
+def file_ultimo_anno(localita):
+    """Archivio colonnare dei dati dell'ultimo anno della località, None se non esistono."""
+    return archivio_colonnare.percorso_aggiornato(f"dati/dati_ultimo_anno/ultimo_anno_{localita}.csv")
+
+
+def _carica_tmedia_ultimo_anno(localita):
+    if localita in _TMEDIA_ULTIMO_ANNO:
+        return _TMEDIA_ULTIMO_ANNO[localita]
+
+    file_input = file_ultimo_anno(localita)
+    if file_input is None:
+        raise FileNotFoundError(f"Dati dell'ultimo anno di {localita} non trovati")
+    temperature = np.full(366, np.nan)
+    anno_osservato = None
+
+    colonne = archivio_colonnare.carica(file_input, ['ANNO', 'MESE', 'GIORNO', 'TMEDIA °C'])
+    if len(colonne) == 4:
+        for anno, mese, giorno, valore in zip(colonne['ANNO'], colonne['MESE'], colonne['GIORNO'], colonne['TMEDIA °C']):
             try:
-                anno_prec = int(riga['ANNO']) - 1
-                mese = int(riga['MESE'])
-                giorno = int(riga['GIORNO'])
-                
-                # Cerchiamo nella mappa se esiste il valore per l'anno precedente
-                valore_prec = mappa_temperature.get((anno_prec, mese, giorno), "")
-                if not valore_prec:
-                    
-                    riga[nuova_colonna] = riga['TMEDIA °C']
-                    
-                else:
-                    riga[nuova_colonna] = valore_prec
-            except (ValueError, KeyError):
-                riga[nuova_colonna] = temp
-            
-            righe_modificate.append(riga)
-
-    # 4. Scrittura finale
-    with open(file_path, "w", newline="", encoding="utf-8") as fout:
-        writer = csv.DictWriter(fout, fieldnames=fieldnames, delimiter=";")
-        writer.writeheader()
-        writer.writerows(righe_modificate)
+                idx = _indice_giorno(int(mese), int(giorno))
+                valore = float(valore) if valore != '' else np.nan
+                anno_osservato = anno_osservato or int(anno)
+            except (ValueError, TypeError):
+                continue
+            # come nella lettura riga per riga, vale la prima occorrenza del giorno
+            if not np.isnan(valore) and np.isnan(temperature[idx]):
+                temperature[idx] = valore
 
-    print(f"  - Aggiunta la Colonna '{nuova_colonna}'.")
+    _TMEDIA_ULTIMO_ANNO[localita] = temperature
+    _ANNO_ULTIMO_OSSERVATO[localita] = anno_osservato
+    return temperature
 
 
-# legge la temperatura media del giorno indicato nell'ultimo anno
-def leggi_tmedia(localita, mese, giorno):
-    file_input = f"dati/dati_ultimo_anno/ultimo_anno_{localita}.csv"
+def invalida_tmedia(localita=None):
+    """Scarta le temperature dell'ultimo anno in memoria (di una località o di tutte)."""
+    global _VERSIONE_TMEDIA
+    _VERSIONE_TMEDIA += 1
+    if localita is None:
+        _TMEDIA_ULTIMO_ANNO.clear()
+        _ANNO_ULTIMO_OSSERVATO.clear()
+    else:
+        _TMEDIA_ULTIMO_ANNO.pop(localita, None)
+        _ANNO_ULTIMO_OSSERVATO.pop(localita, None)
+
 
-    with open(file_input, mode="r", newline="", encoding="utf-8-sig") as infile:
-        reader = csv.DictReader(infile, delimiter=';')
+def versione_tmedia():
+    return _VERSIONE_TMEDIA
 
-        # Normalizza intestazioni
-        reader.fieldnames = [name.strip() for name in reader.fieldnames]
 
-        for row in reader:
-            # Normalizza chiavi
-            row = {k.strip(): v.strip() for k, v in row.items()}
+# anno (es. 2025) a cui si riferisce il file dell'ultimo anno della località
+def anno_ultimo_osservato(localita):
+    _carica_tmedia_ultimo_anno(localita)
+    return _ANNO_ULTIMO_OSSERVATO[localita]
 
-            if (row.get("MESE") == str(mese) and
-                row.get("GIORNO") == str(giorno)):
-                
-                return row.get("TMEDIA °C")
 
-    return None  # se non trova la riga
\ No newline at end of file
+# legge la temperatura media del giorno indicato nell'ultimo anno
+def leggi_tmedia(localita, mese, giorno):
+    try:
+        valore = _carica_tmedia_ultimo_anno(localita)[_indice_giorno(int(mese), int(giorno))]
+    except ValueError:
+        return None  # data non valida
+
+    if np.isnan(valore):
+        return None  # se non trova la riga
+    return float(valore)
+
+
+# restituisce le temperature dell'ultimo anno allineate ai giorni di 'anno'
+# (indice 0 = 1 gennaio); i giorni mancanti restano NaN
+def leggi_tmedia_anno(localita, anno):
+    return _da_calendario_bisestile(_carica_tmedia_ultimo_anno(localita), anno)
+
+
+# riporta le temperature giornaliere di 'anno_origine' sui giorni di 'anno_destinazione'
+# abbinando (mese, giorno): il 29 febbraio viene scartato o lasciato a NaN se serve
+def allinea_temperature_anno(temperature, anno_origine, anno_destinazione):
+    temperature = np.asarray(temperature, dtype=float)
+    if calendar.isleap(anno_origine):
+        bisestile = temperature.copy()
+    else:
+        bisestile = np.insert(temperature, _indice_giorno(2, 29), np.nan)
+    return _da_calendario_bisestile(bisestile, anno_destinazione)
+
+
+def _da_calendario_bisestile(temperature, anno):
+    if calendar.isleap(anno):
+        return temperature.copy()
+    # anno non bisestile: saltiamo lo slot del 29 febbraio
+    return np.delete(temperature, _indice_giorno(2, 29))
+
+
+# costruisce in un colpo solo la matrice delle feature (COLONNE_FEATURES) per tutti
+# i giorni dell'anno: la riga i corrisponde al giorno i+1 dell'anno.
+# Se temp_anno_prec (già allineato ai giorni di 'anno') non è indicato si usa l'ultimo anno osservato.
+def features_anno(localita, anno, temp_anno_prec=None):
+    giorni_nell_anno = 366 if calendar.isleap(anno) else 365
+
+    # Stessa codifica ciclica del dataset (ciclicita_giorno), calcolata su tutto l'anno
+    sin_giorno, cos_giorno = ciclicita_giorno(np.arange(1, giorni_nell_anno + 1))
+
+    if temp_anno_prec is None:
+        temp_anno_prec = leggi_tmedia_anno(localita, anno)
+    else:
+        temp_anno_prec = np.array(temp_anno_prec, dtype=float)
+    for i in np.flatnonzero(np.isnan(temp_anno_prec)):
+        # giorno assente nell'ultimo anno (es. 29 febbraio): usiamo il giorno precedente
+        if i > 0:
+            temp_anno_prec[i] = temp_anno_prec[i - 1]
+
+    return np.column_stack([
+        np.full(giorni_nell_anno, anno, dtype=float),
+        sin_giorno,
+        cos_giorno,
+        temp_anno_prec
+    ])
+
+
+# costruisce la matrice delle feature (COLONNE_FEATURES) per date arbitrarie, date come
+# array paralleli di anni, mesi e giorni; restituisce (matrice, maschera delle date valide).
+# La temperatura dell'anno precedente è quella dell'ultimo anno osservato per lo stesso
+# (mese, giorno); se quel giorno manca si usa il giorno precedente.
+def features_date(localita, anni, mesi, giorni):
+    anni = np.asarray(anni, dtype=np.int64)
+    mesi = np.asarray(mesi, dtype=np.int64)
+    giorni = np.asarray(giorni, dtype=np.int64)
+
+    giorno_anno, valide = _giorno_dell_anno(anni, mesi, giorni)
+    sin_giorno, cos_giorno = ciclicita_giorno(giorno_anno)
+
+    temperature = _carica_tmedia_ultimo_anno(localita).copy()
+    for i in range(1, len(temperature)):
+        if np.isnan(temperature[i]):
+            temperature[i] = temperature[i - 1]
+    indice, _ = _giorno_dell_anno(np.full_like(anni, _ANNO_BISESTILE_RIFERIMENTO), mesi, giorni)
+    temp_anno_prec = np.where(valide, temperature[np.clip(indice - 1, 0, 365)], np.nan)
+
+    matrice = np.column_stack([anni.astype(float), sin_giorno, cos_giorno, temp_anno_prec])
+    return matrice, valide
+
+
+def _giorno_dell_anno(anni, mesi, giorni):
+    # giorno dell'anno (1-366) calcolato con l'aritmetica di datetime64, senza oggetti datetime;
+    # come per datetime, gli anni fuori da 1-9999 non sono date valide
+    anni_validi = (anni >= ANNO_MINIMO) & (anni <= ANNO_MASSIMO)
+    mesi_validi = (mesi >= 1) & (mesi <= 12)
+    anni = np.where(anni_validi, anni, _ANNO_BISESTILE_RIFERIMENTO)
+    inizio_mese = (anni - 1970).astype('datetime64[Y]').astype('datetime64[M]') + np.where(mesi_validi, mesi - 1, 0)
+    data = inizio_mese.astype('datetime64[D]') + (giorni - 1)
+    valide = anni_validi & mesi_validi & (giorni >= 1) & (data.astype('datetime64[M]') == inizio_mese)
+    giorno_anno = (data - data.astype('datetime64[Y]').astype('datetime64[D]')).astype(np.int64) + 1
+    return np.where(valide, giorno_anno, 0), valide
@@ -0,0 +1,196 @@
+"""
+Ingestione completa o incrementale (manifest 'dati/manifest_ingestione.json') dei file mensili
+nel dataset unificato, usata da --new_dataset.
+"""
+
+import hashlib
+import heapq
+import json
+import os
+
+from dati import archivio_colonnare, gestore, unificatore_csv
+
+FILE_MANIFEST = 'dati/manifest_ingestione.json'
+VERSIONE_MANIFEST = 1
+
+COLONNE_DA_ELIMINARE = ['PUNTORUGIADA °C', 'VISIBILITA m', 'VENTOMAX km/h', 'RAFFICA km/h', 'PRESSIONESLM mb']
+COLONNA_ANNO_PRECEDENTE = 'TEMPERATURA_MEDIA_ANNO_PRECEDENTE'
+
+
+# stadi che trasformano ogni riga indipendentemente dalle altre
+def stadi_riga():
+    return [
+        gestore.stadio_gestisci_null,
+        gestore.stadio_separatore_data,
+        gestore.stadio_elimina_colonne(COLONNE_DA_ELIMINARE),
+        gestore.stadio_ciclicita_data,
+    ]
+
+
+def carica():
+    """Voci del manifest ({nome_file: {dimensione, mtime, hash}}), vuoto se assente o di un'altra versione."""
+    if not os.path.exists(FILE_MANIFEST):
+        return {}
+    with open(FILE_MANIFEST, 'r') as f:
+        manifest = json.load(f)
+    if manifest.get('versione') != VERSIONE_MANIFEST:
+        return {}
+    return manifest.get('file', {})
+
+
+def salva(voci):
+    with open(FILE_MANIFEST, 'w') as f:
+        json.dump({'versione': VERSIONE_MANIFEST, 'file': voci}, f, indent=4, sort_keys=True)
+
+
+def _hash_file(percorso):
+    h = hashlib.sha256()
+    with open(percorso, 'rb') as f:
+        for blocco in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(blocco)
+    return h.hexdigest()[:16]
+
+
+# chiave di ordinamento del dataset formalizzato: (località, anno, mese, giorno), come la DATA in unifica_dataset
+def _chiave_riga(riga):
+    try:
+        data = (int(riga['ANNO']), int(riga['MESE']), int(riga['GIORNO']))
+    except (ValueError, KeyError, TypeError):
+        data = (1900, 1, 1)
+    return (riga.get('LOCALITA', '').lower(),) + data
+
+
+# (località, anno, mese, giorno) della riga, None se la data non è convertibile
+def _chiave_giorno(riga):
+    try:
+        return riga.get('LOCALITA', ''), int(riga['ANNO']), int(riga['MESE']), int(riga['GIORNO'])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def _scrivi_dataset(file_output, fieldnames, righe, esporta_csv):
+    # un solo passaggio sulle righe: l'archivio raccoglie le colonne mentre (eventualmente) si scrive il CSV
+    raccolta = archivio_colonnare.RaccoltaColonne(fieldnames)
+    righe = raccolta.attraversa(righe)
+    if esporta_csv:
+        gestore.scrivi_righe(file_output, fieldnames, righe)
+    else:
+        for _ in righe:
+            pass
+    # l'archivio viene scritto dopo il CSV, così risulta il più recente dei due
+    raccolta.salva(archivio_colonnare.percorso_archivio(file_output))
+
+
+def aggiorna_dataset(file_output, ultimo_anno, completo=False, n_worker=None, esporta_csv=True):
+    """
+    Porta il dataset unificato 'file_output' (e i file dell'ultimo anno) allo stato
+    dei file sorgente, ingerendo solo i file nuovi o modificati quando possibile.
+    n_worker: processi per la lettura dei file sorgente (None = numero di core).
+    esporta_csv: scrive anche i CSV oltre agli archivi colonnari.
+    """
+    voci_salvate = carica()
+    presenti = unificatore_csv.file_sorgenti()
+
+    voci = {}
+    da_ingerire = []
+    for nome_file in presenti:
+        percorso = os.path.join(unificatore_csv.cartella_input, nome_file)
+        stat = os.stat(percorso)
+        voce = voci_salvate.get(nome_file)
+        if voce and voce['dimensione'] == stat.st_size and voce['mtime'] == stat.st_mtime:
+            voci[nome_file] = voce
+            continue
+
+        # dimensione o mtime cambiati: il file va riletto solo se è cambiato anche il contenuto
+        voci[nome_file] = {'dimensione': stat.st_size, 'mtime': stat.st_mtime, 'hash': _hash_file(percorso)}
+        if not voce or voce['hash'] != voci[nome_file]['hash']:
+            da_ingerire.append(nome_file)
+
+    rimossi = sorted(set(voci_salvate) - set(presenti))
+    motivo_completo = None
+    if completo:
+        motivo_completo = "richiesta la ricostruzione completa"
+    elif not voci_salvate or archivio_colonnare.percorso_aggiornato(file_output) is None:
+        motivo_completo = "manifest o dataset assenti"
+    elif rimossi:
+        motivo_completo = f"file sorgenti rimossi: {rimossi}"
+    elif any(unificatore_csv.citta_anno_mese(nome_file) is None for nome_file in da_ingerire):
+        motivo_completo = "nomi di file non nel formato {Città}-{Anno}-{Mese}.csv"
+
+    if motivo_completo is None and not da_ingerire:
+        salva(voci)
+        print("  - Nessun file mensile nuovo o modificato: il dataset unificato è già aggiornato.")
+        return
+
+    if motivo_completo is None and not _ingestione_incrementale(file_output, ultimo_anno, sorted(da_ingerire),
+                                                                 n_worker, esporta_csv):
+        motivo_completo = "colonne dei nuovi file diverse da quelle del dataset"
+
+    if motivo_completo is not None:
+        print(f"  - Ricostruzione completa del dataset ({motivo_completo}).")
+        _ingestione_completa(file_output, ultimo_anno, n_worker, esporta_csv)
+
+    salva(voci)
+
+
+def _ingestione_completa(file_output, ultimo_anno, n_worker, esporta_csv):
+    # unificazione e formalizzazione in un solo passaggio: il dataset viene scritto una volta sola
+    fieldnames, righe = gestore.componi_stadi(unificatore_csv.righe_unificate(n_worker),
+                                              stadi_riga() + [gestore.stadio_temperatura_anno_precedente])
+    _scrivi_dataset(file_output, fieldnames, righe, esporta_csv)
+    print(f"  - Dataset unificato e formalizzato in '{file_output}': NULL gestiti, DATA divisa in ANNO, MESE e GIORNO,")
+    print(f"    eliminate le colonne {COLONNE_DA_ELIMINARE}, aggiunte SIN_GIORNO, COS_GIORNO e {COLONNA_ANNO_PRECEDENTE}.")
+
+    #salviamo i dati dell'ultimo anno in un file apposito
+    unificatore_csv.dati_ultimo_anno(ultimo_anno, esporta_csv=esporta_csv)
+
+
+def _ingestione_incrementale(file_output, ultimo_anno, da_ingerire, n_worker, esporta_csv):
+    # restituisce False (senza toccare il dataset) se i nuovi file non hanno le colonne del dataset
+    mesi_sostituiti = {unificatore_csv.citta_anno_mese(nome_file) for nome_file in da_ingerire}
+    percorsi = [os.path.join(unificatore_csv.cartella_input, nome_file) for nome_file in da_ingerire]
+
+    # le righe arrivano già ordinate per città e data dal merge dei blocchi dei singoli file
+    fieldnames_nuove, righe_nuove = gestore.componi_stadi(unificatore_csv.righe_ordinate(percorsi, n_worker), stadi_riga())
+    righe_nuove = list(righe_nuove)
+
+    fieldnames, righe_dataset = archivio_colonnare.righe(archivio_colonnare.percorso_aggiornato(file_output))
+    if [c for c in fieldnames if c != COLONNA_ANNO_PRECEDENTE] != fieldnames_nuove:
+        return False
+
+    # righe del dataset dei mesi reingeriti: i loro giorni cambiano valore (o spariscono)
+    giorni_cambiati = {_chiave_giorno(riga) for riga in righe_nuove}
+    righe_esistenti = []
+    for riga in righe_dataset:
+        try:
+            mese_riga = (riga['LOCALITA'], int(riga['ANNO']), int(riga['MESE']))
+        except (ValueError, KeyError, TypeError):
+            mese_riga = None
+        if mese_riga in mesi_sostituiti:
+            giorni_cambiati.add(_chiave_giorno(riga))
+        else:
+            righe_esistenti.append(riga)
+
+    righe = list(heapq.merge(righe_esistenti, righe_nuove, key=_chiave_riga))
+
+    # righe da ricalcolare: le nuove e quelle il cui giorno dell'anno precedente (stessa città) è cambiato
+    id_nuove = {id(riga) for riga in righe_nuove}
+    da_ricalcolare = []
+    for i, riga in enumerate(righe):
+        giorno = _chiave_giorno(riga)
+        if id(riga) in id_nuove or (giorno is not None and (giorno[0], giorno[1] - 1) + giorno[2:] in giorni_cambiati):
+            da_ricalcolare.append(i)
+
+    # stesso join per città di stadio_temperatura_anno_precedente, limitato alle righe da ricalcolare
+    for i, valore in zip(da_ricalcolare, gestore.valori_anno_precedente(righe, da_ricalcolare)):
+        righe[i][COLONNA_ANNO_PRECEDENTE] = valore
+
+    _scrivi_dataset(file_output, fieldnames, righe, esporta_csv)
+    print(f"  - Ingeriti {len(da_ingerire)} file nuovi o modificati ({len(righe_nuove)} righe) in '{file_output}'; "
+          f"ricalcolata {COLONNA_ANNO_PRECEDENTE} per {len(da_ricalcolare)} righe.")
+
+    citta_ultimo_anno = {citta for citta, anno, _ in mesi_sostituiti if anno == ultimo_anno}
+    citta_ultimo_anno |= {righe[i]['LOCALITA'] for i in da_ricalcolare if righe[i].get('ANNO') == str(ultimo_anno)}
+    if citta_ultimo_anno:
+        unificatore_csv.dati_ultimo_anno(ultimo_anno, citta_ultimo_anno, esporta_csv)
+    return True
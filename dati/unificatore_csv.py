@@ -1,6 +1,12 @@
 import csv
+import heapq
 import os
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from operator import itemgetter
+
+from dati import archivio_colonnare
+from dati.gestore import invalida_tmedia, scrivi_righe
 
 cartella_input = "dati/dati_meteo_separati_csv"
 prima_volta = False
@@ -11,6 +17,13 @@ mesi = {
     "Settembre": 9, "Ottobre": 10, "Novembre": 11, "Dicembre": 12
 }
 
+# (città, anno, mese) di un file mensile '{Città}-{Anno}-{Mese}.csv', None se il nome non è in questo formato
+def citta_anno_mese(nome_file):
+    parti = os.path.splitext(nome_file)[0].split("-")
+    if len(parti) < 3 or parti[-1] not in mesi or not parti[-2].isdigit():
+        return None
+    return "-".join(parti[:-2]), int(parti[-2]), mesi[parti[-1]]
+
 def chiave_ordinamento(nome_file):
     nome = os.path.splitext(nome_file)[0]
     parti = nome.split("-")
@@ -23,64 +36,95 @@ def chiave_ordinamento(nome_file):
 
     return int(anno), mesi.get(mese, 0)
 
-def unifica_dataset(file_output):
-    tutte_righe = []
-    fieldnames = None
+# legge un file mensile: intestazioni normalizzate e righe (con VISIBILITA km rinominata)
+def leggi_file_sorgente(percorso_file):
+    righe = []
+
+    with open(percorso_file, newline="", encoding="utf-8") as fin:
+        reader = csv.DictReader(fin, delimiter=";")
+
+        # Normalizza intestazioni
+        fieldnames = [f.strip() for f in reader.fieldnames]
+
+        # 🔥 Se esiste VISIBILITA km, rinominala in VISIBILITA m
+        if "VISIBILITA km" in fieldnames:
+            idx = fieldnames.index("VISIBILITA km")
+            fieldnames[idx] = "VISIBILITA m"
+
+        for riga in reader:
+            riga = {k.strip(): v.strip() for k, v in riga.items()}
+
+            # 🔥 Rinomina anche nei dati
+            if "VISIBILITA km" in riga:
+                riga["VISIBILITA m"] = riga.pop("VISIBILITA km")
+
+            righe.append(riga)
 
-    # Legge tutti i file
-    for nome_file in os.listdir(cartella_input):
-        if nome_file.lower().endswith(".csv"):
-            percorso_file = os.path.join(cartella_input, nome_file)
+    return fieldnames, righe
 
-            with open(percorso_file, newline="", encoding="utf-8") as fin:
-                reader = csv.DictReader(fin, delimiter=";")
 
-                # Normalizza intestazioni
-                current_fieldnames = [f.strip() for f in reader.fieldnames]
+# file mensili presenti nella cartella delle sorgenti
+def file_sorgenti():
+    return [nome_file for nome_file in os.listdir(cartella_input) if nome_file.lower().endswith(".csv")]
 
-                # 🔥 Se esiste VISIBILITA km, rinominala in VISIBILITA m
-                if "VISIBILITA km" in current_fieldnames:
-                    idx = current_fieldnames.index("VISIBILITA km")
-                    current_fieldnames[idx] = "VISIBILITA m"
 
-                # Salviamo le intestazioni una sola volta
-                if fieldnames is None:
-                    fieldnames = current_fieldnames
+# chiave di ordinamento (città, data) di una riga sorgente, calcolata una volta sola per riga
+def chiave_riga_sorgente(riga):
+    localita = riga.get("LOCALITA", "")
+    # Converte gg/mm/aaaa in data per ordinamento corretto
+    try:
+        giorno, mese, anno = riga.get("DATA", "").split("/")
+        data = date(int(anno), int(mese), int(giorno))
+    except ValueError:
+        data = date(1900, 1, 1)  # default in caso di errore
+    return (localita.lower(), data)
 
-                for riga in reader:
-                    riga = {k.strip(): v.strip() for k, v in riga.items()}
 
-                    # 🔥 Rinomina anche nei dati
-                    if "VISIBILITA km" in riga:
-                        riga["VISIBILITA m"] = riga.pop("VISIBILITA km")
+# legge un file mensile e restituisce intestazioni e blocco di coppie (chiave, riga) già ordinato
+def leggi_blocco_ordinato(percorso_file):
+    fieldnames, righe = leggi_file_sorgente(percorso_file)
+    return fieldnames, sorted(((chiave_riga_sorgente(riga), riga) for riga in righe), key=itemgetter(0))
 
-                    tutte_righe.append(riga)
 
-                    
-    # Ordina prima per LOCALITA, poi per DATA
-    def chiave_ordinamento(riga):
-        localita = riga.get("LOCALITA", "")
-        data_str = riga.get("DATA", "01/01/1900")
-        # Converte gg/mm/aaaa in datetime per ordinamento corretto
-        try:
-            data = datetime.strptime(data_str, "%d/%m/%Y")
-        except ValueError:
-            data = datetime(1900, 1, 1)  # default in caso di errore
-        return (localita.lower(), data)
+# legge i file indicati (in parallelo con n_worker processi, None = numero di core) e fonde
+# i blocchi ordinati con un merge a k vie: restituisce le intestazioni del primo file e
+# l'iteratore delle righe ordinate per città e data
+def righe_ordinate(percorsi, n_worker=None):
+    if n_worker is None:
+        n_worker = os.cpu_count() or 1
+    n_worker = max(1, min(n_worker, len(percorsi)))
 
-    tutte_righe.sort(key=chiave_ordinamento)
+    if n_worker > 1:
+        with ProcessPoolExecutor(max_workers=n_worker) as pool:
+            blocchi = list(pool.map(leggi_blocco_ordinato, percorsi,
+                                    chunksize=max(1, len(percorsi) // (n_worker * 4))))
+    else:
+        blocchi = [leggi_blocco_ordinato(percorso) for percorso in percorsi]
 
+    # Salviamo le intestazioni una sola volta
+    fieldnames = blocchi[0][0] if blocchi else None
+    # a parità di chiave heapq.merge preferisce il blocco che viene prima: stesso ordine di un sort stabile
+    unione = heapq.merge(*(blocco for _, blocco in blocchi), key=itemgetter(0))
+    return fieldnames, (riga for _, riga in unione)
+
+
+# sorgente della pipeline di formalizzazione (gestore.esegui_pipeline):
+# restituisce le intestazioni e le righe di tutti i file mensili, ordinate per città e data
+def righe_unificate(n_worker=None):
+    return righe_ordinate([os.path.join(cartella_input, nome_file) for nome_file in file_sorgenti()], n_worker)
+
+
+def unifica_dataset(file_output, n_worker=None):
     # Scrive file unificato
-    with open(file_output, "w", newline="", encoding="utf-8") as fout:
-        writer = csv.DictWriter(fout, fieldnames=fieldnames, delimiter=";")
-        writer.writeheader()
-        writer.writerows(tutte_righe)
+    scrivi_righe(file_output, *righe_unificate(n_worker))
 
     print(f"  - E' stato creato il dataset unificato ordinato per città e data in '{file_output}'.")
 
 
 
-def dati_ultimo_anno(ultimo_anno):
+# citta: se indicata, rigenera solo i file di queste località
+# esporta_csv: oltre all'archivio colonnare di ogni città scrive anche il CSV
+def dati_ultimo_anno(ultimo_anno, citta=None, esporta_csv=True):
     cartella_output = "dati/dati_ultimo_anno"
     file_input = "dati/dataset_meteo_unificato.csv"
 
@@ -89,35 +133,43 @@ def dati_ultimo_anno(ultimo_anno):
     # Dizionario: {localita: lista_righe}
     dati_per_citta = {}
 
-    with open(file_input, mode="r", newline="", encoding="utf-8-sig") as infile:
-        reader = csv.DictReader(infile, delimiter=";")
+    # le righe sono lette dall'archivio colonnare del dataset, con lo stesso testo del CSV
+    fieldnames, righe_dataset = archivio_colonnare.righe(archivio_colonnare.percorso_aggiornato(file_input))
 
-        # Normalizza nomi colonne (evita problemi di spazi)
-        reader.fieldnames = [name.strip() for name in reader.fieldnames]
+    for row in righe_dataset:
+        if row.get("ANNO") == str(ultimo_anno):
+            localita = row.get("LOCALITA")
+            if citta is not None and localita not in citta:
+                continue
 
-        for row in reader:
-            row = {k.strip(): v.strip() for k, v in row.items()}
+            if localita not in dati_per_citta:
+                dati_per_citta[localita] = []
 
-            if row.get("ANNO") == str(ultimo_anno):
-                localita = row.get("LOCALITA")
-
-                if localita not in dati_per_citta:
-                    dati_per_citta[localita] = []
-
-                dati_per_citta[localita].append(row)
+            dati_per_citta[localita].append(row)
 
     # Creazione file per ogni città
     for localita, righe in dati_per_citta.items():
         nome_file = f"ultimo_anno_{localita}.csv"
         percorso_file = os.path.join(cartella_output, nome_file)
 
-        with open(percorso_file, mode="w", newline="", encoding="utf-8") as outfile:
-            writer = csv.DictWriter(outfile, fieldnames=reader.fieldnames, delimiter=";")
-            writer.writeheader()
-            writer.writerows(righe)
+        if esporta_csv:
+            with open(percorso_file, mode="w", newline="", encoding="utf-8") as outfile:
+                writer = csv.DictWriter(outfile, fieldnames=fieldnames, delimiter=";")
+                writer.writeheader()
+                writer.writerows(righe)
+
+        # l'archivio viene scritto dopo il CSV, così risulta il più recente dei due
+        archivio_colonnare.scrivi(archivio_colonnare.percorso_archivio(percorso_file), fieldnames, righe)
 
         print(f"           - Creato file contenente i dati dell'anno {ultimo_anno} a {localita}: {nome_file}")
 
+    # le temperature dell'ultimo anno eventualmente già in memoria non sono più valide
+    if citta is None:
+        invalida_tmedia()
+    else:
+        for localita in dati_per_citta:
+            invalida_tmedia(localita)
+
     print(f"  - Tutti i file dell'anno {ultimo_anno} sono stati salvati in '{cartella_output}'.")
 
  
\ No newline at end of file
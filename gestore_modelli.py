@@ -1,22 +1,45 @@
-import pandas as pd
+import contextlib
+import importlib
+import io
+import numpy as np
 import json
 import os
-from dati.gestore import leggi_tmedia
-
-# Importiamo i moduli dei modelli
-import xgboost_train_and_test
-import random_forest_train_and_test
-import linear_regression_train_and_test
-# import extratrees_train_and_test
-
-# Mappa per richiamare i moduli dinamicamente
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+import manifest_training
+import modelli_compatti
+from dati.gestore import carica_dataset_per_citta, dati_localita, anno_ultimo_osservato, allinea_temperature_anno, versione_tmedia, features_date, COLONNE_FEATURES
+import registro_modelli
+
+# Mappa per richiamare i moduli dinamicamente.
+# I moduli (e con loro sklearn/xgboost/pandas) vengono importati solo quando
+# servono, tramite modulo_modello(): chi usa solo le previsioni in cache non li carica.
 MAPPA_MODELLI = {
-    'xgboost': xgboost_train_and_test,
-    'random_forest': random_forest_train_and_test,
-    'linear_regression': linear_regression_train_and_test,
-    # 'extratrees': extratrees_train_and_test
+    'xgboost': 'xgboost_train_and_test',
+    'random_forest': 'random_forest_train_and_test',
+    'linear_regression': 'linear_regression_train_and_test',
+    'globale': 'globale_train_and_test',
+    # 'extratrees': 'extratrees_train_and_test'
 }
 
+
+# Famiglie con un solo modello per tutte le città: il loro train_and_test riceve
+# l'elenco delle città e restituisce { città: (rmse, dev_standard) }, e il modulo
+# espone predizione_annuale_array_citta per predire più città con una sola predict.
+FAMIGLIE_MULTI_CITTA = {'globale'}
+
+
+def modulo_modello(nome_modello):
+    return importlib.import_module(MAPPA_MODELLI[nome_modello])
+
+
+def file_modello(nome_modello, citta):
+    """File .pkl del modello addestrato (unico per tutte le città nelle famiglie multi-città)."""
+    if nome_modello in FAMIGLIE_MULTI_CITTA:
+        return f'modelli/modello_{nome_modello}.pkl'
+    return f'modelli/modello_{nome_modello}_{citta}.pkl'
+
 FILE_CONFIG_BEST_MODELS = 'modelli/migliori_modelli.json'
 
 # Peso relativo della deviazione standard nello score composito.
@@ -25,8 +48,49 @@ FILE_CONFIG_BEST_MODELS = 'modelli/migliori_modelli.json'
 # Abbassare ALPHA (es. 0.5) per privilegiare l'RMSE sulla variabilità.
 ALPHA_STD_DEV = 0.3 # nel tempo la deviazione standard tende a "cancellarsi" a differenza dell'mrse quindi diamo più peso a quest'ultimo
 
+# Costo relativo stimato dell'addestramento di ciascuna famiglia:
+# le coppie (città, modello) più pesanti vengono avviate per prime.
+COSTO_MODELLI = {
+    'random_forest': 3,
+    'xgboost': 2,
+    'linear_regression': 1,
+    'globale': 4,
+}
+
+
+def ripartisci_core(n_job, core_budget=None):
+    """
+    Divide il budget di core (None = tutti i core della macchina) tra processi
+    paralleli e thread interni a ciascun addestramento, in modo che
+    processi * thread non superi mai il budget.
+    Restituisce (n_processi, n_thread).
+    """
+    core = core_budget or os.cpu_count() or 1
+    n_processi = max(1, min(n_job, core))
+    return n_processi, max(1, core // n_processi)
+
+
+def _addestra_coppia(dati, target_column, localita, nome_modello, anno_test, n_thread, ricerca, retrain):
+    # Eseguita in un processo worker: riceve solo le partizioni delle città che le servono,
+    # limita i thread di BLAS/OpenMP al budget assegnato e cattura l'output
+    # così che il processo principale lo stampi in ordine.
+    # Per le famiglie multi-città 'localita' è l'elenco delle città.
+    from threadpoolctl import threadpool_limits
+
+    buffer = io.StringIO()
+    with threadpool_limits(limits=n_thread), contextlib.redirect_stdout(buffer):
+        risultato = modulo_modello(nome_modello).train_and_test(
+            dati, target_column, localita, anno_test, n_thread=n_thread, ricerca=ricerca, retrain=retrain
+        )
+    return risultato, buffer.getvalue()
+
 
-def esegui_confronto_e_training(dataset, target_column, anno_test, citta_list):
+def esegui_confronto_e_training(dataset, target_column, anno_test, citta_list, core_budget=None, ricerca=None,
+                                forza_training=False, retrain=None):
+    # ricerca: strategia e budget della ricerca degli iperparametri (None = griglia esaustiva)
+    # retrain: modalità del retrain finale di Random Forest e XGBoost (None = completo, vedi retrain_finale)
+    # forza_training: riaddestra tutte le coppie ignorando il manifest di training
+    import pandas as pd
 
     modelli_nomi = list(MAPPA_MODELLI.keys())
 
@@ -39,16 +103,111 @@ def esegui_confronto_e_training(dataset, target_column, anno_test, citta_list):
 
     print("=== INIZIO TRAINING E CONFRONTO MODELLI ===")
 
+    # Il dataset viene letto, ripulito e diviso per città una sola volta:
+    # tutti i train_and_test ricevono direttamente i DataFrame già pronti.
+    if isinstance(dataset, str):
+        print(f"   > Caricamento del dataset '{dataset}'")
+        dataset = carica_dataset_per_citta(dataset, target_column)
+
+    # Le coppie (città, modello) sono indipendenti: con più core disponibili vengono
+    # addestrate in parallelo, ciascuna con una quota fissa del budget di core.
+    coppie = [(localita, nome_modello) for localita in citta_list for nome_modello in MAPPA_MODELLI]
+
+    # Le coppie con dati, griglia, features e codice invariati rispetto al manifest
+    # non vengono riaddestrate: si riusano le metriche salvate.
+    # Per le famiglie multi-città l'impronta dei dati copre tutte le città.
+    manifest = manifest_training.carica()
+    dati_tutte_le_citta = pd.concat([dati_localita(dataset, target_column, c) for c in citta_list])
+    impronte = {}
+    metriche_salvate = {}
+    for localita, nome_modello in coppie:
+        dati_impronta = dati_tutte_le_citta if nome_modello in FAMIGLIE_MULTI_CITTA \
+            else dati_localita(dataset, target_column, localita)
+        impronte[(localita, nome_modello)] = manifest_training.impronta(
+            dati_impronta, target_column, anno_test, modulo_modello(nome_modello), ricerca, retrain
+        )
+        if not forza_training:
+            metriche = manifest_training.metriche_valide(manifest, localita, nome_modello,
+                                                         impronte[(localita, nome_modello)],
+                                                         file_modello(nome_modello, localita))
+            if metriche is not None:
+                metriche_salvate[(localita, nome_modello)] = metriche
+
+    # un modello multi-città da riaddestrare per una città viene riaddestrato (e rivalutato) per tutte
+    for nome_modello in FAMIGLIE_MULTI_CITTA & set(MAPPA_MODELLI):
+        if any((localita, nome_modello) not in metriche_salvate for localita in citta_list):
+            for localita in citta_list:
+                metriche_salvate.pop((localita, nome_modello), None)
+
+    # Un job per ogni coppia da addestrare, uno solo per ciascuna famiglia multi-città
+    def chiave_job(localita, nome_modello):
+        return (None, nome_modello) if nome_modello in FAMIGLIE_MULTI_CITTA else (localita, nome_modello)
+
+    def dati_job(localita, nome_modello):
+        if localita is None:
+            return {c: dati_localita(dataset, target_column, c) for c in citta_list}, list(citta_list)
+        return {localita: dati_localita(dataset, target_column, localita)}, localita
+
+    jobs = list(dict.fromkeys(chiave_job(*coppia) for coppia in coppie if coppia not in metriche_salvate))
+    print(f"   > Coppie città/modello da addestrare: {len(coppie) - len(metriche_salvate)} "
+          f"in {len(jobs)} job (invariate: {len(metriche_salvate)})")
+    n_processi, n_thread = ripartisci_core(max(1, len(jobs)), core_budget)
+    print(f"   > Budget di core: {n_processi} processi x {n_thread} thread")
+
+    futuri = {}
+    executor = None
+    if n_processi > 1:
+        executor = ProcessPoolExecutor(max_workers=n_processi)
+        for localita, nome_modello in sorted(jobs, key=lambda c: -COSTO_MODELLI.get(c[1], 1)):
+            dati, localita_job = dati_job(localita, nome_modello)
+            futuri[(localita, nome_modello)] = executor.submit(
+                _addestra_coppia, dati, target_column, localita_job, nome_modello, anno_test, n_thread, ricerca,
+                retrain
+            )
+
+    risultati_job = {}
+
+    def risultato_job(chiave):
+        # risultato di train_and_test per il job, calcolato (o atteso dal pool) una sola volta
+        if chiave not in risultati_job:
+            if chiave in futuri:
+                # addestramento già avviato nel pool: attendiamo il risultato e ne stampiamo l'output
+                risultati_job[chiave], output = futuri[chiave].result()
+                print(output, end='')
+            else:
+                localita, nome_modello = chiave
+                _, localita_job = dati_job(localita, nome_modello)
+                risultati_job[chiave] = modulo_modello(nome_modello).train_and_test(
+                    dataset, target_column, localita_job, anno_test, n_thread=n_thread, ricerca=ricerca,
+                    retrain=retrain
+                )
+        return risultati_job[chiave]
+
     for localita in citta_list:
         print(f"\n>>>> Elaborazione città: {localita}")
         best_score = float('inf')
         best_model_name = None
 
-        for nome_modello, modulo in MAPPA_MODELLI.items():
+        for nome_modello in MAPPA_MODELLI:
             print(f"   > Training modello: {nome_modello}")
 
             # train_and_test ora restituisce (rmse, dev_standard)
-            rmse, dev_standard = modulo.train_and_test(dataset, target_column, localita, anno_test)
+            if (localita, nome_modello) in metriche_salvate:
+                rmse, dev_standard = metriche_salvate[(localita, nome_modello)]
+                print("   - Dati, griglia e codice invariati: riuso delle metriche del manifest")
+            elif nome_modello in FAMIGLIE_MULTI_CITTA:
+                # il modello multi-città viene addestrato alla prima città e valutato su ciascuna
+                metriche = risultato_job(chiave_job(localita, nome_modello)).get(localita)
+                if metriche is None:
+                    print(f"   - Nessun dato di test per {localita}: modello escluso dal confronto")
+                    continue
+                rmse, dev_standard = metriche
+            else:
+                rmse, dev_standard = risultato_job(chiave_job(localita, nome_modello))
+
+            if (localita, nome_modello) not in metriche_salvate:
+                manifest_training.registra(manifest, localita, nome_modello, impronte[(localita, nome_modello)],
+                                           rmse, dev_standard)
 
             # Salviamo le due metriche nelle rispettive matrici
             risultati_rmse[nome_modello][localita] = rmse
@@ -77,6 +236,9 @@ def esegui_confronto_e_training(dataset, target_column, anno_test, citta_list):
         print(f"   *** Miglior modello per {localita}: {best_model_name} "
               f"(RMSE: {rmse_best} | Std: {std_best} | Score: {rmse_best + ALPHA_STD_DEV * std_best:.3f}) ***")
 
+    if executor is not None:
+        executor.shutdown()
+
     # ===================================================================
     # MATRICE DI CONFRONTO — unico CSV con RMSE e Std Dev affiancati
     # ===================================================================
@@ -130,6 +292,9 @@ def esegui_confronto_e_training(dataset, target_column, anno_test, citta_list):
 
     print(f"\nAssociazione modelli migliori salvata in '{FILE_CONFIG_BEST_MODELS}'")
 
+    manifest_training.salva(manifest)
+    print(f"Manifest di training salvato in '{manifest_training.FILE_MANIFEST}'")
+
     # Salvataggio CSV unico con entrambe le metriche affiancate per città
     os.makedirs('dati', exist_ok=True)
     df_confronto.to_csv('dati/confronto_metriche_modelli.csv', sep=';', decimal=',')
@@ -139,46 +304,245 @@ def esegui_confronto_e_training(dataset, target_column, anno_test, citta_list):
 def predici_temperatura_localita(localita, anno, mese, giorno):
     """
     Individua il modello migliore per la località, recupera la t_media anno prec
-    e chiama la funzione 'predici' del modulo corretto.
+    e restituisce la temperatura prevista per il giorno indicato.
     """
+    predizioni = predici_temperature_localita(localita, [anno], [mese], [giorno])
+
+    if predizioni is not None and not np.isnan(predizioni[0]):
+        return float(predizioni[0])
+    return None
+
+
+def predici_temperature_localita(localita, anni, mesi, giorni, nome_modello=None):
+    """
+    Versione batch di predici_temperatura_localita: date come array paralleli di
+    anni, mesi e giorni, una sola predict per tutte le righe. Restituisce un array
+    di temperature (NaN per le date non valide) o None se il modello non è disponibile.
+    Con 'nome_modello' si usa quella famiglia di modelli invece della migliore.
+    """
+    modello_scelto = nome_modello or modello_scelto_citta(localita)
+    if not modello_scelto:
+        return None
+
+    try:
+        modello = registro_modelli.carica_modello(percorso_modello(modello_scelto, localita))
+    except FileNotFoundError:
+        print(f"Errore: Modello {modello_scelto} per {localita} non trovato. Eseguire prima il training.", file=sys.stderr)
+        return None
+    # come in random_forest_train_and_test.predici: niente thread paralleli per batch piccoli
+    if hasattr(modello, 'get_params') and 'n_jobs' in modello.get_params():
+        modello.set_params(n_jobs=1)
+
+    matrice, valide = features_date(localita, anni, mesi, giorni)
+    predizioni = np.full(len(valide), np.nan)
+    if valide.any() and hasattr(modello, 'predict_citta'):
+        # modello multi-città: la città diventa una feature
+        predizioni[valide] = modello.predict_citta(localita, matrice[valide])
+    elif valide.any():
+        import pandas as pd
+        input_data = pd.DataFrame(matrice[valide], columns=COLONNE_FEATURES)
+        input_data['ANNO'] = input_data['ANNO'].astype(int)
+        predizioni[valide] = modello.predict(input_data)
+    return predizioni
+
+
+def predici_temperature_anno_citta(citta, anno):
     if not os.path.exists(FILE_CONFIG_BEST_MODELS):
-        print("Errore: File configurazione modelli non trovato. Esegui prima il training.")
+        print("Errore: File configurazione modelli non trovato.", file=sys.stderr)
+        return {}
+
+    with open(FILE_CONFIG_BEST_MODELS, 'r') as f:
+        config = json.load(f)
+
+    modello_scelto = config.get(citta)
+
+    if not modello_scelto:
+        print(f"Errore: Nessun modello associato alla località {citta}", file=sys.stderr)
+        return {}
+
+    modulo = modulo_modello(modello_scelto)
+    risultato = modulo.predizione_annuale(citta, anno)
+
+    return risultato
+
+
+def modello_scelto_citta(citta):
+    """Nome del modello migliore associato alla città in FILE_CONFIG_BEST_MODELS (None se assente)."""
+    if not os.path.exists(FILE_CONFIG_BEST_MODELS):
+        print("Errore: File configurazione modelli non trovato.", file=sys.stderr)
         return None
 
     with open(FILE_CONFIG_BEST_MODELS, 'r') as f:
         config = json.load(f)
 
-    modello_scelto = config.get(localita)
+    modello_scelto = config.get(citta)
 
     if not modello_scelto:
-        print(f"Errore: Nessun modello associato alla località {localita}")
+        print(f"Errore: Nessun modello associato alla località {citta}", file=sys.stderr)
         return None
 
-    temp_anno_prec = leggi_tmedia(localita, mese, giorno)
+    return modello_scelto
 
-    modulo = MAPPA_MODELLI[modello_scelto]
-    predizione = modulo.predici(localita, anno, mese, giorno, temp_anno_prec)
 
-    if predizione is not None:
-        return predizione[0]
-    return None
+def percorso_modello(nome_modello, citta):
+    """File usato per l'inferenza: il formato compatto .npz se aggiornato, altrimenti il .pkl."""
+    return modelli_compatti.percorso_preferito(file_modello(nome_modello, citta))
 
 
-def predici_temperature_anno_citta(citta, anno):
+# Previsioni annuali già calcolate dalla catena pluriennale:
+# (citta, percorso modello, mtime modello, versione dati ultimo anno, anno) -> array
+_PREVISIONI_ANNUALI = {}
+
+
+def predici_array_temperature_anno_citta(citta, anno):
+    """
+    Come predici_temperature_anno_citta, ma restituisce direttamente l'array
+    delle temperature indicizzato per giorno dell'anno (una sola predict batch).
+    """
+    previsioni = predici_anni_citta(citta, [anno])
+    if previsioni is None:
+        return None
+    return previsioni[anno]
+
+
+def citta_con_modello_condiviso(citta_list):
+    """Città di 'citta_list' il cui modello migliore è di una famiglia multi-città."""
     if not os.path.exists(FILE_CONFIG_BEST_MODELS):
-        print("Errore: File configurazione modelli non trovato.")
-        return {}
+        return []
 
     with open(FILE_CONFIG_BEST_MODELS, 'r') as f:
         config = json.load(f)
 
-    modello_scelto = config.get(citta)
+    return [citta for citta in citta_list if config.get(citta) in FAMIGLIE_MULTI_CITTA]
+
+
+def predici_array_temperature_anno_gruppo(citta_list, anno):
+    """
+    Come predici_array_temperature_anno_citta per più città: { città: array o None }.
+    Le città che condividono un modello multi-città vengono predette insieme, con una
+    sola predict per ogni anno della catena (predizione_annuale_array_citta del modulo);
+    le altre una alla volta.
+    """
+    risultato = {}
+    gruppi = {}
+    for citta in citta_list:
+        modello_scelto = modello_scelto_citta(citta)
+        if modello_scelto in FAMIGLIE_MULTI_CITTA:
+            gruppi.setdefault(modello_scelto, []).append(citta)
+        elif modello_scelto:
+            risultato[citta] = predici_array_temperature_anno_citta(citta, anno)
+        else:
+            risultato[citta] = None
+
+    for modello_scelto, gruppo in gruppi.items():
+        risultato.update(_predici_anno_gruppo(modello_scelto, gruppo, anno))
+
+    return {citta: risultato[citta] for citta in citta_list}
+
+
+def _predici_anno_gruppo(modello_scelto, gruppo, anno):
+    # stessa catena pluriennale (e stesse chiavi di _PREVISIONI_ANNUALI) di predici_anni_citta,
+    # ma a ogni anno della catena le città del gruppo ancora da calcolare vanno in un'unica predict
+    modulo = modulo_modello(modello_scelto)
+    file_modello = percorso_modello(modello_scelto, gruppo[0])
+    if not os.path.exists(file_modello):
+        print(f"Errore: Modello '{file_modello}' non trovato. Eseguire prima il training.", file=sys.stderr)
+        return {citta: None for citta in gruppo}
+
+    chiave_base = (file_modello, os.stat(file_modello).st_mtime_ns, versione_tmedia())
+    inizio_catena = {}
+    for citta in gruppo:
+        anno_base = anno_ultimo_osservato(citta)
+        inizio_catena[citta] = anno if anno_base is None else min(anno, anno_base + 1)
+
+    previsioni_prec = {}
+    for anno_catena in range(min(inizio_catena.values()), anno + 1):
+        attive = [citta for citta in gruppo if inizio_catena[citta] <= anno_catena]
+        chiavi = {citta: (citta,) + chiave_base + (anno_catena,) for citta in attive}
+        mancanti = [citta for citta in attive if chiavi[citta] not in _PREVISIONI_ANNUALI]
+
+        if mancanti:
+            temp_anno_prec = {
+                citta: allinea_temperature_anno(previsioni_prec[citta], anno_catena - 1, anno_catena)
+                for citta in mancanti if citta in previsioni_prec
+            }
+            previsioni = modulo.predizione_annuale_array_citta(mancanti, anno_catena, temp_anno_prec)
+            if previsioni is None:
+                return {citta: None for citta in gruppo}
+            for citta in mancanti:
+                _PREVISIONI_ANNUALI[chiavi[citta]] = previsioni[citta]
+
+        for citta in attive:
+            previsioni_prec[citta] = _PREVISIONI_ANNUALI[chiavi[citta]]
+
+    return {citta: previsioni_prec[citta] for citta in gruppo}
+
+
+def predici_anni_citta(citta, anni):
+    """
+    Predice le temperature giornaliere di più anni per la città, restituendo
+    { anno: array indicizzato per giorno dell'anno } (None se manca il modello).
 
+    L'anno successivo all'ultimo osservato usa come TEMPERATURA_MEDIA_ANNO_PRECEDENTE
+    i dati reali dell'ultimo anno; per ogni anno Y successivo si usano le
+    predizioni dell'anno Y-1, calcolate anche se non richieste e tenute in memoria.
+    """
+    modello_scelto = modello_scelto_citta(citta)
     if not modello_scelto:
-        print(f"Errore: Nessun modello associato alla località {citta}")
-        return {}
+        return None
 
-    modulo = MAPPA_MODELLI[modello_scelto]
-    risultato = modulo.predizione_annuale(citta, anno)
+    modulo = modulo_modello(modello_scelto)
+    file_modello = percorso_modello(modello_scelto, citta)
+    if not os.path.exists(file_modello):
+        print(f"Errore: Modello '{file_modello}' non trovato. Eseguire prima il training.", file=sys.stderr)
+        return None
+
+    anno_base = anno_ultimo_osservato(citta)
+    chiave_base = (citta, file_modello, os.stat(file_modello).st_mtime_ns, versione_tmedia())
+
+    risultato = {}
+    for anno in sorted(set(anni)):
+        # Gli anni fino a quello successivo all'ultimo osservato partono dai dati reali,
+        # gli altri risalgono la catena a partire da quell'anno.
+        inizio_catena = anno if anno_base is None else min(anno, anno_base + 1)
+        previsioni_prec = None
+
+        for anno_catena in range(inizio_catena, anno + 1):
+            chiave = chiave_base + (anno_catena,)
+            if chiave not in _PREVISIONI_ANNUALI:
+                temp_anno_prec = None
+                if previsioni_prec is not None:
+                    temp_anno_prec = allinea_temperature_anno(previsioni_prec, anno_catena - 1, anno_catena)
+
+                previsioni = modulo.predizione_annuale_array(citta, anno_catena, temp_anno_prec)
+                if previsioni is None:
+                    return None
+                _PREVISIONI_ANNUALI[chiave] = previsioni
+
+            previsioni_prec = _PREVISIONI_ANNUALI[chiave]
+
+        risultato[anno] = previsioni_prec
+
+    return risultato
+
+
+def predici_intervallo_citta(citta, data_inizio, data_fine):
+    """
+    Temperature previste per ogni giorno da 'data_inizio' a 'data_fine' (incluse),
+    anche a cavallo di più anni, come un unico array (None se manca il modello).
+    """
+    if data_fine < data_inizio:
+        raise ValueError(f"Intervallo non valido: la data finale {data_fine} precede la data iniziale {data_inizio}")
+
+    anni = range(data_inizio.year, data_fine.year + 1)
+    previsioni = predici_anni_citta(citta, anni)
+    if previsioni is None:
+        return None
+
+    tratti = []
+    for anno in anni:
+        inizio = (data_inizio - date(anno, 1, 1)).days if anno == data_inizio.year else 0
+        fine = (data_fine - date(anno, 1, 1)).days + 1 if anno == data_fine.year else len(previsioni[anno])
+        tratti.append(previsioni[anno][inizio:fine])
 
-    return risultato
\ No newline at end of file
+    return np.concatenate(tratti)
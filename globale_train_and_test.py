@@ -0,0 +1,268 @@
+"""
+Famiglia "globale": un solo XGBoost per tutte le città, con la città (e l'anagrafica) come
+feature; train_and_test riceve l'elenco delle città.
+"""
+
+import json
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import joblib
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.metrics import root_mean_squared_error
+from sklearn.model_selection import TimeSeriesSplit
+
+from dati.gestore import COLONNE_FEATURES, dati_localita, features_anno, features_date, leggi_tmedia
+import registro_modelli
+import retrain_finale
+import ricerca_iperparametri
+from xgboost_train_and_test import PARAM_GRID, TREE_METHOD, round_early_stopping
+
+FILE_MODELLO = 'modelli/modello_globale.pkl'
+FILE_ANAGRAFICA = 'dati/anagrafica_citta.json'
+COLONNE_ANAGRAFICA = ['LATITUDINE', 'ALTITUDINE']
+
+
+def carica_anagrafica():
+    """{ città: {LATITUDINE, ALTITUDINE} } da FILE_ANAGRAFICA, vuoto se il file non esiste."""
+    if not os.path.exists(FILE_ANAGRAFICA):
+        return {}
+    with open(FILE_ANAGRAFICA, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class ModelloGlobale:
+    """XGBoost multi-città con la codifica delle città e l'anagrafica usate in addestramento."""
+
+    def __init__(self, modello, citta, anagrafica):
+        self.modello = modello
+        self.citta = list(citta)
+        self.anagrafica = {c: anagrafica[c] for c in self.citta if c in anagrafica}
+        self.colonne = COLONNE_FEATURES + ['CITTA'] + (COLONNE_ANAGRAFICA if self.anagrafica else [])
+
+    def matrice(self, citta, X):
+        """
+        Aggiunge alle feature X (righe di 'citta', scalare o array) il codice della
+        città e l'anagrafica; le città non viste in addestramento hanno codice NaN.
+        """
+        X = pd.DataFrame(np.asarray(X, dtype=float), columns=COLONNE_FEATURES)
+        citta = np.broadcast_to(np.asarray(citta, dtype=object), len(X))
+        codici = {c: i for i, c in enumerate(self.citta)}
+        X['CITTA'] = [codici.get(c, np.nan) for c in citta]
+        if self.anagrafica:
+            for colonna in COLONNE_ANAGRAFICA:
+                X[colonna] = [self.anagrafica.get(c, {}).get(colonna, np.nan) for c in citta]
+        X['ANNO'] = X['ANNO'].astype(int)
+        return X[self.colonne]
+
+    def predict_citta(self, citta, X):
+        return self.modello.predict(self.matrice(citta, X)).astype(float)
+
+
+def _tipi_feature(colonne):
+    return ['c' if colonna == 'CITTA' else 'q' for colonna in colonne]
+
+
+def train_and_test(dataset, target_column, citta_list, anno_test, n_thread=-1, ricerca=None, retrain=None):
+    # dataset: percorso del CSV oppure dizionario {localita: DataFrame} di carica_dataset_per_citta
+    # n_thread, ricerca, retrain: come negli altri moduli *_train_and_test
+    # Restituisce { città: (rmse, dev_standard) } sull'anno di test
+    # ===============================
+    # 1. CARICAMENTO DATI
+    # ===============================
+    anagrafica = carica_anagrafica()
+    citta_con_dati = [c for c in citta_list if len(dati_localita(dataset, target_column, c))]
+    df_clean = pd.concat([dati_localita(dataset, target_column, c) for c in citta_con_dati], ignore_index=True)
+    # ordine temporale su tutte le città, necessario per TimeSeriesSplit
+    df_clean = df_clean.sort_values(['ANNO', 'MESE', 'GIORNO'], kind='stable', ignore_index=True)
+
+    modello_vuoto = ModelloGlobale(None, citta_con_dati, anagrafica)
+    X_tutte = modello_vuoto.matrice(df_clean['LOCALITA'].astype(str).to_numpy(), df_clean[COLONNE_FEATURES])
+    y_tutte = df_clean[target_column].reset_index(drop=True)
+
+    # ===============================
+    # 2. SPLIT TEMPORALE
+    # ===============================
+    train = (df_clean['ANNO'] < anno_test).to_numpy()
+    test = (df_clean['ANNO'] == anno_test).to_numpy()
+    X_train, y_train = X_tutte[train].reset_index(drop=True), y_tutte[train].reset_index(drop=True)
+    X_test, y_test = X_tutte[test], y_tutte[test]
+
+    print(f"   - [Globale] Training sugli anni antecedenti al {anno_test} per {len(citta_con_dati)} città "
+          f"(Train size: {len(X_train)})")
+    print(f"   - [Globale] Test sull'anno {anno_test} (Test size: {len(X_test)})")
+
+    # ===============================
+    # 3. GRID SEARCH
+    # ===============================
+    xgb_model = xgb.XGBRegressor(
+        objective='reg:squarederror',
+        tree_method=TREE_METHOD,
+        enable_categorical=True,
+        feature_types=_tipi_feature(modello_vuoto.colonne),
+        random_state=42,
+        n_jobs=n_thread
+    )
+
+    tscv = TimeSeriesSplit(n_splits=5)
+
+    t_start = time.perf_counter()
+    param_grid, split_cv = round_early_stopping(xgb_model, PARAM_GRID, X_train, y_train, tscv)
+    print(f"   - [Globale] Round scelti con early stopping in {time.perf_counter() - t_start:.2f} s")
+
+    print("   - [Globale] Addestramento con TimeSeriesSplit iniziato.")
+    grid_search = ricerca_iperparametri.esegui_ricerca(xgb_model, param_grid, X_train, y_train, split_cv, ricerca,
+                                                       n_jobs=n_thread)
+    print("   - [Globale] Addestramento completato.")
+    print(f"            - Migliori parametri: {grid_search.best_params_}")
+
+    pred_test = grid_search.best_estimator_.predict(X_test)
+
+    # ===============================
+    # 4. METRICHE PER CITTÀ
+    # ===============================
+    risultati_citta = {}
+    citta_test = df_clean.loc[test, 'LOCALITA'].astype(str).to_numpy()
+    os.makedirs('dati/risultati_dei_modelli', exist_ok=True)
+    for citta in citta_con_dati:
+        righe = citta_test == citta
+        if not righe.any():
+            continue
+        residui = y_test[righe].to_numpy() - pred_test[righe]
+        rmse = root_mean_squared_error(y_test[righe], pred_test[righe])
+        dev_standard = float(np.std(residui))
+        risultati_citta[citta] = (round(rmse, 3), round(dev_standard, 3))
+        print(f"            - {citta}: RMSE {rmse:.3f} °C | Std {dev_standard:.3f} °C | "
+              f"Bias {float(np.mean(residui)):.3f} °C")
+
+        risultati = df_clean[test][righe].copy()
+        risultati["PRED_GLOBALE"] = np.round(pred_test[righe], 2)
+        risultati.to_csv(f'./dati/risultati_dei_modelli/predizioni_globale_{citta}.csv',
+                         index=False, sep=';', decimal=',')
+
+    # -----------------------------------------------------------------------
+    # Salvataggio parametri
+    results_df = pd.DataFrame(grid_search.cv_results_)
+    results_df['TEMPO_FIT_MEDIO_S'] = results_df['mean_fit_time']
+    colonne_interessanti = [col for col in results_df.columns if 'param_' in col or 'mean_test_score' in col]
+    results_df = results_df[colonne_interessanti + ['TEMPO_FIT_MEDIO_S']]
+    results_df['mean_test_score'] = -results_df['mean_test_score']
+    results_df = results_df.rename(columns={'mean_test_score': 'RMSE_medio_CV'})
+    for citta, (rmse, dev_standard) in risultati_citta.items():
+        results_df[f'RMSE_Test_{anno_test}_{citta}'] = np.nan
+        results_df[f'STD_DEV_Test_{anno_test}_{citta}'] = np.nan
+        results_df.loc[grid_search.best_index_, f'RMSE_Test_{anno_test}_{citta}'] = rmse
+        results_df.loc[grid_search.best_index_, f'STD_DEV_Test_{anno_test}_{citta}'] = dev_standard
+    results_df = results_df.round(5)
+
+    os.makedirs('dati/parametri', exist_ok=True)
+    results_df.to_csv('dati/parametri/parametri_globale.csv', index=False, sep=';', decimal=',')
+    print("   - Salvati i parametri in 'parametri_globale.csv'")
+    # -----------------------------------------------------------------------
+
+    # ===============================
+    # 5. RETRAIN FINALE
+    # ===============================
+    print("\n   -> Iniziato il Retraining sull'intero dataset.")
+    finale = (df_clean['ANNO'] <= anno_test).to_numpy()
+    X_final, y_final = X_tutte[finale], y_tutte[finale]
+
+    final_model = retrain_finale.riaddestra(
+        grid_search,
+        lambda: xgb.XGBRegressor(**{**xgb_model.get_params(), **grid_search.best_params_}),
+        X_final,
+        y_final,
+        (df_clean.loc[finale, 'ANNO'] == anno_test).to_numpy(),
+        retrain
+    )
+
+    os.makedirs('modelli', exist_ok=True)
+    joblib.dump(ModelloGlobale(final_model, citta_con_dati, anagrafica), FILE_MODELLO)
+    print(f"   --> Modello salvato come '{os.path.basename(FILE_MODELLO)}'")
+
+    return risultati_citta
+
+
+def _carica_modello():
+    try:
+        return registro_modelli.carica_modello(FILE_MODELLO)
+    except FileNotFoundError:
+        print("Errore: Modello globale non trovato.", file=sys.stderr)
+        return None
+
+
+def usa_modello(localita, anno=2026):
+    print(f"  - Località: {localita}")
+    print(f"  - Anno della previsione: {anno}")
+
+    mese = int(input("  - Mese (1-12): "))
+    giorno = int(input("  - Giorno (1-31): "))
+    temp_anno_prec = leggi_tmedia(localita, mese, giorno)
+    print(f"  - Temperatura media dello stesso giorno anno precedente (°C): {temp_anno_prec}")
+
+    previsione = predici(localita, anno, mese, giorno, temp_anno_prec)
+
+    print("\n" + "=" * 42)
+    print(f"  DATA: {giorno}/{mese}/{anno}")
+    print(f"  PREVISIONE TEMPERATURA MEDIA: {previsione:.2f} °C")
+    print("=" * 42 + "\n")
+
+
+def predici(localita, anno, mese, giorno, temp_anno_prec):
+    modello = _carica_modello()
+    if modello is None:
+        return
+
+    try:
+        datetime(anno, mese, giorno)
+    except ValueError:
+        return
+
+    matrice, _ = features_date(localita, [anno], [mese], [giorno])
+    matrice[:, 3] = float(temp_anno_prec)
+    return float(modello.predict_citta(localita, matrice)[0])
+
+
+def predizione_annuale_array_citta(citta_list, anno, temp_anno_prec=None):
+    """
+    Previsioni di tutti i giorni di 'anno' per più città con un'unica predict.
+    Restituisce { città: array indicizzato per giorno dell'anno }, oppure None se
+    il modello non è disponibile. 'temp_anno_prec' è un eventuale dizionario
+    { città: valori per giorno di 'anno' } che sostituisce i dati dell'ultimo anno.
+    """
+    modello = _carica_modello()
+    if modello is None:
+        return None
+
+    temp_anno_prec = temp_anno_prec or {}
+    blocchi = [features_anno(citta, anno, temp_anno_prec.get(citta)) for citta in citta_list]
+    righe_per_citta = [len(blocco) for blocco in blocchi]
+    citta_righe = np.repeat(np.asarray(citta_list, dtype=object), righe_per_citta)
+
+    predizioni = modello.predict_citta(citta_righe, np.vstack(blocchi))
+    return dict(zip(citta_list, np.split(predizioni, np.cumsum(righe_per_citta)[:-1])))
+
+
+def predizione_annuale_array(localita, anno, temp_anno_prec=None):
+    """Come negli altri moduli: array delle previsioni giornaliere di 'anno' per una città."""
+    previsioni = predizione_annuale_array_citta([localita], anno, {localita: temp_anno_prec})
+    if previsioni is None:
+        return None
+    return previsioni[localita]
+
+
+def predizione_annuale(localita, anno):
+    risultato = {}
+    predizioni = predizione_annuale_array(localita, anno)
+    if predizioni is None:
+        return risultato
+
+    data_corrente = date(anno, 1, 1)
+    for valore in predizioni:
+        risultato[(data_corrente.month, data_corrente.day)] = float(valore)
+        data_corrente += timedelta(days=1)
+    return risultato
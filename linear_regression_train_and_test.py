@@ -2,20 +2,38 @@ import pandas as pd
 import numpy as np
 import joblib
 import os
+import sys
 import math
-from datetime import datetime
-import calendar
-from dati.gestore import leggi_tmedia
+import time
+from datetime import datetime, date, timedelta
+from dati.gestore import leggi_tmedia, features_anno, dati_localita, COLONNE_FEATURES
+import registro_modelli
+import modelli_compatti
+import ricerca_iperparametri
+import retrain_finale
+import regressione_incrementale
 
-from sklearn.linear_model import LinearRegression
-from sklearn.model_selection import GridSearchCV, TimeSeriesSplit
+from sklearn.model_selection import TimeSeriesSplit
 from sklearn.metrics import root_mean_squared_error
+from threadpoolctl import threadpool_limits
 
+# Moduli ausiliari il cui sorgente entra nell'impronta del manifest di training
+MODULI_DIPENDENTI = (regressione_incrementale,)
 
-def train_and_test(dataset, target_column, localita, anno_test):
-    df = pd.read_csv(dataset, sep=';')
+# Griglia degli iperparametri (usata anche per l'impronta del manifest di training)
+PARAM_GRID = {
+    'fit_intercept': [True, False]
+}
+
+
+def train_and_test(dataset, target_column, localita, anno_test, n_thread=-1, ricerca=None, retrain=None):
+    # n_thread: thread BLAS per i prodotti matriciali delle statistiche sufficienti
+    # (-1 = tutti i core); la griglia ha due sole combinazioni, quindi resta sequenziale
+    # ricerca, retrain: ignorati; CV e retrain si risolvono in forma chiusa dalle statistiche
+    # sufficienti (vedi regressione_incrementale), quindi la griglia è sempre valutata per intero
+    # dataset: percorso del CSV oppure dizionario {localita: DataFrame} di carica_dataset_per_citta
     features = ['ANNO', 'SIN_GIORNO', 'COS_GIORNO', 'TEMPERATURA_MEDIA_ANNO_PRECEDENTE']
-    df_clean = df.dropna(subset=['LOCALITA'] + features + [target_column])
+    df_clean = dati_localita(dataset, target_column, localita)
 
     train_df = df_clean[(df_clean['ANNO'] < anno_test) & (df_clean['LOCALITA'] == localita)]
     test_df = df_clean[(df_clean['ANNO'] == anno_test) & (df_clean['LOCALITA'] == localita)]
@@ -27,20 +45,26 @@ def train_and_test(dataset, target_column, localita, anno_test):
 
     print(f"   - [LinearReg] Training sugli anni antecedenti al {anno_test} per {localita}")
 
-    param_grid = {
-        'fit_intercept': [True, False]
-    }
+    param_grid = PARAM_GRID
 
-    lr_model = LinearRegression()
     tscv = TimeSeriesSplit(n_splits=5)
 
-    grid_search = GridSearchCV(lr_model, param_grid, cv=tscv, scoring='neg_root_mean_squared_error', n_jobs=-1)
+    # offset delle statistiche sufficienti: media delle features di training, fissata
+    # per tutta la vita dello stato (anche per gli aggiornamenti incrementali)
+    offset = X_train.to_numpy(dtype=np.float64).mean(axis=0)
 
     print("   - Addestramento iniziato.")
-    grid_search.fit(X_train, y_train)
+    # CV in forma chiusa: ogni fold si risolve dalle statistiche dei blocchi, senza refit
+    t_start = time.perf_counter()
+    with threadpool_limits(limits=n_thread if n_thread > 0 else None, user_api='blas'):
+        cv_results, best_index = regressione_incrementale.cross_validation(X_train, y_train, tscv, param_grid, offset)
+        best_params = cv_results['params'][best_index]
+        coef, intercept = regressione_incrementale.risolvi(
+            regressione_incrementale.statistiche(X_train, y_train, offset), offset, best_params['fit_intercept'])
+    best_model = regressione_incrementale.crea_modello(coef, intercept, best_params['fit_intercept'], features)
+    ricerca_iperparametri.registra_misura(time.perf_counter() - t_start, 0, 0.0, 0.0)
     print("   - Addestramento completato.")
 
-    best_model = grid_search.best_estimator_
     pred_test = best_model.predict(X_test)
     rmse = root_mean_squared_error(y_test, pred_test)
 
@@ -58,15 +82,15 @@ def train_and_test(dataset, target_column, localita, anno_test):
     print(f"   - Bias medio: {float(np.mean(residui)):.3f} °C")
 
     # Salvataggio Parametri
-    results_df = pd.DataFrame(grid_search.cv_results_)
+    results_df = pd.DataFrame(cv_results)
     colonne_interessanti = [col for col in results_df.columns if 'param_' in col or 'mean_test_score' in col]
     results_df = results_df[colonne_interessanti]
     results_df['mean_test_score'] = -results_df['mean_test_score']
     results_df = results_df.rename(columns={'mean_test_score': 'RMSE_medio_CV'})
     results_df[f'RMSE_Test_{anno_test}'] = np.nan
     results_df[f'STD_DEV_Test_{anno_test}'] = np.nan
-    results_df.loc[grid_search.best_index_, f'RMSE_Test_{anno_test}'] = rmse
-    results_df.loc[grid_search.best_index_, f'STD_DEV_Test_{anno_test}'] = dev_standard
+    results_df.loc[best_index, f'RMSE_Test_{anno_test}'] = rmse
+    results_df.loc[best_index, f'STD_DEV_Test_{anno_test}'] = dev_standard
     results_df = results_df.round(5)
 
     os.makedirs('dati/parametri', exist_ok=True)
@@ -79,22 +103,90 @@ def train_and_test(dataset, target_column, localita, anno_test):
     risultati["PRED_LINREG"] = risultati["PRED_LINREG"].round(2)
     risultati.to_csv(f'./dati/risultati_dei_modelli/predizioni_linear_regression_{localita}.csv', index=False, sep=';', decimal=',')
 
-    # Retrain
+    # Retrain: le statistiche dell'anno di test si sommano a quelle del training
     print("\n   -> Retraining finale.")
-    final_train_df = df_clean[(df_clean['ANNO'] <= anno_test) & (df_clean['LOCALITA'] == localita)]
-    final_model = LinearRegression(**grid_search.best_params_)
-    final_model.fit(final_train_df[features], final_train_df[target_column])
+    t_start = time.perf_counter()
+    with threadpool_limits(limits=n_thread if n_thread > 0 else None, user_api='blas'):
+        stat_finali = regressione_incrementale.somma(
+            regressione_incrementale.statistiche(X_train, y_train, offset),
+            regressione_incrementale.statistiche(X_test, y_test, offset)
+        )
+    coef, intercept = regressione_incrementale.risolvi(stat_finali, offset, best_params['fit_intercept'])
+    final_model = regressione_incrementale.crea_modello(coef, intercept, best_params['fit_intercept'], features)
+    retrain_finale.registra_misura(time.perf_counter() - t_start)
+
+    righe_finali = pd.concat([train_df, test_df])
+    regressione_incrementale.salva_stato(localita, stat_finali, offset, best_params['fit_intercept'], features,
+                                         _ultima_data(righe_finali),
+                                         regressione_incrementale.impronta(righe_finali[features],
+                                                                           righe_finali[target_column]))
 
     os.makedirs('modelli', exist_ok=True)
     joblib.dump(final_model, f'modelli/modello_linear_regression_{localita}.pkl')
     print(f"   --> Modello salvato: 'modello_linear_regression_{localita}.pkl'")
 
+    # Esportazione nel formato compatto (array NumPy) usato per l'inferenza
+    modelli_compatti.esporta(final_model, f'modelli/modello_linear_regression_{localita}.pkl')
+    print(f"   --> Esportato il formato compatto 'modello_linear_regression_{localita}.npz'")
+
     # Restituisce sia RMSE che deviazione standard dei residui
     return round(rmse, 3), round(dev_standard, 3)
 
 
-def usa_modello(localita):
-    anno = 2026
+def _ultima_data(df):
+    return max(zip(df['ANNO'].astype(int), df['MESE'].astype(int), df['GIORNO'].astype(int)))
+
+
+def aggiorna_con_nuove_osservazioni(dataset, target_column, localita):
+    """
+    Aggiorna il modello della città con le righe di 'dataset' successive all'ultima
+    già inclusa nello stato: le statistiche sufficienti crescono in O(features²) per
+    riga e i coefficienti vengono ricalcolati subito, senza un nuovo training.
+
+    Se le righe già incluse sono cambiate (impronta diversa: mesi reimportati e corretti,
+    TEMPERATURA_MEDIA_ANNO_PRECEDENTE ricalcolata) sommare solo le nuove farebbe derivare
+    le statistiche: vengono invece ricostruite da tutte le righe del dataset.
+
+    Restituisce (righe nuove aggiunte, statistiche ricostruite); (0, False) se lo stato
+    non esiste o se non c'è nulla da aggiornare, e in quel caso il modello non viene riscritto.
+    """
+    stato = regressione_incrementale.carica_stato(localita)
+    if stato is None:
+        return 0, False
+
+    df_clean = dati_localita(dataset, target_column, localita)
+    if df_clean.empty:
+        return 0, False
+
+    features = stato['features']
+    date_righe = list(zip(df_clean['ANNO'].astype(int), df_clean['MESE'].astype(int), df_clean['GIORNO'].astype(int)))
+    incluse = np.array([d <= stato['ultima_data'] for d in date_righe])
+    nuove = df_clean[~incluse]
+    ricostruito = regressione_incrementale.impronta(
+        df_clean.loc[incluse, features], df_clean.loc[incluse, target_column]) != stato['impronta']
+    if nuove.empty and not ricostruito:
+        return 0, False
+
+    if ricostruito:
+        stat = regressione_incrementale.statistiche(df_clean[features], df_clean[target_column], stato['offset'])
+    else:
+        stat = regressione_incrementale.somma(
+            stato['stat'],
+            regressione_incrementale.statistiche(nuove[features], nuove[target_column], stato['offset'])
+        )
+    coef, intercept = regressione_incrementale.risolvi(stat, stato['offset'], stato['fit_intercept'])
+    modello = regressione_incrementale.crea_modello(coef, intercept, stato['fit_intercept'], features)
+
+    percorso = f'modelli/modello_linear_regression_{localita}.pkl'
+    joblib.dump(modello, percorso)
+    modelli_compatti.esporta(modello, percorso)
+    regressione_incrementale.salva_stato(localita, stat, stato['offset'], stato['fit_intercept'], features,
+                                         _ultima_data(df_clean),
+                                         regressione_incrementale.impronta(df_clean[features], df_clean[target_column]))
+    return len(nuove), ricostruito
+
+
+def usa_modello(localita, anno=2026):
     print(f"  - Località: {localita}")
     print(f"  - Anno della previsione: {anno}")
 
@@ -113,9 +205,9 @@ def usa_modello(localita):
 
 def predici(localita, anno, mese, giorno, temp_anno_prec):
     try:
-        modello = joblib.load(f'modelli/modello_linear_regression_{localita}.pkl')
+        modello = registro_modelli.carica_modello(modelli_compatti.percorso_preferito(f'modelli/modello_linear_regression_{localita}.pkl'))
     except FileNotFoundError:
-        print("Errore: Modello LR non trovato.")
+        print("Errore: Modello LR non trovato.", file=sys.stderr)
         return
 
     try:
@@ -132,12 +224,34 @@ def predici(localita, anno, mese, giorno, temp_anno_prec):
     return float(modello.predict(input_data)[0])
 
 
+def predizione_annuale_array(localita, anno, temp_anno_prec=None):
+    """
+    Predice la temperatura media di tutti i giorni dell'anno con un'unica
+    chiamata a predict. Restituisce un array indicizzato per giorno dell'anno
+    (indice 0 = 1 gennaio), oppure None se il modello non è disponibile.
+    'temp_anno_prec' (un valore per giorno di 'anno') sostituisce la temperatura
+    dell'ultimo anno osservato come feature TEMPERATURA_MEDIA_ANNO_PRECEDENTE.
+    """
+    try:
+        modello = registro_modelli.carica_modello(modelli_compatti.percorso_preferito(f'modelli/modello_linear_regression_{localita}.pkl'))
+    except FileNotFoundError:
+        print("Errore: Modello LR non trovato.", file=sys.stderr)
+        return None
+
+    input_data = pd.DataFrame(features_anno(localita, anno, temp_anno_prec), columns=COLONNE_FEATURES)
+    input_data['ANNO'] = input_data['ANNO'].astype(int)
+
+    return modello.predict(input_data).astype(float)
+
+
 def predizione_annuale(localita, anno):
     risultato = {}
-    for mese in range(1, 13):
-        giorni_nel_mese = calendar.monthrange(anno, mese)[1]
-        for giorno in range(1, giorni_nel_mese + 1):
-            valore = predici(localita, anno, mese, giorno, leggi_tmedia(localita, mese, giorno))
-            if valore is not None:
-                risultato[(mese, giorno)] = valore
-    return risultato
\ No newline at end of file
+    predizioni = predizione_annuale_array(localita, anno)
+    if predizioni is None:
+        return risultato
+
+    data_corrente = date(anno, 1, 1)
+    for valore in predizioni:
+        risultato[(data_corrente.month, data_corrente.day)] = float(valore)
+        data_corrente += timedelta(days=1)
+    return risultato
@@ -1,14 +1,38 @@
+import time
+T_AVVIO = time.perf_counter()
+
 import argparse
-from dati import gestore, unificatore_csv
-import gestore_modelli
-import cerca_con_a_star
-import valuta_a_star
+import importlib
+import json
+import sys
 
-import xgboost_train_and_test
-import linear_regression_train_and_test
-import random_forest_train_and_test
+# I moduli del progetto vengono importati solo dai comandi che li usano (vedi importa()):
+# in questo modo, ad esempio, --find_scheduling con le previsioni in cache non carica
+# sklearn, xgboost e pandas.
+TEMPI_IMPORT = {}  # nome modulo -> (secondi, numero di moduli caricati con lui)
 
-import json
+# dipendenze pesanti di cui --timing riporta se sono state caricate
+DIPENDENZE_PESANTI = ['pandas', 'sklearn', 'xgboost', 'joblib', 'matplotlib']
+
+
+def importa(nome_modulo):
+    t_start = time.perf_counter()
+    n_moduli = len(sys.modules)
+    modulo = importlib.import_module(nome_modulo)
+    if nome_modulo not in TEMPI_IMPORT:
+        TEMPI_IMPORT[nome_modulo] = (time.perf_counter() - t_start, len(sys.modules) - n_moduli)
+    return modulo
+
+
+def stampa_tempi():
+    print("\n=== TEMPI DI AVVIO ===")
+    for nome_modulo, (secondi, n_moduli) in TEMPI_IMPORT.items():
+        print(f"  - import {nome_modulo:<36} {secondi * 1000:9.1f} ms ({n_moduli} moduli)")
+    caricate = [d for d in DIPENDENZE_PESANTI if d in sys.modules]
+    print(f"  - Dipendenze pesanti caricate: {', '.join(caricate) if caricate else 'nessuna'}")
+    print(f"  - Tempo totale (import + comando): {time.perf_counter() - T_AVVIO:.3f} s")
+
+registro_modelli = importa("registro_modelli")
 
 with open("parametri.json", "r", encoding="utf-8") as f:
     parametri = json.load(f)
@@ -16,77 +40,139 @@ with open("parametri.json", "r", encoding="utf-8") as f:
 citta = parametri["citta"] # città che sono salvate nel dataset
 anno_test = parametri["anno_test"] # che è l'ultimo anno (per ogni città) salvato nel dataset
 anno_predizione = parametri["anno_predizione"] # anno in cui effetturare le predizioni
+worker_previsioni = parametri.get("worker_previsioni") # processi per le predizioni delle città (null = numero di core)
+worker_ingestione = parametri.get("worker_ingestione") # processi per la lettura dei file mensili in --new_dataset (null = numero di core)
+esporta_csv = parametri.get("esporta_csv", True) # con --new_dataset scrive anche i CSV oltre agli archivi colonnari (.npz)
+core_training = parametri.get("core_training") # core totali usati da --find_models (null = numero di core)
+ricerca_iperparametri = parametri.get("ricerca_iperparametri") # strategia e budget della ricerca degli iperparametri
+retrain_finale = parametri.get("retrain_finale") # 'completo', 'warm_start' o 'confronto'
+
+# limiti del registro dei modelli tenuti in memoria (LRU)
+registro_modelli.configura(
+    max_modelli=parametri.get("max_modelli_in_memoria"),
+    max_byte=parametri["max_mb_modelli_in_memoria"] * 1024 * 1024 if "max_mb_modelli_in_memoria" in parametri else None
+)
 
 def main():
     parser = argparse.ArgumentParser(description="Script di gestione Dataset e Training")
 
     # Comandi principali per il progetto
     parser.add_argument("--new_dataset", action="store_true", help="Si considerano nuovi file di meteo presi dalla piattaforma online (https://www.ilmeteo.it/portale/archivio-meteo) e si uniscono (e formalizzano) per essere usati per l'addestramento dei modelli")
+    parser.add_argument("--full_ingestion", action="store_true", help="Con --new_dataset ricostruisce il dataset unificato da tutti i file mensili, anche quelli già ingeriti secondo il manifest di ingestione")
+    parser.add_argument("--update_linear_models", action="store_true", help="Con --new_dataset aggiorna i modelli di regressione lineare già addestrati con i nuovi dati, senza un nuovo training (i file dei modelli vengono riscritti)")
     parser.add_argument("--find_models", action="store_true", help="Allena tutte le tipologie di modello di apprendimento su tutte le città, li testa sull'anno 2025 e in base ai risultati dei test, individua il modello migliore per ciascuna città ")
+    parser.add_argument("--full_retrain", action="store_true", help="Con --find_models riaddestra tutte le coppie città/modello, anche quelle invariate secondo il manifest di training")
     parser.add_argument("--find_scheduling", action="store_true", help="Esegue l'algoritmo di ricerca A* per trovare la pianificazione che minimizza i costi")
     parser.add_argument("--evaluation_scheduling", action="store_true", help="Mostra le perfomance dell'algoritmo di ricerca A* per la sua valutazione")
+    parser.add_argument("--evaluation_training", action="store_true", help="Misura le prestazioni dell'addestramento (tempi di ricerca e retrain, dimensione e caricamento dei modelli, memoria) per ogni città e modello")
+    parser.add_argument("--benchmark_runs", type=int, default=3, help="Ripetizioni di ogni misura di --evaluation_training (la tabella riporta mediana e scarto)")
+    parser.add_argument("--refresh_forecasts", action="store_true", help="Con --find_scheduling e --evaluation_scheduling ricalcola le previsioni meteo ignorando la cache su disco")
 
     # Comandi per poter usare i modelli (questi devono essere già allenati)
     parser.add_argument("--use_model_xgboost", action="store_true", help="Lancia il modello xgboost su dei dati di input")
     parser.add_argument("--use_model_random_forest", action="store_true", help="Lancia il modello random forest su dei dati di input")
     parser.add_argument("--use_model_linear_regression", action="store_true", help="Lancia il modello random forest su dei dati di input")
+    parser.add_argument("--bulk_input", default=None, help="Modalità non interattiva: file CSV (citta;anno;mese;giorno) o JSONL di richieste da predire ('-' per stdin). Con un --use_model_* usa quel modello, altrimenti il migliore di ogni città")
+    parser.add_argument("--bulk_output", default="-", help="File CSV o JSONL su cui scrivere le previsioni della modalità --bulk_input ('-' per stdout)")
+
+    # Server locale per interrogare i modelli migliori senza ricaricarli a ogni richiesta
+    parser.add_argument("--serve_predictions", action="store_true", help="Avvia il server locale (HTTP) delle previsioni, con i modelli migliori sempre in memoria e le richieste raggruppate in batch")
+    parser.add_argument("--server_port", type=int, default=8765, help="Porta su localhost del server delle previsioni")
+    parser.add_argument("--server_socket", default=None, help="Socket Unix su cui ascoltare al posto della porta TCP")
+
+    parser.add_argument("--timing", action="store_true", help="Al termine stampa il tempo di import di ogni modulo e il tempo totale di esecuzione")
 
     args = parser.parse_args()
     path_file = "dati/dataset_meteo_unificato.csv" # file contenente l'intero dataset
 
     if args.new_dataset:
         print("\n=== LETTURA E FORMALIZZAZIONE DEL DATASET ===")
-        unificatore_csv.unifica_dataset(path_file)
-        gestore.gestisci_null(path_file)
-        gestore.separatore_data(path_file)
-        
-        gestore.elimina_colonne(path_file, ['PUNTORUGIADA °C', 'VISIBILITA m', 'VENTOMAX km/h', 'RAFFICA km/h', 
-        'PRESSIONESLM mb'])
-        gestore.aggiungi_ciclicita_data(path_file)
-        gestore.aggiungi_temperatura_anno_precedente(path_file)
-
-        #salviamo i dati dell'ultimo anno in un file apposito
-        unificatore_csv.dati_ultimo_anno(anno_test)
+        # ingestione incrementale: vengono letti solo i file mensili nuovi o modificati
+        ingestione = importa("dati.ingestione")
+        ingestione.aggiorna_dataset(path_file, anno_test, args.full_ingestion, worker_ingestione, esporta_csv)
+
+    if args.new_dataset and args.update_linear_models:
+        # i modelli lineari già addestrati seguono i nuovi dati senza un nuovo training
+        print("\n=== AGGIORNAMENTO DEI MODELLI DI REGRESSIONE LINEARE ===")
+        linear_regression = importa("linear_regression_train_and_test")
+        for localita in citta:
+            n_nuove, ricostruito = linear_regression.aggiorna_con_nuove_osservazioni(path_file, 'TMEDIA °C', localita)
+            if ricostruito:
+                print(f"  - Regressione lineare di {localita}: righe già incluse modificate, statistiche ricostruite "
+                      f"da tutto il dataset ({n_nuove} nuove osservazioni); riscritto 'modello_linear_regression_{localita}.pkl'.")
+            elif n_nuove:
+                print(f"  - Regressione lineare di {localita} aggiornata con {n_nuove} nuove osservazioni; "
+                      f"riscritto 'modello_linear_regression_{localita}.pkl'.")
 
     if args.find_models:
         print("\n=== INDIVIDUAZIONE DEL MODELLO MIGLIORE PER OGNI CITTA' ===")
-        gestore_modelli.esegui_confronto_e_training(path_file, 'TMEDIA °C', anno_test, citta)
+        gestore_modelli = importa("gestore_modelli")
+        gestore_modelli.esegui_confronto_e_training(path_file, 'TMEDIA °C', anno_test, citta, core_training, ricerca_iperparametri,
+                                                    args.full_retrain, retrain_finale)
 
     if args.find_scheduling:
         print("\n=== INDIVIDUAZIONE DELLA MIGLIORE PIANIFICAZIONE ===")
-        cerca_con_a_star.cerca_soluzione(anno_predizione, citta)
+        cerca_con_a_star = importa("cerca_con_a_star")
+        cerca_con_a_star.cerca_soluzione(anno_predizione, citta, args.refresh_forecasts, worker_previsioni)
 
     if args.evaluation_scheduling:
         print("\n=== INDIVIDUAZIONE PERFOMANCE A* ===")
-        valuta_a_star.esegui_benchmark(anno_predizione, citta)
+        valuta_a_star = importa("valuta_a_star")
+        valuta_a_star.esegui_benchmark(anno_predizione, citta, aggiorna_cache=args.refresh_forecasts,
+                                     n_worker=worker_previsioni)
+
+    if args.evaluation_training:
+        print("\n=== INDIVIDUAZIONE PERFOMANCE TRAINING ===")
+        valuta_training = importa("valuta_training")
+        valuta_training.esegui_benchmark_training(path_file, 'TMEDIA °C', anno_test, citta, args.benchmark_runs,
+                                                  ricerca=ricerca_iperparametri, retrain=retrain_finale)
 
             
-    if args.use_model_xgboost:
+    if args.bulk_input:
+        # Modalità non interattiva: le richieste arrivano da file e le previsioni vengono scritte a blocchi
+        nome_modello = None
+        if args.use_model_xgboost:
+            nome_modello = 'xgboost'
+        elif args.use_model_random_forest:
+            nome_modello = 'random_forest'
+        elif args.use_model_linear_regression:
+            nome_modello = 'linear_regression'
+        importa("predizioni_bulk").esegui_bulk(args.bulk_input, args.bulk_output, nome_modello)
+
+    if args.use_model_xgboost and not args.bulk_input:
         print("")
         ripeti = True
         while ripeti:
             localita = input("Località per cui effettuare la predizione con XGBoost(prima lettera maiuscola):")
             if localita in citta:
                 ripeti = False
-        xgboost_train_and_test.usa_modello(localita)
+        importa("xgboost_train_and_test").usa_modello(localita, anno_predizione)
 
-    if args.use_model_random_forest:
+    if args.use_model_random_forest and not args.bulk_input:
         print("")
         ripeti = True
         while ripeti:
             localita = input("Località per cui effettuare la predizione con Random Forest(prima lettera maiuscola):")
             if localita in citta:
                 ripeti = False
-        random_forest_train_and_test.usa_modello(localita)
+        importa("random_forest_train_and_test").usa_modello(localita, anno_predizione)
 
-    if args.use_model_linear_regression:
+    if args.use_model_linear_regression and not args.bulk_input:
         print("")
         ripeti = True
         while ripeti:
             localita = input("Località per cui effettuare la predizione con Regressione Lineare(prima lettera maiuscola):")
             if localita in citta:
                 ripeti = False
-        linear_regression_train_and_test.usa_modello(localita)
+        importa("linear_regression_train_and_test").usa_modello(localita, anno_predizione)
+
+    if args.serve_predictions:
+        print("\n=== SERVER DELLE PREVISIONI ===")
+        server_predizioni = importa("server_predizioni")
+        server_predizioni.esegui_server(citta, porta=args.server_port, socket_unix=args.server_socket)
+
+    if args.timing:
+        stampa_tempi()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,88 @@
+"""
+Manifest dell'addestramento incrementale: le coppie città/modello con impronta di dati,
+griglia, features e codice invariata vengono saltate.
+"""
+
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from dati.gestore import COLONNE_FEATURES
+
+FILE_MANIFEST = 'modelli/manifest_training.json'
+VERSIONE_MANIFEST = 1
+
+
+def _sha256(*parti):
+    h = hashlib.sha256()
+    for parte in parti:
+        h.update(parte if isinstance(parte, bytes) else str(parte).encode('utf-8'))
+    return h.hexdigest()[:16]
+
+
+def _hash_sorgente(percorso):
+    with open(percorso, 'rb') as f:
+        return _sha256(f.read())
+
+
+def carica():
+    """Manifest salvato ({'Bari|xgboost': voce, ...}), vuoto se assente o di un'altra versione."""
+    if not os.path.exists(FILE_MANIFEST):
+        return {}
+    with open(FILE_MANIFEST, 'r') as f:
+        manifest = json.load(f)
+    if manifest.get('versione') != VERSIONE_MANIFEST:
+        return {}
+    return manifest.get('coppie', {})
+
+
+def salva(coppie):
+    os.makedirs(os.path.dirname(FILE_MANIFEST), exist_ok=True)
+    with open(FILE_MANIFEST, 'w') as f:
+        json.dump({'versione': VERSIONE_MANIFEST, 'coppie': coppie}, f, indent=4, sort_keys=True)
+
+
+def impronta(dati_citta, target_column, anno_test, modulo, ricerca=None, retrain=None):
+    """Impronta (dati, griglia, features, codice) dell'addestramento di 'modulo' sui dati della città."""
+    import pandas as pd
+    import retrain_finale
+    import ricerca_iperparametri
+
+    righe = dati_citta[dati_citta['ANNO'] <= anno_test]
+    hash_righe = pd.util.hash_pandas_object(righe, index=False).to_numpy()
+
+    griglia = {
+        'param_grid': getattr(modulo, 'PARAM_GRID', None),
+        'ricerca': ricerca_iperparametri.configurazione(ricerca),
+        'retrain': retrain or 'completo',
+    }
+    return {
+        'dati': _sha256(target_column, anno_test, len(righe), hash_righe.tobytes()),
+        'griglia': _sha256(json.dumps(griglia, sort_keys=True)),
+        'features': _sha256(json.dumps(COLONNE_FEATURES)),
+        'codice': _sha256(*(_hash_sorgente(m.__file__) for m in
+                            (modulo, ricerca_iperparametri, retrain_finale, *getattr(modulo, 'MODULI_DIPENDENTI', ())))),
+    }
+
+
+def metriche_valide(coppie, localita, nome_modello, impronta_attuale, file_modello):
+    """
+    (rmse, dev_standard) salvati per la coppia se l'impronta coincide e il modello
+    'file_modello' è ancora su disco, altrimenti None (la coppia va riaddestrata).
+    """
+    voce = coppie.get(f'{localita}|{nome_modello}')
+    if voce is None or voce.get('impronta') != impronta_attuale:
+        return None
+    if not os.path.exists(file_modello):
+        return None
+    return voce['rmse'], voce['dev_standard']
+
+
+def registra(coppie, localita, nome_modello, impronta_attuale, rmse, dev_standard):
+    coppie[f'{localita}|{nome_modello}'] = {
+        'impronta': impronta_attuale,
+        'rmse': float(rmse),
+        'dev_standard': float(dev_standard),
+        'addestrato_il': datetime.now().isoformat(timespec='seconds'),
+    }
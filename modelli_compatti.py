@@ -0,0 +1,206 @@
+"""
+Formato di inferenza compatto (.npz di array NumPy) dei modelli addestrati, usato al posto
+del .pkl solo se registra l'hash del .pkl attuale.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+ESTENSIONE = '.npz'
+
+# (percorso, mtime, dimensione) -> hash, per non rileggere i file a ogni predizione
+_HASH = {}
+
+
+class ModelloCompatto:
+    """Modello caricato da un file .npz; espone predict(X) come gli stimatori originali."""
+
+    def __init__(self, dati):
+        self.tipo = str(dati['tipo'])
+        self.dati = {chiave: dati[chiave] for chiave in dati.files}
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if self.tipo == 'lineare':
+            return X @ self.dati['coef'] + float(self.dati['intercetta'])
+
+        somme = _somma_foglie(self.dati, X.astype(np.float32), self.tipo == 'xgboost')
+        if self.tipo == 'random_forest':
+            return somme / len(self.dati['radici'])
+        return somme + float(self.dati['base_score'])
+
+
+def percorso_compatto(percorso_pkl):
+    return os.path.splitext(percorso_pkl)[0] + ESTENSIONE
+
+
+def _memorizzato(percorso, calcola):
+    info = os.stat(percorso)
+    chiave = (percorso, info.st_mtime_ns, info.st_size)
+    if chiave not in _HASH:
+        _HASH[chiave] = calcola(percorso)
+    return _HASH[chiave]
+
+
+def _hash_file(percorso):
+    h = hashlib.sha256()
+    with open(percorso, 'rb') as f:
+        for blocco in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(blocco)
+    return h.hexdigest()[:16]
+
+
+def _hash_pkl_registrato(percorso_npz):
+    with np.load(percorso_npz, allow_pickle=False) as dati:
+        return str(dati['hash_pkl']) if 'hash_pkl' in dati.files else None
+
+
+def percorso_preferito(percorso_pkl):
+    """
+    Restituisce il .npz se esiste ed è stato esportato dal .pkl attuale (hash
+    registrato uguale a quello del .pkl), altrimenti il .pkl.
+    """
+    percorso_npz = percorso_compatto(percorso_pkl)
+    if not os.path.exists(percorso_npz):
+        return percorso_pkl
+    if not os.path.exists(percorso_pkl):
+        return percorso_npz
+    if _memorizzato(percorso_npz, _hash_pkl_registrato) != _memorizzato(percorso_pkl, _hash_file):
+        return percorso_pkl
+    return percorso_npz
+
+
+def carica(percorso):
+    with np.load(percorso, allow_pickle=False) as dati:
+        return ModelloCompatto(dati)
+
+
+def esporta(modello, percorso_pkl):
+    """
+    Salva 'modello' (LinearRegression, RandomForestRegressor o XGBRegressor) nel formato
+    compatto; va chiamata dopo aver scritto 'percorso_pkl', di cui registra l'hash.
+    """
+    nome_classe = type(modello).__name__
+
+    if nome_classe == 'LinearRegression':
+        dati = {
+            'tipo': np.array('lineare'),
+            'coef': np.asarray(modello.coef_, dtype=np.float64),
+            'intercetta': np.array(float(modello.intercept_)),
+        }
+    elif nome_classe == 'RandomForestRegressor':
+        dati = _appiattisci_alberi([_albero_sklearn(stimatore.tree_) for stimatore in modello.estimators_])
+        dati['tipo'] = np.array('random_forest')
+    elif nome_classe == 'XGBRegressor':
+        dati, base_score = _alberi_xgboost(modello)
+        dati['tipo'] = np.array('xgboost')
+        dati['base_score'] = np.array(base_score)
+    else:
+        raise ValueError(f"Modello '{nome_classe}' non supportato dal formato compatto")
+
+    if os.path.exists(percorso_pkl):
+        dati['hash_pkl'] = np.array(_hash_file(percorso_pkl))
+
+    percorso_npz = percorso_compatto(percorso_pkl)
+    np.savez(percorso_npz, **dati)
+    return percorso_npz
+
+
+# =============================================================================
+# ESTRAZIONE DEGLI ALBERI
+# =============================================================================
+
+def _albero_sklearn(tree):
+    # sklearn: si va a sinistra se x <= threshold; le foglie hanno children_left == -1
+    return {
+        'feature': tree.feature,
+        'threshold': tree.threshold,
+        'left': tree.children_left,
+        'right': tree.children_right,
+        'missing_left': np.zeros(tree.node_count, dtype=bool),
+        'value': tree.value[:, 0, 0],
+    }
+
+
+def _alberi_xgboost(modello):
+    booster = modello.get_booster()
+    learner = json.loads(booster.save_raw(raw_format='json'))['learner']
+    alberi_json = learner['gradient_booster']['model']['trees']
+
+    # se il modello è stato addestrato con early stopping, predict usa solo i primi alberi
+    best_iteration = getattr(modello, 'best_iteration', None)
+    if best_iteration is not None:
+        alberi_json = alberi_json[:best_iteration + 1]
+
+    alberi = []
+    for albero in alberi_json:
+        left = np.asarray(albero['left_children'], dtype=np.int64)
+        condizioni = np.asarray(albero['split_conditions'], dtype=np.float32)
+        foglia = left == -1
+        # XGBoost: si va a sinistra se x < split; nelle foglie split_conditions contiene il valore
+        alberi.append({
+            'feature': np.where(foglia, 0, np.asarray(albero['split_indices'], dtype=np.int64)),
+            'threshold': condizioni,
+            'left': left,
+            'right': np.asarray(albero['right_children'], dtype=np.int64),
+            'missing_left': np.asarray(albero['default_left'], dtype=bool),
+            'value': np.where(foglia, condizioni, 0.0),
+        })
+
+    base_score = float(learner['learner_model_param']['base_score'].strip('[]'))
+    return _appiattisci_alberi(alberi), base_score
+
+
+def _appiattisci_alberi(alberi):
+    # Concatena tutti gli alberi in array contigui; i figli diventano indici globali
+    radici = []
+    offset = 0
+    for albero in alberi:
+        radici.append(offset)
+        offset += len(albero['left'])
+
+    def concatena(chiave, dtype):
+        return np.ascontiguousarray(np.concatenate([a[chiave] for a in alberi]), dtype=dtype)
+
+    left = concatena('left', np.int64)
+    right = concatena('right', np.int64)
+    spostamenti = np.repeat(radici, [len(a['left']) for a in alberi])
+    foglia = left == -1
+
+    return {
+        'radici': np.asarray(radici, dtype=np.int64),
+        'feature': np.where(foglia, 0, concatena('feature', np.int64)),
+        'threshold': concatena('threshold', np.float64),
+        'left': np.where(foglia, -1, left + spostamenti),
+        'right': np.where(foglia, -1, right + spostamenti),
+        'missing_left': concatena('missing_left', bool),
+        'value': concatena('value', np.float64),
+    }
+
+
+# =============================================================================
+# VALUTAZIONE
+# =============================================================================
+
+def _somma_foglie(dati, X, confronto_stretto):
+    """Somma, per ogni riga di X, i valori delle foglie raggiunte in tutti gli alberi."""
+    n_righe = X.shape[0]
+    # nodo corrente per ogni (albero, riga)
+    nodi = np.repeat(dati['radici'][:, None], n_righe, axis=1)
+    righe = np.broadcast_to(np.arange(n_righe), nodi.shape)
+    left, right = dati['left'], dati['right']
+
+    attivi = left[nodi] != -1
+    while attivi.any():
+        n = nodi[attivi]
+        x = X[righe[attivi], dati['feature'][n]]
+        soglia = dati['threshold'][n]
+        va_a_sinistra = (x < soglia) if confronto_stretto else (x <= soglia)
+        va_a_sinistra = np.where(np.isnan(x), dati['missing_left'][n], va_a_sinistra)
+        nodi[attivi] = np.where(va_a_sinistra, left[n], right[n])
+        attivi = left[nodi] != -1
+
+    return dati['value'][nodi].sum(axis=0)
@@ -0,0 +1,144 @@
+"""
+Modalità non interattiva dei comandi --use_model_*: previsioni a blocchi per un flusso di
+richieste CSV (citta;anno;mese;giorno) o JSONL; la diagnostica va su stderr.
+"""
+
+import contextlib
+import csv
+import itertools
+import json
+import sys
+from collections import defaultdict
+
+import numpy as np
+
+import gestore_modelli
+from dati.gestore import ANNO_MASSIMO, ANNO_MINIMO
+
+DIMENSIONE_BLOCCO = 10000
+CAMPI = ['citta', 'anno', 'mese', 'giorno']
+
+
+def formato_da_percorso(percorso):
+    return 'jsonl' if percorso.lower().endswith(('.jsonl', '.json')) else 'csv'
+
+
+def leggi_richieste(file_input, formato):
+    """Genera le richieste come dizionari {citta, anno, mese, giorno}."""
+    if formato == 'jsonl':
+        for riga in file_input:
+            if riga.strip():
+                richiesta = json.loads(riga)
+                yield {campo: richiesta.get(campo) for campo in CAMPI}
+    else:
+        reader = csv.DictReader(file_input, delimiter=';')
+        reader.fieldnames = [nome.strip().lower() for nome in reader.fieldnames]
+        for riga in reader:
+            yield {campo: (riga.get(campo) or '').strip() for campo in CAMPI}
+
+
+def predici_stream(richieste, nome_modello=None, dimensione_blocco=DIMENSIONE_BLOCCO):
+    """
+    Genera le richieste nello stesso ordine d'ingresso con la chiave 'temperatura'
+    aggiunta. Con 'nome_modello' si usa quella famiglia di modelli per tutte le città,
+    altrimenti il modello migliore di ciascuna.
+    """
+    richieste = iter(richieste)
+    while True:
+        blocco = list(itertools.islice(richieste, dimensione_blocco))
+        if not blocco:
+            return
+
+        temperature = [None] * len(blocco)
+        per_citta = defaultdict(list)
+        for i, richiesta in enumerate(blocco):
+            try:
+                data = (int(richiesta['anno']), int(richiesta['mese']), int(richiesta['giorno']))
+            except (TypeError, ValueError):
+                continue  # riga malformata: temperatura assente
+            if not (ANNO_MINIMO <= data[0] <= ANNO_MASSIMO and 1 <= data[1] <= 12 and 1 <= data[2] <= 31):
+                continue  # data fuori intervallo: temperatura assente
+            per_citta[richiesta['citta']].append((i, data))
+
+        for citta, righe in per_citta.items():
+            for (i, _), valore in zip(righe, _predici_citta(citta, [data for _, data in righe], nome_modello)):
+                if valore is not None and not np.isnan(valore):
+                    temperature[i] = round(float(valore), 3)
+
+        for richiesta, temperatura in zip(blocco, temperature):
+            yield {**richiesta, 'temperatura': temperatura}
+
+
+def _predici(citta, date, nome_modello):
+    anni, mesi, giorni = (np.array(colonna) for colonna in zip(*date))
+    return gestore_modelli.predici_temperature_localita(citta, anni, mesi, giorni, nome_modello)
+
+
+def _predici_citta(citta, date, nome_modello):
+    """
+    Temperature previste per le 'date' di una città (None dove non disponibili).
+    Se la predict del gruppo fallisce per un errore dei dati si riprova riga per riga,
+    così una riga problematica non toglie la previsione alle altre.
+    """
+    try:
+        predizioni = _predici(citta, date, nome_modello)
+    except FileNotFoundError as errore:
+        # manca un file della città (es. dati dell'ultimo anno): nessuna riga è prevedibile
+        print(f"Errore: previsioni non disponibili per {citta}: {errore}", file=sys.stderr)
+        return [None] * len(date)
+    except (ValueError, OverflowError):
+        predizioni = []
+        for data in date:
+            try:
+                predizione = _predici(citta, [data], nome_modello)
+            except (FileNotFoundError, ValueError, OverflowError) as errore:
+                print(f"Errore: previsione non disponibile per {citta} {data}: {errore}", file=sys.stderr)
+                predizione = None
+            predizioni.append(None if predizione is None else predizione[0])
+        return predizioni
+
+    return [None] * len(date) if predizioni is None else predizioni
+
+
+def scrivi_risposte(risposte, file_output, formato):
+    """Scrive le risposte man mano che il generatore le produce; restituisce il numero di righe."""
+    n_righe = 0
+    if formato == 'jsonl':
+        for risposta in risposte:
+            file_output.write(json.dumps(risposta) + '\n')
+            n_righe += 1
+    else:
+        writer = csv.DictWriter(file_output, fieldnames=CAMPI + ['temperatura'], delimiter=';')
+        writer.writeheader()
+        for risposta in risposte:
+            writer.writerow(risposta)
+            n_righe += 1
+    return n_righe
+
+
+def esegui_bulk(percorso_input, percorso_output='-', nome_modello=None, dimensione_blocco=DIMENSIONE_BLOCCO):
+    """
+    Legge le richieste da 'percorso_input' e scrive le previsioni su 'percorso_output'
+    ('-' indica stdin/stdout, in formato CSV).
+    """
+    formato_input = 'csv' if percorso_input == '-' else formato_da_percorso(percorso_input)
+    formato_output = 'csv' if percorso_output == '-' else formato_da_percorso(percorso_output)
+
+    file_input = sys.stdin if percorso_input == '-' else open(percorso_input, newline='', encoding='utf-8')
+    file_output = sys.stdout if percorso_output == '-' else open(percorso_output, 'w', newline='', encoding='utf-8')
+    try:
+        # con l'output su stdout, i messaggi stampati durante le predizioni vanno su stderr
+        stampa = contextlib.redirect_stdout(sys.stderr) if file_output is sys.stdout else contextlib.nullcontext()
+        with stampa:
+            richieste = leggi_richieste(file_input, formato_input)
+            risposte = predici_stream(richieste, nome_modello, dimensione_blocco)
+            n_righe = scrivi_risposte(risposte, file_output, formato_output)
+    finally:
+        if file_input is not sys.stdin:
+            file_input.close()
+        if file_output is not sys.stdout:
+            file_output.close()
+
+    if percorso_output != '-':
+        print(f"  - Scritte {n_righe} previsioni in '{percorso_output}'")
+    return n_righe
@@ -2,22 +2,37 @@ import pandas as pd
 import numpy as np
 import joblib
 import os
+import sys
 import math
-import matplotlib.pyplot as plt
-from datetime import datetime
-import calendar
-from dati.gestore import leggi_tmedia
+from datetime import datetime, date, timedelta
+from dati.gestore import leggi_tmedia, features_anno, dati_localita, COLONNE_FEATURES
+import registro_modelli
+import modelli_compatti
+import ricerca_iperparametri
+import retrain_finale
 
 from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import GridSearchCV, TimeSeriesSplit
+from sklearn.model_selection import TimeSeriesSplit
 from sklearn.metrics import root_mean_squared_error
 
+# Griglia degli iperparametri (usata anche per l'impronta del manifest di training)
+PARAM_GRID = {
+    'n_estimators': [100, 200],
+    'max_depth': [5, 10, None],
+    'min_samples_split': [2, 5],
+    'min_samples_leaf': [1, 2]
+}
 
-def train_and_test(dataset, target_column, localita, anno_test):
+
+def train_and_test(dataset, target_column, localita, anno_test, n_thread=-1, ricerca=None, retrain=None):
+    # n_thread: core della coppia (-1 = tutti): thread dello stimatore finale e processi della
+    # ricerca degli iperparametri, dove ogni valutazione usa un solo thread (budget di core rispettato)
+    # ricerca: strategia e budget della ricerca degli iperparametri (vedi ricerca_iperparametri)
+    # retrain: modalità del retrain finale, 'completo' (default), 'warm_start' o 'confronto' (vedi retrain_finale)
     # ===============================
     # 1. CARICAMENTO DATI
     # ===============================
-    df = pd.read_csv(dataset, sep=';')
+    # dataset: percorso del CSV oppure dizionario {localita: DataFrame} di carica_dataset_per_citta
 
     features = [
         'ANNO',
@@ -26,7 +41,7 @@ def train_and_test(dataset, target_column, localita, anno_test):
         'TEMPERATURA_MEDIA_ANNO_PRECEDENTE'
     ]
 
-    df_clean = df.dropna(subset=['LOCALITA'] + features + [target_column])
+    df_clean = dati_localita(dataset, target_column, localita)
 
     # ===============================
     # 2. SPLIT TEMPORALE
@@ -46,30 +61,18 @@ def train_and_test(dataset, target_column, localita, anno_test):
     # ===============================
     # 3. GRID SEARCH
     # ===============================
-    param_grid = {
-        'n_estimators': [100, 200],
-        'max_depth': [5, 10, None],
-        'min_samples_split': [2, 5],
-        'min_samples_leaf': [1, 2]
-    }
+    param_grid = PARAM_GRID
 
     rf_model = RandomForestRegressor(
         random_state=42,
-        n_jobs=-1
+        n_jobs=n_thread
     )
 
     tscv = TimeSeriesSplit(n_splits=5)
 
-    grid_search = GridSearchCV(
-        rf_model,
-        param_grid,
-        cv=tscv,
-        scoring='neg_root_mean_squared_error',
-        n_jobs=None
-    )
-
     print("   - Addestramento con TimeSeriesSplit iniziato.")
-    grid_search.fit(X_train, y_train)
+    grid_search = ricerca_iperparametri.esegui_ricerca(rf_model, param_grid, X_train, y_train, tscv, ricerca,
+                                                       risorsa='n_estimators', n_jobs=n_thread)
     print("   - Addestramento completato.")
 
     best_model = grid_search.best_estimator_
@@ -139,23 +142,28 @@ def train_and_test(dataset, target_column, localita, anno_test):
     X_final = final_train_df[features]
     y_final = final_train_df[target_column]
 
-    final_model = RandomForestRegressor(
-        random_state=42,
-        n_jobs=-1,
-        **grid_search.best_params_
+    final_model = retrain_finale.riaddestra(
+        grid_search,
+        lambda: RandomForestRegressor(random_state=42, n_jobs=n_thread, **grid_search.best_params_),
+        X_final,
+        y_final,
+        final_train_df['ANNO'] == anno_test,
+        retrain
     )
-    final_model.fit(X_final, y_final)
 
     os.makedirs('modelli', exist_ok=True)
     joblib.dump(final_model, f'modelli/modello_random_forest_{localita}.pkl')
     print(f"   --> Modello salvato come 'modello_random_forest_{localita}.pkl'")
 
+    # Esportazione nel formato compatto (array NumPy) usato per l'inferenza
+    modelli_compatti.esporta(final_model, f'modelli/modello_random_forest_{localita}.pkl')
+    print(f"   --> Esportato il formato compatto 'modello_random_forest_{localita}.npz'")
+
     # Restituisce sia RMSE che deviazione standard dei residui
     return round(rmse, 3), round(dev_standard, 3)
 
 
-def usa_modello(localita):
-    anno = 2026
+def usa_modello(localita, anno=2026):
     print(f"  - Località: {localita}")
     print(f"  - Anno della previsione: {anno}")
 
@@ -174,10 +182,11 @@ def usa_modello(localita):
 
 def predici(localita, anno, mese, giorno, temp_anno_prec):
     try:
-        modello = joblib.load(f'modelli/modello_random_forest_{localita}.pkl')
-        modello.set_params(n_jobs=1)
+        modello = registro_modelli.carica_modello(modelli_compatti.percorso_preferito(f'modelli/modello_random_forest_{localita}.pkl'))
+        if hasattr(modello, 'set_params'):  # il formato compatto non ha parametri
+            modello.set_params(n_jobs=1)
     except FileNotFoundError:
-        print("Errore: Modello RF non trovato.")
+        print("Errore: Modello RF non trovato.", file=sys.stderr)
         return
 
     try:
@@ -195,12 +204,36 @@ def predici(localita, anno, mese, giorno, temp_anno_prec):
     return float(modello.predict(input_data)[0])
 
 
+def predizione_annuale_array(localita, anno, temp_anno_prec=None):
+    """
+    Predice la temperatura media di tutti i giorni dell'anno con un'unica
+    chiamata a predict. Restituisce un array indicizzato per giorno dell'anno
+    (indice 0 = 1 gennaio), oppure None se il modello non è disponibile.
+    'temp_anno_prec' (un valore per giorno di 'anno') sostituisce la temperatura
+    dell'ultimo anno osservato come feature TEMPERATURA_MEDIA_ANNO_PRECEDENTE.
+    """
+    try:
+        modello = registro_modelli.carica_modello(modelli_compatti.percorso_preferito(f'modelli/modello_random_forest_{localita}.pkl'))
+        if hasattr(modello, 'set_params'):  # il formato compatto non ha parametri
+            modello.set_params(n_jobs=1)
+    except FileNotFoundError:
+        print("Errore: Modello RF non trovato.", file=sys.stderr)
+        return None
+
+    input_data = pd.DataFrame(features_anno(localita, anno, temp_anno_prec), columns=COLONNE_FEATURES)
+    input_data['ANNO'] = input_data['ANNO'].astype(int)
+
+    return modello.predict(input_data).astype(float)
+
+
 def predizione_annuale(localita, anno):
     risultato = {}
-    for mese in range(1, 13):
-        giorni_nel_mese = calendar.monthrange(anno, mese)[1]
-        for giorno in range(1, giorni_nel_mese + 1):
-            valore = predici(localita, anno, mese, giorno, leggi_tmedia(localita, mese, giorno))
-            if valore is not None:
-                risultato[(mese, giorno)] = valore
-    return risultato
\ No newline at end of file
+    predizioni = predizione_annuale_array(localita, anno)
+    if predizioni is None:
+        return risultato
+
+    data_corrente = date(anno, 1, 1)
+    for valore in predizioni:
+        risultato[(data_corrente.month, data_corrente.day)] = float(valore)
+        data_corrente += timedelta(days=1)
+    return risultato
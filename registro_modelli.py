@@ -0,0 +1,113 @@
+"""
+Registro LRU dei modelli caricati, condiviso nel processo: chiave (percorso, mtime, dimensione)
+del file, limiti sul numero di modelli e sui byte.
+"""
+
+import os
+import time
+from collections import OrderedDict
+
+import modelli_compatti
+
+# Limiti di default, modificabili con configura()
+MAX_MODELLI = 16
+MAX_BYTE = 512 * 1024 * 1024
+
+# percorso -> (chiave, modello, byte), in ordine di utilizzo (ultimo = più recente)
+_MODELLI = OrderedDict()
+
+_STATISTICHE = {
+    'hit': 0,
+    'miss': 0,
+    'evizioni': 0,
+    'tempo_caricamento_s': 0.0,
+}
+
+
+def configura(max_modelli=None, max_byte=None):
+    """Imposta i limiti del registro ed elimina subito i modelli in eccesso."""
+    global MAX_MODELLI, MAX_BYTE
+    if max_modelli is not None:
+        MAX_MODELLI = max_modelli
+    if max_byte is not None:
+        MAX_BYTE = max_byte
+    _rispetta_limiti()
+
+
+def carica_modello(percorso):
+    """
+    Restituisce il modello salvato in 'percorso', deserializzandolo solo se non
+    è già in memoria o se il file è cambiato. Solleva FileNotFoundError se il
+    file non esiste, come joblib.load.
+    """
+    info = os.stat(percorso)
+    chiave = (percorso, info.st_mtime_ns, info.st_size)
+
+    voce = _MODELLI.get(percorso)
+    if voce is not None and voce[0] == chiave:
+        _MODELLI.move_to_end(percorso)
+        _STATISTICHE['hit'] += 1
+        return voce[1]
+
+    _STATISTICHE['miss'] += 1
+    t_start = time.perf_counter()
+    if percorso.endswith(modelli_compatti.ESTENSIONE):
+        modello = modelli_compatti.carica(percorso)
+    else:
+        import joblib  # import ritardato: serve solo quando un .pkl va davvero deserializzato
+        modello = joblib.load(percorso)
+    _STATISTICHE['tempo_caricamento_s'] += time.perf_counter() - t_start
+
+    _MODELLI[percorso] = (chiave, modello, info.st_size)
+    _MODELLI.move_to_end(percorso)
+    _rispetta_limiti()
+    return modello
+
+
+def invalida(percorso=None):
+    """Rimuove dal registro il modello indicato (o tutti se percorso è None)."""
+    if percorso is None:
+        _MODELLI.clear()
+    else:
+        _MODELLI.pop(percorso, None)
+
+
+def statistiche():
+    """Contatori di hit/miss/evizioni, tempo totale di caricamento e occupazione attuale."""
+    return {
+        **_STATISTICHE,
+        'modelli_in_memoria': len(_MODELLI),
+        'byte_in_memoria': _byte_occupati(),
+    }
+
+
+def azzera_statistiche():
+    for chiave in _STATISTICHE:
+        _STATISTICHE[chiave] = 0
+
+
+def unisci_statistiche(altre):
+    """Somma ai contatori locali quelli raccolti in un altro processo (es. un worker)."""
+    for chiave in _STATISTICHE:
+        _STATISTICHE[chiave] += altre.get(chiave, 0)
+
+
+def stampa_statistiche():
+    s = statistiche()
+    print(f"  - Registro modelli: {s['hit']} hit, {s['miss']} miss, {s['evizioni']} evizioni, "
+          f"caricamento {s['tempo_caricamento_s']:.3f} s, "
+          f"{s['modelli_in_memoria']} modelli in memoria ({s['byte_in_memoria'] / 1024 / 1024:.1f} MB)")
+
+
+def _byte_occupati():
+    return sum(voce[2] for voce in _MODELLI.values())
+
+
+def _rispetta_limiti():
+    # L'ultimo modello inserito non viene mai eliminato, anche se da solo supera MAX_BYTE
+    while len(_MODELLI) > 1 and (len(_MODELLI) > MAX_MODELLI or _byte_occupati() > MAX_BYTE):
+        _MODELLI.popitem(last=False)
+        _STATISTICHE['evizioni'] += 1
+    while len(_MODELLI) > MAX_MODELLI:
+        _MODELLI.popitem(last=False)
+        _STATISTICHE['evizioni'] += 1
@@ -0,0 +1,148 @@
+"""
+Regressione lineare in forma chiusa dalle statistiche sufficienti (ZᵀZ, Zᵀy, yᵀy, n), con
+cross-validation e aggiornamento incrementale senza rifare fit.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+from sklearn.linear_model import LinearRegression
+
+FILE_STATO = 'modelli/statistiche_linear_regression_{}.npz'
+
+
+def statistiche(X, y, offset):
+    """Statistiche sufficienti delle righe (X, y) rispetto a 'offset'."""
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    Z = np.column_stack([np.ones(len(X)), X - offset])
+    return {'ZtZ': Z.T @ Z, 'Zty': Z.T @ y, 'yty': float(y @ y), 'n': len(y)}
+
+
+def somma(*blocchi):
+    """Statistiche dell'unione di più blocchi di righe."""
+    return {
+        'ZtZ': sum(b['ZtZ'] for b in blocchi),
+        'Zty': sum(b['Zty'] for b in blocchi),
+        'yty': sum(b['yty'] for b in blocchi),
+        'n': sum(b['n'] for b in blocchi),
+    }
+
+
+def risolvi(stat, offset, fit_intercept=True):
+    """Coefficienti e intercetta (nelle coordinate originali) dei minimi quadrati."""
+    if fit_intercept:
+        # come LinearRegression si centra sulle medie delle righe stesse, ricavate dalle
+        # statistiche: una feature costante (es. ANNO nel primo fold) riceve coefficiente 0
+        n = stat['n']
+        media_x = stat['ZtZ'][0, 1:] / n
+        media_y = stat['Zty'][0] / n
+        Sxx = stat['ZtZ'][1:, 1:] - n * np.outer(media_x, media_x)
+        Sxy = stat['Zty'][1:] - n * media_x * media_y
+        coef = np.linalg.lstsq(Sxx, Sxy, rcond=None)[0]
+        return coef, float(media_y - coef @ media_x - coef @ offset)
+
+    # senza intercetta la retta passa per l'origine delle coordinate originali:
+    # [1, X] = Z M, quindi [1, X]ᵀ[1, X] = Mᵀ ZtZ M
+    M = np.eye(len(offset) + 1)
+    M[0, 1:] = offset
+    A = M.T @ stat['ZtZ'] @ M
+    b = M.T @ stat['Zty']
+    coef = np.linalg.lstsq(A[1:, 1:], b[1:], rcond=None)[0]
+    return coef, 0.0
+
+
+def sse(stat, offset, coef, intercept):
+    """Somma dei quadrati dei residui del modello (coef, intercept) sulle righe di 'stat'."""
+    theta = np.concatenate([[intercept + coef @ offset], coef])
+    return max(stat['yty'] - 2 * theta @ stat['Zty'] + theta @ stat['ZtZ'] @ theta, 0.0)
+
+
+def cross_validation(X, y, cv, param_grid, offset):
+    """
+    Cross-validation di 'param_grid' (solo fit_intercept) dalle statistiche dei fold.
+
+    Restituisce (cv_results, best_index) con le stesse chiavi usate da
+    GridSearchCV per il CSV dei parametri (score = -RMSE medio sui fold).
+    """
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # i fold di TimeSeriesSplit sono blocchi contigui: si calcolano le statistiche
+    # del primo training e di ogni blocco di validazione una sola volta
+    split = list(cv.split(X))
+    inizio = split[0][0][-1] + 1
+    blocchi = [statistiche(X[:inizio], y[:inizio], offset)]
+    blocchi += [statistiche(X[test], y[test], offset) for _, test in split]
+
+    combinazioni = [{'fit_intercept': f} for f in param_grid['fit_intercept']]
+    punteggi = []
+    for params in combinazioni:
+        rmse_fold = []
+        training = blocchi[0]
+        for validazione in blocchi[1:]:
+            coef, intercept = risolvi(training, offset, params['fit_intercept'])
+            rmse_fold.append(np.sqrt(sse(validazione, offset, coef, intercept) / validazione['n']))
+            training = somma(training, validazione)
+        punteggi.append(-float(np.mean(rmse_fold)))
+
+    best_index = int(np.argmax(punteggi))
+    ordine = np.argsort(-np.array(punteggi), kind='stable')
+    rank = np.empty(len(punteggi), dtype=int)
+    rank[ordine] = np.arange(1, len(punteggi) + 1)
+    cv_results = {
+        'params': combinazioni,
+        'param_fit_intercept': [p['fit_intercept'] for p in combinazioni],
+        'mean_test_score': punteggi,
+        'rank_test_score': rank,
+    }
+    return cv_results, best_index
+
+
+def crea_modello(coef, intercept, fit_intercept, features):
+    """LinearRegression di scikit-learn con i coefficienti già calcolati (stesso .pkl di prima)."""
+    modello = LinearRegression(fit_intercept=fit_intercept)
+    modello.coef_ = np.asarray(coef, dtype=np.float64)
+    modello.intercept_ = float(intercept)
+    modello.n_features_in_ = len(features)
+    modello.feature_names_in_ = np.asarray(features, dtype=object)
+    return modello
+
+
+def impronta(X, y):
+    """Hash dei valori (features e target, nell'ordine delle righe) incluse nelle statistiche."""
+    h = hashlib.sha256()
+    h.update(np.ascontiguousarray(X, dtype=np.float64).tobytes())
+    h.update(np.ascontiguousarray(y, dtype=np.float64).tobytes())
+    return h.hexdigest()[:16]
+
+
+def salva_stato(localita, stat, offset, fit_intercept, features, ultima_data, impronta_righe):
+    """
+    Salva lo stato della città; 'ultima_data' = (anno, mese, giorno) dell'ultima riga inclusa,
+    'impronta_righe' = impronta() delle righe incluse.
+    """
+    os.makedirs('modelli', exist_ok=True)
+    with open(FILE_STATO.format(localita), 'wb') as f:
+        np.savez(f, ZtZ=stat['ZtZ'], Zty=stat['Zty'], yty=np.array(stat['yty']), n=np.array(stat['n']),
+                 offset=np.asarray(offset, dtype=np.float64), fit_intercept=np.array(fit_intercept),
+                 features=np.asarray(features), ultima_data=np.asarray(ultima_data, dtype=np.int64),
+                 impronta=np.array(impronta_righe))
+
+
+def carica_stato(localita):
+    """Stato salvato della città, None se assente."""
+    percorso = FILE_STATO.format(localita)
+    if not os.path.exists(percorso):
+        return None
+    with np.load(percorso) as dati:
+        return {
+            'stat': {'ZtZ': dati['ZtZ'], 'Zty': dati['Zty'], 'yty': float(dati['yty']), 'n': int(dati['n'])},
+            'offset': dati['offset'],
+            'fit_intercept': bool(dati['fit_intercept']),
+            'features': [str(f) for f in dati['features']],
+            'ultima_data': tuple(int(v) for v in dati['ultima_data']),
+            # stati salvati prima dell'impronta: None, quindi alla prima occasione vengono ricostruiti
+            'impronta': str(dati['impronta']) if 'impronta' in dati.files else None,
+        }
@@ -0,0 +1,127 @@
+"""
+Retrain finale dei modelli ad alberi (anni <= anno_test): 'completo', 'warm_start' o
+'confronto' (entrambi, con RMSE su righe escluse dal retrain).
+"""
+
+import copy
+import math
+import time
+
+import numpy as np
+from sklearn.metrics import root_mean_squared_error
+
+MODALITA = ('completo', 'warm_start', 'confronto')
+MIN_AGGIUNTI = 10
+QUOTA_VALUTAZIONE = 0.25
+
+_ULTIMA_MISURA = {}
+
+
+def _n_aggiunti(n_esistenti, n_righe_nuove, n_righe_totali):
+    return max(MIN_AGGIUNTI, math.ceil(n_esistenti * n_righe_nuove / max(n_righe_totali, 1)))
+
+
+def _warm_start(modello_ricerca, X_final, y_final, n_righe_nuove):
+    nome_classe = type(modello_ricerca).__name__
+
+    if nome_classe == 'RandomForestRegressor':
+        # copia: il modello della ricerca resta quello valutato sull'anno di test
+        modello = copy.deepcopy(modello_ricerca)
+        n_alberi = modello.n_estimators
+        modello.set_params(warm_start=True,
+                           n_estimators=n_alberi + _n_aggiunti(n_alberi, n_righe_nuove, len(X_final)))
+        modello.fit(X_final, y_final)  # vengono addestrati solo gli alberi aggiunti
+        modello.set_params(warm_start=False)
+        return modello
+
+    if nome_classe == 'XGBRegressor':
+        booster = modello_ricerca.get_booster()
+        n_round = booster.num_boosted_rounds()
+        modello = type(modello_ricerca)(**{
+            **modello_ricerca.get_params(),
+            'n_estimators': _n_aggiunti(n_round, n_righe_nuove, len(X_final)),
+        })
+        modello.fit(X_final, y_final, xgb_model=booster)
+        return modello
+
+    raise ValueError(f"Warm start non supportato per '{nome_classe}'")
+
+
+def riaddestra(ricerca_cv, crea_modello, X_final, y_final, righe_nuove, modalita='completo'):
+    """
+    Restituisce il modello finale secondo 'modalita'.
+
+    ricerca_cv   : ricerca degli iperparametri già eseguita (best_estimator_, refit_time_)
+    crea_modello : funzione senza argomenti che crea lo stimatore del retrain completo
+    righe_nuove  : maschera booleana delle righe di X_final assenti dal training della ricerca
+                   (in ordine di data, come le righe di X_final)
+    """
+    t_start = time.perf_counter()
+    modello = _riaddestra(ricerca_cv, crea_modello, X_final, y_final, righe_nuove, modalita)
+    registra_misura(time.perf_counter() - t_start, modalita)
+    return modello
+
+
+def registra_misura(tempo_s, modalita='completo'):
+    """Registra la durata di un retrain eseguito fuori da riaddestra (es. soluzione in forma chiusa)."""
+    _ULTIMA_MISURA.clear()
+    _ULTIMA_MISURA.update({'tempo_s': tempo_s, 'modalita': modalita or 'completo'})
+
+
+def ultima_misura():
+    """Durata (e modalità) dell'ultimo retrain finale."""
+    return dict(_ULTIMA_MISURA)
+
+
+def _riaddestra(ricerca_cv, crea_modello, X_final, y_final, righe_nuove, modalita):
+    modalita = modalita or 'completo'
+    if modalita not in MODALITA:
+        raise ValueError(f"Modalità di retrain '{modalita}' non valida (ammesse: {', '.join(MODALITA)})")
+
+    n_righe_nuove = int(np.sum(righe_nuove))
+    if modalita == 'completo':
+        modello = crea_modello()
+        modello.fit(X_final, y_final)
+        return modello
+
+    if modalita == 'warm_start':
+        t_start = time.perf_counter()
+        modello_warm = _warm_start(ricerca_cv.best_estimator_, X_final, y_final, n_righe_nuove)
+        tempo_warm = time.perf_counter() - t_start
+        n_righe_ricerca = len(X_final) - n_righe_nuove
+        tempo_completo = getattr(ricerca_cv, 'refit_time_', 0.0) * len(X_final) / max(n_righe_ricerca, 1)
+        print(f"   - Retrain warm start: {tempo_warm:.2f} s "
+              f"(retrain completo stimato: {tempo_completo:.2f} s, risparmio: {tempo_completo - tempo_warm:.2f} s)")
+        return modello_warm
+
+    # righe di valutazione: l'ultima parte delle righe nuove, mai vista dai due modelli
+    # confrontati (né dal modello della ricerca, addestrato sugli anni precedenti)
+    indici_nuove = np.flatnonzero(righe_nuove)
+    n_valutazione = int(len(indici_nuove) * QUOTA_VALUTAZIONE)
+    valutazione = np.zeros(len(X_final), dtype=bool)
+    valutazione[indici_nuove[len(indici_nuove) - n_valutazione:]] = n_valutazione > 0
+    X_confronto, y_confronto = X_final[~valutazione], y_final[~valutazione]
+
+    t_start = time.perf_counter()
+    modello_warm = _warm_start(ricerca_cv.best_estimator_, X_confronto, y_confronto, n_righe_nuove - n_valutazione)
+    tempo_warm = time.perf_counter() - t_start
+
+    t_start = time.perf_counter()
+    modello_completo = crea_modello()
+    modello_completo.fit(X_confronto, y_confronto)
+    tempo_completo = time.perf_counter() - t_start
+
+    print(f"   - Retrain warm start: {tempo_warm:.2f} s | completo: {tempo_completo:.2f} s "
+          f"(risparmio: {tempo_completo - tempo_warm:.2f} s)")
+    if n_valutazione > 0:
+        X_valutazione, y_valutazione = X_final[valutazione], y_final[valutazione]
+        rmse_warm = root_mean_squared_error(y_valutazione, modello_warm.predict(X_valutazione))
+        rmse_completo = root_mean_squared_error(y_valutazione, modello_completo.predict(X_valutazione))
+        print(f"   - RMSE sulle ultime {n_valutazione} righe nuove (escluse dal retrain): "
+              f"warm start {rmse_warm:.3f} °C | completo {rmse_completo:.3f} °C "
+              f"(differenza: {rmse_warm - rmse_completo:+.3f} °C)")
+    else:
+        print("   - Righe nuove insufficienti per confrontare l'RMSE su dati esclusi dal retrain")
+
+    # modello salvato: warm start sull'intero dataset finale, righe di valutazione comprese
+    return _warm_start(ricerca_cv.best_estimator_, X_final, y_final, n_righe_nuove)
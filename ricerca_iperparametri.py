@@ -0,0 +1,157 @@
+"""
+Strategie di ricerca degli iperparametri ('esaustiva', 'casuale', 'dimezzamento') con budget di
+fit o di tempo, condivise dai moduli *_train_and_test.
+"""
+
+import math
+import time
+
+import numpy as np
+
+from sklearn.base import clone
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401 (abilita le classi Halving*)
+from sklearn.model_selection import (
+    HalvingGridSearchCV,
+    HalvingRandomSearchCV,
+    ParameterGrid,
+    ParameterSampler,
+    check_cv,
+)
+
+import cache_cv
+
+STRATEGIE = ('esaustiva', 'casuale', 'dimezzamento')
+FATTORE_DIMEZZAMENTO = 3
+RANDOM_STATE = 42
+
+_ULTIMA_MISURA = {}
+
+
+def configurazione(ricerca=None):
+    """Completa la configurazione di parametri.json con i valori di default."""
+    ricerca = dict(ricerca or {})
+    strategia = ricerca.get('strategia') or 'esaustiva'
+    if strategia not in STRATEGIE:
+        raise ValueError(f"Strategia di ricerca '{strategia}' non valida (ammesse: {', '.join(STRATEGIE)})")
+    return {
+        'strategia': strategia,
+        'n_combinazioni': ricerca.get('n_combinazioni'),
+        'max_fit': ricerca.get('max_fit'),
+        'max_secondi': ricerca.get('max_secondi'),
+    }
+
+
+def esegui_ricerca(stimatore, param_grid, X, y, cv, ricerca=None, risorsa='n_samples', n_jobs=None):
+    """
+    Esegue la ricerca degli iperparametri con la strategia indicata in 'ricerca'
+    (dizionario con chiavi strategia, n_combinazioni, max_fit, max_secondi) e
+    restituisce l'oggetto di ricerca già addestrato.
+
+    'param_grid' può essere un dizionario o una lista di dizionari, come in
+    GridSearchCV; con una lista la risorsa del successive halving deve essere
+    'n_samples'. 'risorsa' è il parametro usato dal successive halving:
+    'n_estimators' per Random Forest, 'n_samples' (righe del training set)
+    negli altri casi.
+
+    'n_jobs' è il budget di core della coppia città/modello: le valutazioni
+    (combinazione, fold) girano su n_jobs processi, ognuno con lo stimatore a
+    thread singolo; il modello migliore mantiene i thread dello stimatore originale.
+    """
+    t_start = time.perf_counter()
+    ricerca = configurazione(ricerca)
+    strategia = ricerca['strategia']
+    cv = check_cv(cv)  # accetta anche una lista di split (train, test), come GridSearchCV
+    n_fold = cv.get_n_splits()
+    n_griglia = len(ParameterGrid(param_grid))
+    max_fit = _budget_fit(stimatore, param_grid, X, y, ricerca)
+    comune = dict(cv=cv, scoring='neg_root_mean_squared_error', n_jobs=n_jobs)
+
+    if strategia == 'casuale':
+        n_combinazioni = ricerca['n_combinazioni'] or n_griglia
+        if max_fit is not None:
+            n_combinazioni = min(n_combinazioni, max_fit // n_fold)
+        n_combinazioni = max(1, min(n_combinazioni, n_griglia))
+        print(f"   - Ricerca casuale: {n_combinazioni} combinazioni su {n_griglia}")
+        # stesse combinazioni che estrarrebbe RandomizedSearchCV, valutate tramite la cache dei fold
+        candidati = list(ParameterSampler(param_grid, n_iter=n_combinazioni, random_state=RANDOM_STATE))
+        return _ricerca_con_cache(stimatore, candidati, X, y, cv, t_start, n_jobs)
+
+    elif strategia == 'dimezzamento':
+        griglia = param_grid
+        max_risorse = 'auto'
+        if risorsa != 'n_samples':
+            # la risorsa viene assegnata dal dimezzamento: il suo valore massimo è quello della griglia
+            griglia = dict(param_grid)
+            max_risorse = max(griglia.pop(risorsa, [stimatore.get_params()[risorsa]]))
+        n_candidati = len(ParameterGrid(griglia))
+
+        # con fattore f il numero totale di valutazioni è circa n * (1 + 1/f + 1/f^2 + ...) <= n * f / (f - 1)
+        valutazioni_per_candidato = FATTORE_DIMEZZAMENTO / (FATTORE_DIMEZZAMENTO - 1)
+        limite = n_candidati if max_fit is None else math.floor(max_fit / (n_fold * valutazioni_per_candidato))
+        limite = min(limite, ricerca['n_combinazioni'] or n_candidati)
+
+        # min_resources='exhaust': l'ultima iterazione usa sempre la risorsa massima
+        halving = dict(factor=FATTORE_DIMEZZAMENTO, resource=risorsa, max_resources=max_risorse,
+                       min_resources='exhaust', random_state=RANDOM_STATE, **comune)
+        if limite >= n_candidati:
+            print(f"   - Successive halving su {n_candidati} combinazioni (risorsa: {risorsa})")
+            ricerca_cv = HalvingGridSearchCV(cache_cv.stimatore_a_thread_singolo(stimatore, n_jobs), griglia,
+                                             **halving)
+        else:
+            n_candidati = max(FATTORE_DIMEZZAMENTO, limite)
+            print(f"   - Successive halving su {n_candidati} combinazioni casuali (risorsa: {risorsa})")
+            ricerca_cv = HalvingRandomSearchCV(cache_cv.stimatore_a_thread_singolo(stimatore, n_jobs), griglia,
+                                               n_candidates=n_candidati, **halving)
+
+    else:
+        if max_fit is not None and max_fit < n_griglia * n_fold:
+            print(f"   - Avviso: la ricerca esaustiva richiede {n_griglia * n_fold} fit, oltre il budget di {max_fit}")
+        return _ricerca_con_cache(stimatore, list(ParameterGrid(param_grid)), X, y, cv, t_start, n_jobs)
+
+    ricerca_cv.fit(X, y)
+    if 'n_jobs' in stimatore.get_params():
+        # il modello migliore (usato anche dal warm start) torna ai thread dello stimatore originale
+        ricerca_cv.best_estimator_.set_params(n_jobs=stimatore.get_params()['n_jobs'])
+
+    registra_misura(time.perf_counter() - t_start, len(ricerca_cv.cv_results_['params']) * n_fold,
+                    float(np.mean(ricerca_cv.cv_results_['mean_fit_time'])),
+                    float(np.mean(ricerca_cv.cv_results_['mean_score_time'])))
+    return ricerca_cv
+
+
+def _ricerca_con_cache(stimatore, candidati, X, y, cv, t_start, n_jobs=None):
+    n_miss = cache_cv.ultime_statistiche()['miss']
+    ricerca_cv = cache_cv.ricerca_con_cache(stimatore, candidati, X, y, cv, n_jobs)
+    registra_misura(time.perf_counter() - t_start, cache_cv.ultime_statistiche()['miss'] - n_miss,
+                    float(np.mean(ricerca_cv.cv_results_['mean_fit_time'])),
+                    float(np.mean(ricerca_cv.cv_results_['mean_score_time'])))
+    return ricerca_cv
+
+
+def registra_misura(tempo_s, n_fit, fit_medio_s, score_medio_s):
+    """Registra le misure di una ricerca eseguita fuori da esegui_ricerca (es. CV in forma chiusa)."""
+    _ULTIMA_MISURA.clear()
+    _ULTIMA_MISURA.update({'tempo_s': tempo_s, 'n_fit': n_fit, 'fit_medio_s': fit_medio_s,
+                           'score_medio_s': score_medio_s})
+
+
+def ultima_misura():
+    """Tempo totale, numero di fit e tempi medi di fit/score dell'ultima esegui_ricerca."""
+    return dict(_ULTIMA_MISURA)
+
+
+def _budget_fit(stimatore, param_grid, X, y, ricerca):
+    # Budget in numero di fit: il minimo tra max_fit e quanto entra in max_secondi
+    max_fit = ricerca['max_fit']
+    if ricerca['max_secondi'] is None:
+        return max_fit
+
+    # fit di prova con la prima combinazione della griglia sull'intero training set:
+    # i fold di TimeSeriesSplit sono più piccoli, quindi la stima è per eccesso
+    prova = clone(stimatore).set_params(**next(iter(ParameterGrid(param_grid))))
+    t_start = time.perf_counter()
+    prova.fit(X, y)
+    durata_fit = max(time.perf_counter() - t_start, 1e-6)
+
+    fit_nel_tempo = max(1, int(ricerca['max_secondi'] / durata_fit))
+    return fit_nel_tempo if max_fit is None else min(max_fit, fit_nel_tempo)
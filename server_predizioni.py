@@ -0,0 +1,250 @@
+"""
+Server locale (asyncio, HTTP minimale) delle previsioni con i modelli in memoria e le richieste
+raggruppate per città: GET /predizione?citta=&anno=&mese=&giorno= e GET /statistiche.
+"""
+
+import asyncio
+import json
+import time
+from collections import defaultdict, deque
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+
+import gestore_modelli
+import registro_modelli
+from dati.gestore import ANNO_MASSIMO, ANNO_MINIMO
+
+FINESTRA_BATCH_S = 0.005  # attesa massima per raccogliere richieste nello stesso batch
+MAX_BATCH = 4096          # righe massime per batch
+N_LATENZE = 10000         # latenze recenti usate per i percentili
+
+_STATI_HTTP = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed'}
+
+
+class ServerPredizioni:
+
+    def __init__(self, citta, finestra_s=FINESTRA_BATCH_S, max_batch=MAX_BATCH):
+        self.citta = list(citta)
+        self.finestra_s = finestra_s
+        self.max_batch = max_batch
+        self.coda = None  # creata nel loop asyncio in avvia()
+
+        self.t_avvio = time.perf_counter()
+        self.contatori = {
+            'richieste': 0,
+            'errori': 0,
+            'batch': 0,
+            'predict': 0,
+            'righe_predette': 0,
+        }
+        self.latenze = deque(maxlen=N_LATENZE)
+
+    # -------------------------------------------------------------------------
+    # Preparazione dei modelli
+    # -------------------------------------------------------------------------
+
+    def riscalda_modelli(self):
+        """Carica subito modello migliore e dati dell'ultimo anno di ogni città."""
+        for citta in self.citta:
+            temperatura = gestore_modelli.predici_temperatura_localita(citta, 2000, 1, 1)
+            stato = "pronto" if temperatura is not None else "non disponibile"
+            print(f"  - Modello per {citta}: {stato}")
+
+    # -------------------------------------------------------------------------
+    # Batching delle richieste
+    # -------------------------------------------------------------------------
+
+    async def predici(self, citta, anno, mese, giorno):
+        """Accoda una richiesta e attende che il batch che la contiene venga servito."""
+        futuro = asyncio.get_running_loop().create_future()
+        await self.coda.put((citta, anno, mese, giorno, futuro))
+        return await futuro
+
+    async def _ciclo_batch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.coda.get()]
+
+            # raccogliamo quello che arriva entro la finestra (o fino a MAX_BATCH)
+            scadenza = loop.time() + self.finestra_s
+            while len(batch) < self.max_batch:
+                attesa = scadenza - loop.time()
+                if attesa <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.coda.get(), attesa))
+                except asyncio.TimeoutError:
+                    break
+
+            per_citta = defaultdict(list)
+            for richiesta in batch:
+                per_citta[richiesta[0]].append(richiesta)
+
+            self.contatori['batch'] += 1
+            for citta, richieste in per_citta.items():
+                try:
+                    self._consegna(richieste, await self._predici_richieste(loop, citta, richieste))
+                except Exception:
+                    # una richiesta che fa fallire la predict non deve far fallire le altre
+                    # della stessa città: le ripetiamo una alla volta
+                    for richiesta in richieste:
+                        try:
+                            self._consegna([richiesta], await self._predici_richieste(loop, citta, [richiesta]))
+                        except Exception as errore:
+                            if not richiesta[4].done():
+                                richiesta[4].set_exception(errore)
+
+    async def _predici_richieste(self, loop, citta, richieste):
+        anni = [r[1] for r in richieste]
+        mesi = [r[2] for r in richieste]
+        giorni = [r[3] for r in richieste]
+        # la predict è CPU-bound: la eseguiamo fuori dal loop per continuare ad accettare connessioni
+        predizioni = await loop.run_in_executor(
+            None, gestore_modelli.predici_temperature_localita, citta, anni, mesi, giorni
+        )
+        self.contatori['predict'] += 1
+        self.contatori['righe_predette'] += len(richieste)
+        return predizioni
+
+    @staticmethod
+    def _consegna(richieste, predizioni):
+        for i, r in enumerate(richieste):
+            if r[4].done():
+                continue
+            if predizioni is None or np.isnan(predizioni[i]):
+                r[4].set_result(None)
+            else:
+                r[4].set_result(float(predizioni[i]))
+
+    # -------------------------------------------------------------------------
+    # Statistiche
+    # -------------------------------------------------------------------------
+
+    def statistiche(self):
+        durata = time.perf_counter() - self.t_avvio
+        latenze_ms = np.array(self.latenze) * 1000
+        batch = self.contatori['batch']
+        return {
+            **self.contatori,
+            'uptime_s': round(durata, 3),
+            'richieste_al_secondo': round(self.contatori['richieste'] / durata, 3) if durata > 0 else 0.0,
+            'righe_medie_per_predict': round(self.contatori['righe_predette'] / self.contatori['predict'], 3)
+            if self.contatori['predict'] else 0.0,
+            'predict_medie_per_batch': round(self.contatori['predict'] / batch, 3) if batch else 0.0,
+            'latenza_media_ms': round(float(latenze_ms.mean()), 3) if len(latenze_ms) else None,
+            'latenza_p50_ms': round(float(np.percentile(latenze_ms, 50)), 3) if len(latenze_ms) else None,
+            'latenza_p95_ms': round(float(np.percentile(latenze_ms, 95)), 3) if len(latenze_ms) else None,
+            'latenza_max_ms': round(float(latenze_ms.max()), 3) if len(latenze_ms) else None,
+            'registro_modelli': registro_modelli.statistiche(),
+        }
+
+    # -------------------------------------------------------------------------
+    # HTTP
+    # -------------------------------------------------------------------------
+
+    async def _rispondi(self, metodo, destinazione):
+        if metodo != 'GET':
+            return 405, {'errore': 'Sono supportate solo richieste GET'}
+
+        url = urlsplit(destinazione)
+        if url.path == '/statistiche':
+            return 200, self.statistiche()
+        if url.path != '/predizione':
+            return 404, {'errore': f"Percorso '{url.path}' non trovato"}
+
+        parametri = {chiave: valori[0] for chiave, valori in parse_qs(url.query).items()}
+        citta = parametri.get('citta')
+        if citta not in self.citta:
+            return 404, {'errore': f"Città '{citta}' non disponibile"}
+        try:
+            anno, mese, giorno = (int(parametri[chiave]) for chiave in ('anno', 'mese', 'giorno'))
+        except (KeyError, ValueError):
+            return 400, {'errore': "Parametri 'anno', 'mese' e 'giorno' interi obbligatori"}
+        if not ANNO_MINIMO <= anno <= ANNO_MASSIMO:
+            return 400, {'errore': f"Anno {anno} fuori dall'intervallo {ANNO_MINIMO}-{ANNO_MASSIMO}"}
+        if not 1 <= mese <= 12:
+            return 400, {'errore': f"Mese {mese} fuori dall'intervallo 1-12"}
+        if not 1 <= giorno <= 31:
+            return 400, {'errore': f"Giorno {giorno} fuori dall'intervallo 1-31"}
+
+        t_start = time.perf_counter()
+        temperatura = await self.predici(citta, anno, mese, giorno)
+        self.latenze.append(time.perf_counter() - t_start)
+
+        if temperatura is None:
+            return 400, {'errore': f"Data {giorno}/{mese}/{anno} non valida o modello non disponibile"}
+        return 200, {'citta': citta, 'anno': anno, 'mese': mese, 'giorno': giorno,
+                     'temperatura': round(temperatura, 3)}
+
+    async def gestisci_connessione(self, reader, writer):
+        # HTTP/1.1 con keep-alive: i controller possono riutilizzare la stessa connessione
+        try:
+            while True:
+                riga_richiesta = await reader.readline()
+                if not riga_richiesta.strip():
+                    break
+
+                intestazioni = {}
+                while True:
+                    riga = await reader.readline()
+                    if not riga.strip():
+                        break
+                    nome, _, valore = riga.decode('latin-1').partition(':')
+                    intestazioni[nome.strip().lower()] = valore.strip().lower()
+
+                try:
+                    metodo, destinazione, _ = riga_richiesta.decode('latin-1').split()
+                except ValueError:
+                    metodo, destinazione = '', ''
+
+                self.contatori['richieste'] += 1
+                try:
+                    stato, corpo = await self._rispondi(metodo, destinazione)
+                except Exception as errore:
+                    stato, corpo = 400, {'errore': str(errore)}
+                if stato != 200:
+                    self.contatori['errori'] += 1
+
+                dati = json.dumps(corpo).encode('utf-8')
+                chiudi = intestazioni.get('connection') == 'close'
+                writer.write(
+                    f"HTTP/1.1 {stato} {_STATI_HTTP[stato]}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(dati)}\r\n"
+                    f"Connection: {'close' if chiudi else 'keep-alive'}\r\n\r\n".encode('latin-1') + dati
+                )
+                await writer.drain()
+                if chiudi:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def avvia(self, host='127.0.0.1', porta=8765, socket_unix=None):
+        self.coda = asyncio.Queue()
+        ciclo = asyncio.create_task(self._ciclo_batch())
+
+        if socket_unix:
+            server = await asyncio.start_unix_server(self.gestisci_connessione, path=socket_unix)
+            print(f"  - Server in ascolto sul socket Unix '{socket_unix}'")
+        else:
+            server = await asyncio.start_server(self.gestisci_connessione, host, porta)
+            print(f"  - Server in ascolto su http://{host}:{porta}")
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            ciclo.cancel()
+
+
+def esegui_server(citta, host='127.0.0.1', porta=8765, socket_unix=None):
+    server = ServerPredizioni(citta)
+    server.riscalda_modelli()
+    try:
+        asyncio.run(server.avvia(host, porta, socket_unix))
+    except KeyboardInterrupt:
+        print("\n  - Server arrestato.")
+        print(json.dumps(server.statistiche(), indent=4))
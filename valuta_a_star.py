@@ -179,7 +179,8 @@ def _genera_scenari(tutte_le_citta: list, tutte_le_colture: dict):
 # FUNZIONE PRINCIPALE DI BENCHMARK
 # =============================================================================
 
-def esegui_benchmark(anno_target: int, tutte_le_citta: list, output_csv: str = 'dati/benchmark_risultati.csv'):
+def esegui_benchmark(anno_target: int, tutte_le_citta: list, output_csv: str = 'dati/benchmark_risultati.csv',
+                     aggiorna_cache: bool = False, n_worker: int = None):
     """
     Esegue il benchmark su tutti gli scenari crescenti e stampa + salva la tabella.
 
@@ -188,6 +189,8 @@ def esegui_benchmark(anno_target: int, tutte_le_citta: list, output_csv: str = '
     anno_target    : anno di riferimento per le previsioni meteo
     tutte_le_citta : lista completa di città disponibili (nell'ordine desiderato)
     output_csv     : nome del file CSV di output
+    aggiorna_cache : se True ricalcola le previsioni ignorando la cache su disco
+    n_worker       : processi usati per le predizioni delle città (None = numero di core)
     """
 
     # -------------------------------------------------------------------------
@@ -201,7 +204,7 @@ def esegui_benchmark(anno_target: int, tutte_le_citta: list, output_csv: str = '
 
     citta_da_caricare = [c for c in tutte_le_citta if c not in astar.TEMPERATURE]
     if citta_da_caricare:
-        astar.carica_dati_meteo(anno_target, citta_da_caricare)
+        astar.carica_dati_meteo(anno_target, citta_da_caricare, aggiorna_cache, n_worker)
     
     astar.precalcola_costi(anno_target, tutte_le_citta)
 
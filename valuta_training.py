@@ -0,0 +1,179 @@
+"""
+Benchmark dell'addestramento per ogni coppia città/modello (tempi, artefatti, memoria), salvato
+in 'dati/benchmark_training.csv'.
+"""
+
+import contextlib
+import csv
+import glob
+import importlib
+import io
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import gestore_modelli
+
+# (chiave della misura, intestazione CSV, formato console)
+METRICHE = [
+    ('caricamento_dataset_s', 'Caricamento Dataset (s)', '{:.3f}'),
+    ('ricerca_s', 'Ricerca Iperparametri (s)', '{:.3f}'),
+    ('n_fit', 'Fit Eseguiti', '{:.0f}'),
+    ('fit_medio_s', 'Fit Medio (s)', '{:.4f}'),
+    ('score_medio_s', 'Score Medio (s)', '{:.4f}'),
+    ('retrain_s', 'Retrain Finale (s)', '{:.3f}'),
+    ('totale_s', 'Train and Test (s)', '{:.3f}'),
+    ('artefatti_kb', 'Artefatti (KB)', '{:.1f}'),
+    ('caricamento_modello_s', 'Caricamento Modello (s)', '{:.4f}'),
+    ('picco_rss_mb', 'Picco RSS (MB)', '{:.1f}'),
+]
+
+# file di input del progetto che train_and_test legge con percorsi relativi: resi assoluti
+# prima di spostarsi nella cartella temporanea, così si misura lo stesso modello di --find_models
+INPUT_PROGETTO = [
+    ('globale_train_and_test', 'FILE_ANAGRAFICA'),
+]
+
+
+def _misura_coppia(percorso_dataset, target_column, localita, nome_modello, anno_test, ricerca, retrain):
+    # Eseguita in un processo dedicato: restituisce il dizionario delle misure di una coppia
+    import resource
+    import joblib
+    import modelli_compatti
+    import regressione_incrementale
+    import retrain_finale
+    import ricerca_iperparametri
+    from dati.gestore import carica_dataset_per_citta
+
+    t_start = time.perf_counter()
+    dataset = carica_dataset_per_citta(os.path.abspath(percorso_dataset), target_column)
+    caricamento_dataset = time.perf_counter() - t_start
+
+    modulo = gestore_modelli.modulo_modello(nome_modello)
+    for nome_modulo, attributo in INPUT_PROGETTO:
+        modulo_input = importlib.import_module(nome_modulo)
+        setattr(modulo_input, attributo, os.path.abspath(getattr(modulo_input, attributo)))
+    cartella_progetto = os.getcwd()
+    cartella = tempfile.mkdtemp(prefix='benchmark_training_')
+    os.chdir(cartella)
+    try:
+        t_start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            modulo.train_and_test(dataset, target_column, localita, anno_test, ricerca=ricerca, retrain=retrain)
+        totale = time.perf_counter() - t_start
+
+        artefatti = sorted(glob.glob('modelli/*'))
+        t_start = time.perf_counter()
+        for artefatto in artefatti:
+            if artefatto == regressione_incrementale.FILE_STATO.format(localita):
+                regressione_incrementale.carica_stato(localita)
+            elif artefatto.endswith(modelli_compatti.ESTENSIONE):
+                modelli_compatti.carica(artefatto)
+            else:
+                joblib.load(artefatto)
+        caricamento_modello = time.perf_counter() - t_start
+        dimensione = sum(os.path.getsize(artefatto) for artefatto in artefatti)
+    finally:
+        os.chdir(cartella_progetto)
+        shutil.rmtree(cartella, ignore_errors=True)
+
+    misura_ricerca = ricerca_iperparametri.ultima_misura()
+    return {
+        'caricamento_dataset_s': caricamento_dataset,
+        'ricerca_s': misura_ricerca.get('tempo_s', float('nan')),
+        'n_fit': misura_ricerca.get('n_fit', float('nan')),
+        'fit_medio_s': misura_ricerca.get('fit_medio_s', float('nan')),
+        'score_medio_s': misura_ricerca.get('score_medio_s', float('nan')),
+        'retrain_s': retrain_finale.ultima_misura().get('tempo_s', float('nan')),
+        'totale_s': totale,
+        'artefatti_kb': dimensione / 1024,
+        'caricamento_modello_s': caricamento_modello,
+        # su Linux ru_maxrss è in KB
+        'picco_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def _mediana_e_scarto(valori):
+    return statistics.median(valori), max(valori) - min(valori)
+
+
+def esegui_benchmark_training(percorso_dataset, target_column, anno_test, tutte_le_citta, n_ripetizioni=3,
+                              output_csv='dati/benchmark_training.csv', ricerca=None, retrain=None):
+    """
+    Esegue il benchmark dell'addestramento su tutte le coppie (città, famiglia)
+    e stampa + salva la tabella.
+
+    Parameters
+    ----------
+    percorso_dataset : CSV del dataset unificato
+    target_column    : colonna da predire
+    anno_test        : anno usato come test (come in --find_models)
+    tutte_le_citta   : città da misurare
+    n_ripetizioni    : ripetizioni di ogni misura (mediana e scarto sulle ripetizioni)
+    output_csv       : nome del file CSV di output
+    ricerca, retrain : configurazione della ricerca e del retrain, come in --find_models
+    """
+    print("=" * 55)
+    print("     BENCHMARK TRAINING — Misura delle coppie città/modello")
+    print("=" * 55)
+
+    # le famiglie multi-città vengono misurate una volta sola, su tutte le città insieme
+    coppie = []
+    for nome_modello in gestore_modelli.MAPPA_MODELLI:
+        if nome_modello in gestore_modelli.FAMIGLIE_MULTI_CITTA:
+            coppie.append((tuple(tutte_le_citta), nome_modello))
+        else:
+            coppie.extend((localita, nome_modello) for localita in tutte_le_citta)
+
+    print(f"\nCoppie da misurare: {len(coppie)} x {n_ripetizioni} ripetizioni\n")
+
+    intestazioni = ['Città', 'Modello', 'Ripetizioni']
+    for _, nome, _ in METRICHE:
+        intestazioni += [f'{nome} Mediana', f'{nome} Scarto']
+
+    sep = "-" * 118
+    print(sep)
+    print(f"{'Città':<22} {'Modello':<18} | {'Dataset(s)':>10} {'Ricerca(s)':>10} {'Fit':>5} "
+          f"{'Fit(s)':>8} {'Retrain(s)':>10} {'Totale(s)':>10} {'KB':>9} {'Load(s)':>8} {'RSS(MB)':>8}")
+    print(sep)
+
+    righe = []
+    for localita, nome_modello in coppie:
+        misure = []
+        for _ in range(n_ripetizioni):
+            # un processo nuovo per ogni misura: memoria e cache non si trascinano tra le ripetizioni
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                misure.append(executor.submit(
+                    _misura_coppia, percorso_dataset, target_column,
+                    list(localita) if isinstance(localita, tuple) else localita,
+                    nome_modello, anno_test, ricerca, retrain
+                ).result())
+
+        aggregate = {chiave: _mediana_e_scarto([m[chiave] for m in misure]) for chiave, _, _ in METRICHE}
+        nome_citta = ' | '.join(localita) if isinstance(localita, tuple) else localita
+
+        m = {chiave: valore[0] for chiave, valore in aggregate.items()}
+        print(f"{nome_citta[:22]:<22} {nome_modello:<18} | {m['caricamento_dataset_s']:>10.3f} "
+              f"{m['ricerca_s']:>10.3f} {m['n_fit']:>5.0f} {m['fit_medio_s']:>8.4f} {m['retrain_s']:>10.3f} "
+              f"{m['totale_s']:>10.3f} {m['artefatti_kb']:>9.1f} {m['caricamento_modello_s']:>8.4f} "
+              f"{m['picco_rss_mb']:>8.1f}")
+
+        riga = [nome_citta, nome_modello, n_ripetizioni]
+        for chiave, _, formato in METRICHE:
+            mediana, scarto = aggregate[chiave]
+            riga += [formato.format(mediana), formato.format(scarto)]
+        righe.append(riga)
+
+    print(sep)
+    print("\nValori mediani sulle ripetizioni; nel CSV anche lo scarto (massimo - minimo).")
+
+    os.makedirs(os.path.dirname(output_csv) or '.', exist_ok=True)
+    with open(output_csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(intestazioni)
+        writer.writerows(righe)
+
+    print(f"\nRisultati salvati in '{output_csv}'")
@@ -2,22 +2,81 @@ import pandas as pd
 import numpy as np
 import joblib
 import os
+import sys
 import math
-import matplotlib.pyplot as plt
-from datetime import datetime
-import calendar
-from dati.gestore import leggi_tmedia
-
+from datetime import datetime, date, timedelta
+from dati.gestore import leggi_tmedia, features_anno, dati_localita, COLONNE_FEATURES
+import registro_modelli
+import modelli_compatti
+import cache_cv
+import ricerca_iperparametri
+import retrain_finale
+
+import time
 import xgboost as xgb
-from sklearn.model_selection import GridSearchCV, TimeSeriesSplit
+from sklearn.model_selection import ParameterGrid, TimeSeriesSplit
 from sklearn.metrics import root_mean_squared_error
 
-
-def train_and_test(dataset, target_column, localita, anno_test):
+# Griglia degli iperparametri (usata anche per l'impronta del manifest di training).
+# n_estimators non è nella griglia: per ogni combinazione viene scelto con l'early stopping.
+PARAM_GRID = {
+    'max_depth': [3, 6, 10],
+    'learning_rate': [0.01, 0.1, 0.2],
+    'subsample': [0.8, 1.0]
+}
+
+MAX_ROUND = 1000          # round massimi per la scelta di n_estimators
+ROUND_EARLY_STOPPING = 50  # round senza miglioramenti sul fold di validazione prima di fermarsi
+TREE_METHOD = 'hist'      # costruzione degli alberi su istogrammi
+
+
+def round_early_stopping(xgb_model, param_grid, X_train, y_train, tscv):
+    """
+    Per ogni combinazione della griglia sceglie n_estimators con l'early stopping,
+    addestrando sui fold di training dell'ultimo split di 'tscv' e validando
+    sull'ultimo fold (il più recente, come nei test sull'anno successivo).
+
+    L'ultimo fold è riservato all'early stopping e non viene mai valutato dalla
+    cross-validation, altrimenti l'RMSE medio della CV sarebbe ottimistico: gli
+    split restituiti sono quelli di 'tscv' sulle sole righe che lo precedono
+    (il modello migliore è comunque riaddestrato su tutto X_train).
+    Restituisce (griglia come lista di combinazioni con n_estimators fissato, split della CV).
+    """
+    idx_train, idx_val = list(tscv.split(X_train))[-1]
+    # idx_train sono le prime righe di X_train: gli split su di esse valgono anche come posizioni in X_train
+    split_cv = list(tscv.split(X_train.iloc[idx_train]))
+    X_fit, y_fit = X_train.iloc[idx_train], y_train.iloc[idx_train]
+    X_val, y_val = X_train.iloc[idx_val], y_train.iloc[idx_val]
+
+    def round_migliori(parametri):
+        modello = xgb.XGBRegressor(**{
+            **xgb_model.get_params(),
+            **parametri,
+            'n_estimators': MAX_ROUND,
+            'early_stopping_rounds': ROUND_EARLY_STOPPING,
+        })
+        modello.fit(X_fit, y_fit, eval_set=[(X_val, y_val)], verbose=False)
+        return modello.best_iteration + 1
+
+    # i round già scelti in un --find_models precedente (stessi dati e parametri) vengono riusati
+    combinazioni = list(ParameterGrid(param_grid))
+    etichetta = f'early_stopping|{tscv.get_n_splits()}|{MAX_ROUND}|{ROUND_EARLY_STOPPING}'
+    n_round = cache_cv.valori_memorizzati(xgb_model, X_train, y_train, etichetta, combinazioni, round_migliori)
+
+    griglia = [{**{k: [v] for k, v in parametri.items()}, 'n_estimators': [n]}
+               for parametri, n in zip(combinazioni, n_round)]
+    return griglia, split_cv
+
+
+def train_and_test(dataset, target_column, localita, anno_test, n_thread=-1, ricerca=None, retrain=None):
+    # n_thread: core della coppia (-1 = tutti): thread dello stimatore finale e processi della
+    # ricerca degli iperparametri, dove ogni valutazione usa un solo thread (budget di core rispettato)
+    # ricerca: strategia e budget della ricerca degli iperparametri (vedi ricerca_iperparametri)
+    # retrain: modalità del retrain finale, 'completo' (default), 'warm_start' o 'confronto' (vedi retrain_finale)
     # ===============================
     # 1. CARICAMENTO DATI
     # ===============================
-    df = pd.read_csv(dataset, sep=';')
+    # dataset: percorso del CSV oppure dizionario {localita: DataFrame} di carica_dataset_per_citta
 
     features = [
         'ANNO',
@@ -26,7 +85,7 @@ def train_and_test(dataset, target_column, localita, anno_test):
         'TEMPERATURA_MEDIA_ANNO_PRECEDENTE'
     ]
 
-    df_clean = df.dropna(subset=['LOCALITA'] + features + [target_column])
+    df_clean = dati_localita(dataset, target_column, localita)
 
     # ===============================
     # 2. SPLIT TEMPORALE
@@ -46,30 +105,27 @@ def train_and_test(dataset, target_column, localita, anno_test):
     # ===============================
     # 3. GRID SEARCH
     # ===============================
-    param_grid = {
-        'n_estimators': [100, 300],
-        'max_depth': [3, 6, 10],
-        'learning_rate': [0.01, 0.1, 0.2],
-        'subsample': [0.8, 1.0]
-    }
+    param_grid = PARAM_GRID
 
     xgb_model = xgb.XGBRegressor(
         objective='reg:squarederror',
-        random_state=42
+        tree_method=TREE_METHOD,
+        random_state=42,
+        n_jobs=n_thread
     )
 
     tscv = TimeSeriesSplit(n_splits=5)
 
-    grid_search = GridSearchCV(
-        xgb_model,
-        param_grid,
-        cv=tscv,
-        scoring='neg_root_mean_squared_error',
-        n_jobs=-1
-    )
+    # n_estimators di ogni combinazione scelto con l'early stopping sull'ultimo fold,
+    # che resta fuori dagli split valutati dalla ricerca
+    t_start = time.perf_counter()
+    param_grid, split_cv = round_early_stopping(xgb_model, param_grid, X_train, y_train, tscv)
+    print(f"   - [XGBoost] Round scelti con early stopping in {time.perf_counter() - t_start:.2f} s")
 
     print("   - [XGBoost] Addestramento con TimeSeriesSplit iniziato.")
-    grid_search.fit(X_train, y_train)
+    # n_estimators è già fissato per ogni combinazione: il successive halving usa le righe come risorsa
+    grid_search = ricerca_iperparametri.esegui_ricerca(xgb_model, param_grid, X_train, y_train, split_cv, ricerca,
+                                                       n_jobs=n_thread)
     print("   - [XGBoost] Addestramento completato.")
 
     best_model = grid_search.best_estimator_
@@ -95,8 +151,10 @@ def train_and_test(dataset, target_column, localita, anno_test):
     # -----------------------------------------------------------------------
     # Salvataggio parametri
     results_df = pd.DataFrame(grid_search.cv_results_)
-    colonne_interessanti = [col for col in results_df.columns if 'param_' in col or 'mean_test_score' in col or 'rank_test_score' in col]
-    results_df = results_df[colonne_interessanti]
+    # tempo medio di fit per fold (i round scelti con l'early stopping sono in param_n_estimators)
+    results_df['TEMPO_FIT_MEDIO_S'] = results_df['mean_fit_time']
+    colonne_interessanti = [col for col in results_df.columns if 'param_' in col or 'mean_test_score' in col]
+    results_df = results_df[colonne_interessanti + ['TEMPO_FIT_MEDIO_S']]
     results_df['mean_test_score'] = -results_df['mean_test_score']
     results_df = results_df.rename(columns={'mean_test_score': 'RMSE_medio_CV'})
     results_df[f'RMSE_Test_{anno_test}'] = np.nan
@@ -143,24 +201,34 @@ def train_and_test(dataset, target_column, localita, anno_test):
     X_final = final_train_df[features]
     y_final = final_train_df[target_column]
 
-    final_model = xgb.XGBRegressor(
-        objective='reg:squarederror',
-        random_state=42,
-        **grid_search.best_params_
+    final_model = retrain_finale.riaddestra(
+        grid_search,
+        lambda: xgb.XGBRegressor(
+            objective='reg:squarederror',
+            tree_method=TREE_METHOD,
+            random_state=42,
+            n_jobs=n_thread,
+            **grid_search.best_params_
+        ),
+        X_final,
+        y_final,
+        final_train_df['ANNO'] == anno_test,
+        retrain
     )
 
-    final_model.fit(X_final, y_final)
-
     os.makedirs('modelli', exist_ok=True)
     joblib.dump(final_model, f'modelli/modello_xgboost_{localita}.pkl')
     print(f"   --> Modello salvato come 'modello_xgboost_{localita}.pkl'")
 
+    # Esportazione nel formato compatto (array NumPy) usato per l'inferenza
+    modelli_compatti.esporta(final_model, f'modelli/modello_xgboost_{localita}.pkl')
+    print(f"   --> Esportato il formato compatto 'modello_xgboost_{localita}.npz'")
+
     # Restituisce sia RMSE che deviazione standard dei residui
     return round(rmse, 3), round(dev_standard, 3)
 
 
-def usa_modello(localita):
-    anno = 2026
+def usa_modello(localita, anno=2026):
     print(f"  - Località: {localita}")
     print(f"  - Anno della previsione: {anno}")
 
@@ -179,9 +247,9 @@ def usa_modello(localita):
 
 def predici(localita, anno, mese, giorno, temp_anno_prec):
     try:
-        modello = joblib.load(f'modelli/modello_xgboost_{localita}.pkl')
+        modello = registro_modelli.carica_modello(modelli_compatti.percorso_preferito(f'modelli/modello_xgboost_{localita}.pkl'))
     except FileNotFoundError:
-        print("Errore: Modello non trovato. Eseguire prima il training.")
+        print("Errore: Modello non trovato. Eseguire prima il training.", file=sys.stderr)
         return
 
     try:
@@ -200,11 +268,34 @@ def predici(localita, anno, mese, giorno, temp_anno_prec):
     return float(modello.predict(input_data)[0])
 
 
+def predizione_annuale_array(localita, anno, temp_anno_prec=None):
+    """
+    Predice la temperatura media di tutti i giorni dell'anno con un'unica
+    chiamata a predict. Restituisce un array indicizzato per giorno dell'anno
+    (indice 0 = 1 gennaio), oppure None se il modello non è disponibile.
+    'temp_anno_prec' (un valore per giorno di 'anno') sostituisce la temperatura
+    dell'ultimo anno osservato come feature TEMPERATURA_MEDIA_ANNO_PRECEDENTE.
+    """
+    try:
+        modello = registro_modelli.carica_modello(modelli_compatti.percorso_preferito(f'modelli/modello_xgboost_{localita}.pkl'))
+    except FileNotFoundError:
+        print("Errore: Modello non trovato. Eseguire prima il training.", file=sys.stderr)
+        return None
+
+    input_data = pd.DataFrame(features_anno(localita, anno, temp_anno_prec), columns=COLONNE_FEATURES)
+    input_data['ANNO'] = input_data['ANNO'].astype(int)
+
+    return modello.predict(input_data).astype(float)
+
+
 def predizione_annuale(localita, anno):
     risultato = {}
-    for mese in range(1, 13):
-        giorni_nel_mese = calendar.monthrange(anno, mese)[1]
-        for giorno in range(1, giorni_nel_mese + 1):
-            valore = predici(localita, anno, mese, giorno, leggi_tmedia(localita, mese, giorno))
-            risultato[(mese, giorno)] = valore
-    return risultato
\ No newline at end of file
+    predizioni = predizione_annuale_array(localita, anno)
+    if predizioni is None:
+        return risultato
+
+    data_corrente = date(anno, 1, 1)
+    for valore in predizioni:
+        risultato[(data_corrente.month, data_corrente.day)] = float(valore)
+        data_corrente += timedelta(days=1)
+    return risultato